@@ -0,0 +1,210 @@
+from datetime import date, datetime, timedelta
+from sqlalchemy import delete, exists, insert, select, update
+from models import db, Inventory, InventoryAlert
+from thresholds import (
+    expiring_filter,
+    expiry_transition,
+    low_stock_filter,
+    low_stock_transition,
+)
+
+# Days before today the expiry scan still looks at, so a few missed runs do
+# not lose alerts
+EXPIRY_SCAN_LOOKBACK_DAYS = 7
+
+
+# Move an item's alert of one kind into the raised or cleared state, pending
+# the next digest
+def set_alert(inventory_id, material, kind, active, total_litres, best_before_date):
+    if isinstance(best_before_date, str):
+        best_before_date = date.fromisoformat(best_before_date)
+    values = {
+        "material": material,
+        "active": active,
+        "total_litres": total_litres,
+        "best_before_date": best_before_date,
+        "changed_at": datetime.utcnow(),
+        "notified_at": None,
+    }
+    result = db.session.execute(
+        update(InventoryAlert)
+        .where(InventoryAlert.inventory_id == inventory_id, InventoryAlert.kind == kind)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0 and active:
+        db.session.execute(
+            insert(InventoryAlert).values(
+                inventory_id=inventory_id, kind=kind, **values
+            )
+        )
+
+
+# Update alert states for changed items, given as (before, after) item
+# states. Only crossings touch the table, and the written item row is
+# locked until the commit, so concurrent changes cannot race here.
+def apply_alert_changes(changes):
+    removed = []
+    for before, after in changes:
+        if after is None:
+            removed.append(before.inventory_id)
+            continue
+        for kind, change in (
+            ("low_stock", low_stock_transition(before, after)),
+            ("expiry", expiry_transition(before, after)),
+        ):
+            if change:
+                set_alert(
+                    after.inventory_id,
+                    after.material,
+                    kind,
+                    change == "raised",
+                    after.total_litres,
+                    after.best_before_date,
+                )
+    if removed:
+        # Deleted items have nothing left to alert about
+        db.session.execute(
+            delete(InventoryAlert).where(InventoryAlert.inventory_id.in_(removed))
+        )
+
+
+# Raise expiry alerts for items that have moved into their expiring soon
+# window with the passing of time. Only the window is read, through the best
+# before date index, and items already alerted are skipped.
+def scan_expiring(today=None):
+    today = today or date.today()
+    alerted = (
+        select(InventoryAlert.id)
+        .where(
+            InventoryAlert.inventory_id == Inventory.id,
+            InventoryAlert.kind == "expiry",
+            InventoryAlert.active.is_(True),
+        )
+        .correlate(Inventory)
+    )
+    rows = db.session.execute(
+        expiring_filter(
+            select(
+                Inventory.id,
+                Inventory.material,
+                Inventory.total_litres,
+                Inventory.best_before_date,
+            ).where(
+                Inventory.best_before_date
+                >= today - timedelta(days=EXPIRY_SCAN_LOOKBACK_DAYS),
+                ~exists(alerted),
+            ),
+            today,
+        )
+    ).all()
+    for row in rows:
+        set_alert(
+            row.id,
+            row.material,
+            "expiry",
+            True,
+            row.total_litres,
+            row.best_before_date,
+        )
+    db.session.commit()
+    return len(rows)
+
+
+# Bring every alert in line with the current threshold rules, after they
+# change: items now in a state get raised alerts, and active alerts of items
+# no longer in it are cleared
+def sync_alerts(today=None):
+    for kind, in_state in (
+        ("low_stock", low_stock_filter(select(Inventory.id))),
+        ("expiry", expiring_filter(select(Inventory.id), today)),
+    ):
+        alerted = select(InventoryAlert.inventory_id).where(
+            InventoryAlert.kind == kind, InventoryAlert.active.is_(True)
+        )
+        items = select(
+            Inventory.id,
+            Inventory.material,
+            Inventory.total_litres,
+            Inventory.best_before_date,
+        )
+        for active, condition in (
+            (True, (Inventory.id.in_(in_state), Inventory.id.not_in(alerted))),
+            (False, (Inventory.id.in_(alerted), Inventory.id.not_in(in_state))),
+        ):
+            for row in db.session.execute(items.where(*condition)).all():
+                set_alert(
+                    row.id,
+                    row.material,
+                    kind,
+                    active,
+                    row.total_litres,
+                    row.best_before_date,
+                )
+    db.session.commit()
+
+
+# Alert state changes not yet sent in a digest, up to the given time
+def pending_alerts(until):
+    return db.session.execute(
+        select(
+            InventoryAlert.id,
+            InventoryAlert.kind,
+            InventoryAlert.active,
+            InventoryAlert.material,
+            InventoryAlert.total_litres,
+            InventoryAlert.best_before_date,
+            Inventory.product_name,
+            Inventory.location,
+        )
+        .outerjoin(Inventory, Inventory.id == InventoryAlert.inventory_id)
+        .where(
+            InventoryAlert.notified_at.is_(None),
+            InventoryAlert.changed_at <= until,
+        )
+        .order_by(
+            InventoryAlert.kind,
+            InventoryAlert.active.desc(),
+            InventoryAlert.changed_at,
+        )
+    ).all()
+
+
+# Plain text digest of alert state changes
+def digest_text(alerts):
+    sections = (
+        ("low_stock", True, "Products that dropped to their low stock threshold:"),
+        ("low_stock", False, "Products restocked above their threshold:"),
+        ("expiry", True, "Products now inside their expiry window:"),
+        ("expiry", False, "Products no longer expiring soon:"),
+    )
+    lines = ["Inventory alert changes since the last digest.", ""]
+    for kind, active, heading in sections:
+        matching = [
+            alert for alert in alerts if alert.kind == kind and alert.active == active
+        ]
+        if not matching:
+            continue
+        lines.append(heading)
+        lines.extend(
+            f"- {alert.product_name} (Material: {int(alert.material)}, "
+            f"Location: {alert.location}): {alert.total_litres} litres, "
+            f"best before {alert.best_before_date:%Y-%m-%d}"
+            for alert in matching
+        )
+        lines.append("")
+    return "\n".join(lines)
+
+
+# Mark alerts as sent, unless they changed again since they were read
+def mark_notified(alerts, until):
+    db.session.execute(
+        update(InventoryAlert)
+        .where(
+            InventoryAlert.id.in_([alert.id for alert in alerts]),
+            InventoryAlert.changed_at <= until,
+        )
+        .values(notified_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
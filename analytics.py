@@ -0,0 +1,147 @@
+from datetime import date, datetime, timedelta
+from sqlalchemy import Date, func, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.sql.visitors import InternalTraversal
+from models import db, Inventory, InventoryTransaction
+
+PERIODS = ("day", "week", "month")
+
+# Most buckets a report may span, which bounds the response size
+MAX_BUCKETS = 1000
+
+# Latest end date a report may have. The bucket after the last is worked
+# out, and a month step adds up to 32 days.
+MAX_END_DATE = date.max - timedelta(days=32)
+
+# Columns consumption can be grouped by
+GROUP_COLUMNS = {
+    "product": Inventory.product_name,
+    "location": Inventory.location,
+}
+
+
+# First day of the day, week (Monday) or month containing a timestamp,
+# compiled to the date functions of each database
+class date_bucket(FunctionElement):
+    type = Date()
+    inherit_cache = True
+    # The period changes the SQL, so it is part of the statement cache key
+    _traverse_internals = FunctionElement._traverse_internals + [
+        ("period", InternalTraversal.dp_string)
+    ]
+
+    def __init__(self, period, column):
+        self.period = period
+        super().__init__(column)
+
+
+@compiles(date_bucket)
+def compile_date_bucket(element, compiler, **kw):
+    column = compiler.process(list(element.clauses)[0], **kw)
+    if element.period == "week":
+        return f"DATE({column}, 'weekday 0', '-6 days')"
+    if element.period == "month":
+        return f"DATE({column}, 'start of month')"
+    return f"DATE({column})"
+
+
+@compiles(date_bucket, "mysql")
+def compile_date_bucket_mysql(element, compiler, **kw):
+    column = compiler.process(list(element.clauses)[0], **kw)
+    if element.period == "week":
+        return f"DATE(DATE_SUB({column}, INTERVAL WEEKDAY({column}) DAY))"
+    if element.period == "month":
+        return f"DATE(DATE_FORMAT({column}, '%%Y-%%m-01'))"
+    return f"DATE({column})"
+
+
+# Quantity taken per bucket (and group) between two dates, summed in SQL
+def consumption_statement(start_date, end_date, period="day", group_by=None):
+    bucket = date_bucket(period, InventoryTransaction.date_taken).label("bucket")
+    columns = [bucket]
+    if group_by:
+        columns.append(GROUP_COLUMNS[group_by].label("group"))
+    statement = select(
+        *columns, func.sum(InventoryTransaction.quantity_taken).label("quantity")
+    ).where(
+        InventoryTransaction.date_taken >= start_date,
+        InventoryTransaction.date_taken < end_date + timedelta(days=1),
+    )
+    if group_by:
+        statement = statement.join(
+            Inventory, InventoryTransaction.inventory_id == Inventory.id
+        )
+    return statement.group_by(*columns).order_by(*columns)
+
+
+# Start date of the bucket containing a date
+def bucket_start(day, period):
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+
+# Number of buckets between two dates, counted without building them
+def bucket_count(start_date, end_date, period):
+    start = bucket_start(start_date, period)
+    if period == "month":
+        return (end_date.year - start.year) * 12 + end_date.month - start.month + 1
+    return (end_date - start).days // (7 if period == "week" else 1) + 1
+
+
+# Every bucket between two dates, so quiet periods show up as zero
+def bucket_range(start_date, end_date, period):
+    buckets = []
+    current = bucket_start(start_date, period)
+    while current <= end_date:
+        buckets.append(current)
+        if period == "month":
+            current = (current + timedelta(days=32)).replace(day=1)
+        else:
+            current += timedelta(days=7 if period == "week" else 1)
+    return buckets
+
+
+# Rolling mean of each series using pandas
+def rolling_averages(series, window):
+    import pandas as pd
+
+    frame = pd.DataFrame({index: item["totals"] for index, item in enumerate(series)})
+    averages = frame.rolling(window, min_periods=1).mean().round(2)
+    for index, item in enumerate(series):
+        item["rolling_average"] = averages[index].tolist()
+
+
+# Consumption totals per bucket, shaped for charting: one shared list of
+# bucket labels and one list of totals per series
+def consumption_report(start_date, end_date, period="day", group_by=None, rolling=None):
+    buckets = bucket_range(start_date, end_date, period)
+    positions = {bucket: index for index, bucket in enumerate(buckets)}
+
+    series = {}
+    rows = db.session.execute(
+        consumption_statement(start_date, end_date, period, group_by)
+    )
+    for row in rows:
+        bucket = row.bucket
+        if isinstance(bucket, datetime):
+            bucket = bucket.date()
+        key = row.group if group_by else "total"
+        totals = series.setdefault(key, [0.0] * len(buckets))
+        totals[positions[bucket]] = float(row.quantity)
+
+    series = [{"key": key, "totals": totals} for key, totals in series.items()]
+    if rolling and series:
+        rolling_averages(series, rolling)
+
+    return {
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "period": period,
+        "group_by": group_by,
+        "buckets": [bucket.isoformat() for bucket in buckets],
+        "series": series,
+    }
@@ -1,54 +1,130 @@
 # Import necessary libraries and modules
 from flask import (
+    Blueprint,
     Flask,
+    current_app,
     request,
     url_for,
     session,
-    send_file,
     redirect,
     render_template,
     flash,
     jsonify,
+    send_file,
+    send_from_directory,
 )
-import io
-import pandas as pd
+import click
+import hmac
+import time
 from functools import wraps
 from decimal import Decimal
-from models import db, Inventory, User, InventoryTransaction, DeletedInventory
-from itsdangerous import URLSafeTimedSerializer
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
-from pytz import timezone
-from config import (
-    SQLALCHEMY_DATABASE_URI,
-    SECRET_KEY,
-    MAIL_SERVER,
-    MAIL_PORT,
-    MAIL_USE_TLS,
-    MAIL_USERNAME,
-    MAIL_PASSWORD,
-    MAIL_DEFAULT_SENDER,
+from models import (
+    db,
+    Inventory,
+    User,
+    InventoryTransaction,
+    DeletedInventory,
+    ThresholdRule,
+)
+from exports import export_response
+from report_jobs import ReportJobs, FINISHED
+from mail_queue import MailQueue
+from profiling import Profiler
+from inventory_search import (
+    SEARCH_FIELDS,
+    CursorError,
+    reindex_inventory,
+    row_page,
+    search_inventory,
+)
+from events import broker, purge_events, stream
+from db_routing import configure_engines, pool_stats, replica_reads
+from response_cache import response_cache
+from metrics import (
+    CONTENT_TYPE,
+    init_metrics,
+    job_failures,
+    job_seconds,
+    render_metrics,
+)
+from dashboard_counters import (
+    current_version,
+    dashboard_summary,
+    rebuild_counters,
+    summary_etag,
+)
+from inventory_changes import item_state, record_changes
+from alerts import (
+    digest_text,
+    mark_notified,
+    pending_alerts,
+    scan_expiring,
+    sync_alerts,
+)
+from thresholds import (
+    LOW_STOCK_THRESHOLD,
+    EXPIRY_WINDOW_DAYS,
+    ThresholdRuleError,
+    invalidate_rules,
+    delete_rule,
+    rule_json,
+    save_rule,
 )
+from pick_lists import PickListError, take_pick_list, take_stock
+from analytics import (
+    MAX_BUCKETS,
+    MAX_END_DATE,
+    PERIODS,
+    GROUP_COLUMNS,
+    bucket_count,
+    consumption_report,
+)
+from ledger import (
+    MAX_HISTORY_DAYS,
+    record_movement,
+    build_snapshots,
+    inventory_id_for_material,
+    stock_on,
+    stock_history,
+)
+from inventory_lookup import (
+    material_cache,
+    init_material_cache,
+    lookup_material,
+    invalidate_material,
+)
+from reports import (
+    low_inventory_statement,
+    expiring_soon_statement,
+    inventory_levels_statement,
+    inventory_taken_statement,
+    user_activity_statement,
+)
+from itsdangerous import URLSafeTimedSerializer
 from flask_mail import Mail, Message
-from datetime import datetime, timedelta
+from flask_migrate import Migrate, stamp
+from datetime import date, datetime, timedelta
+
+# Extensions are bound to an app by create_app
+mail = Mail()
+migrate = Migrate()
+
+# Background report job store
+report_jobs = ReportJobs()
+
+# Outbound email queue
+mail_queue = MailQueue()
 
-# Initialize Flask app
-app = Flask(__name__)
+# Opt-in profiler for slow requests and scheduled jobs
+profiler = Profiler()
 
-# Configure app with database and mail settings from config.py
-app.config["SQLALCHEMY_DATABASE_URI"] = SQLALCHEMY_DATABASE_URI
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["MAIL_SERVER"] = MAIL_SERVER
-app.config["MAIL_PORT"] = MAIL_PORT
-app.config["MAIL_USE_TLS"] = MAIL_USE_TLS
-app.config["MAIL_USERNAME"] = MAIL_USERNAME
-app.config["MAIL_PASSWORD"] = MAIL_PASSWORD
-app.config["MAIL_DEFAULT_SENDER"] = MAIL_DEFAULT_SENDER
-app.config["SECRET_KEY"] = SECRET_KEY
+# Routes and commands, registered on the app by create_app
+bp = Blueprint("main", __name__, cli_group=None)
 
-# Initialize Flask-Mail and SQLAlchemy
-mail = Mail(app)
-db.init_app(app)
+
+# Serializer for password reset tokens, signed with the app's secret key
+def reset_serializer():
+    return URLSafeTimedSerializer(current_app.config["SECRET_KEY"])
 
 
 # Decorator function to enforce login required for certain routes
@@ -56,15 +132,36 @@ def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if "username" not in session:
-            return redirect(url_for("login"))
+            return redirect(url_for("main.login"))
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+# Whether the logged in user is an admin
+def is_admin():
+    if "username" not in session:
+        return False
+    user = User.query.filter_by(username=session["username"]).first()
+    return user is not None and user.role == "admin"
+
+
+# Decorator function to restrict routes to admins
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if "username" not in session:
+            return redirect(url_for("main.login"))
+        if not is_admin():
+            return jsonify({"error": "Admin access required"}), 403
         return f(*args, **kwargs)
 
     return decorated_function
 
 
 # Route for user login
-@app.route("/login", methods=["GET", "POST"])
-@app.route("/", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
+@bp.route("/", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         username = request.form.get("username")
@@ -72,22 +169,21 @@ def login():
         user = User.query.filter_by(username=username).first()
         if user and user.check_password(password):
             session["username"] = username
-            return redirect(url_for("dashboard"))
+            return redirect(url_for("main.dashboard"))
         else:
             return render_template("index.html", error="Invalid credentials")
     return render_template("index.html")
 
 
-
 # Route for dashboard, accessible only after login
-@app.route("/dashboard")
+@bp.route("/dashboard")
 @login_required
 def dashboard():
     return render_template("dashboard.html")
 
 
 # Route for user registration
-@app.route("/register", methods=["GET", "POST"])
+@bp.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
         username = request.form.get("username")
@@ -108,28 +204,29 @@ def register():
         new_user = User(username=username, email=email, role=role)
         new_user.set_password(password)
         db.session.add(new_user)
-        db.session.commit()
 
-        # Send email notification to the new user
+        # Queue an email notification to the new user, sent once the account
+        # is committed
         msg = Message("Welcome to StockGuard", recipients=[new_user.email])
         msg.body = f"Hello {new_user.username},\n\nThank you for registering at StockGuard. Your account has been successfully created."
-        mail.send(msg)
+        mail_queue.queue(msg)
+        db.session.commit()
 
-        return redirect(url_for("login"))
+        return redirect(url_for("main.login"))
 
     return render_template("register.html")
 
 
 # Route for user logout
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
     # Clear the session to log the user out
     session.clear()
-    return redirect(url_for("login"))
+    return redirect(url_for("main.login"))
 
 
 # Route to request password reset
-@app.route("/request_password_reset", methods=["POST"])
+@bp.route("/request_password_reset", methods=["POST"])
 def request_password_reset():
     # Get the email from the form
     email = request.form.get("email")
@@ -141,14 +238,15 @@ def request_password_reset():
         return render_template("password_reset.html", error="User not found")
 
     # Generate a password reset token
-    token = serializer.dumps(user.email, salt="password-reset-salt")
+    token = reset_serializer().dumps(user.email, salt="password-reset-salt")
     # Create a password reset URL
-    reset_url = url_for("reset_password", token=token, _external=True)
+    reset_url = url_for("main.reset_password", token=token, _external=True)
 
-    # Send a password reset email to the user
+    # Queue a password reset email to the user
     msg = Message("Password Reset Request", recipients=[user.email])
     msg.body = f"Hello {user.username},\n\nPlease click the link to reset your password: {reset_url}"
-    mail.send(msg)
+    mail_queue.queue(msg)
+    db.session.commit()
 
     # Inform the user that a password reset link has been sent
     return render_template(
@@ -157,11 +255,13 @@ def request_password_reset():
 
 
 # Route to reset password
-@app.route("/reset_password/<token>", methods=["POST"])
+@bp.route("/reset_password/<token>", methods=["POST"])
 def reset_password(token):
     try:
         # Verify the token and get the email
-        email = serializer.loads(token, salt="password-reset-salt", max_age=3600)
+        email = reset_serializer().loads(
+            token, salt="password-reset-salt", max_age=3600
+        )
     except:
         # If token is invalid or expired, return an error
         return render_template(
@@ -175,13 +275,13 @@ def reset_password(token):
     # Set the new password for the user
     user.set_password(password)
 
-    # Commit the changes to the database
-    db.session.commit()
-
-    # Send a confirmation email to the user
+    # Queue a confirmation email to the user
     msg = Message("Password Reset Successful", recipients=[user.email])
     msg.body = f"Hello {user.username},\n\nYour password has been reset successfully."
-    mail.send(msg)
+    mail_queue.queue(msg)
+
+    # Commit the changes to the database
+    db.session.commit()
 
     # Inform the user that the password has been reset
     return render_template(
@@ -190,7 +290,7 @@ def reset_password(token):
 
 
 # Route to update user profile
-@app.route("/update_profile", methods=["GET", "POST"])
+@bp.route("/update_profile", methods=["GET", "POST"])
 @login_required
 def update_profile():
     # Get the current user's information
@@ -203,34 +303,84 @@ def update_profile():
         if password:
             # Set the new password if provided
             user.set_password(password)
-        # Commit the changes to the database
-        db.session.commit()
-        # Send a confirmation email to the user
+        # Queue a confirmation email to the user
         msg = Message("Profile Update Successful", recipients=[user.email])
         msg.body = (
             f"Hello {user.username},\n\nYour profile has been updated successfully."
         )
-        mail.send(msg)
+        mail_queue.queue(msg)
+        # Commit the changes to the database
+        db.session.commit()
 
         # Redirect to the dashboard
-        return redirect(url_for("dashboard"))
+        return redirect(url_for("main.dashboard"))
     # Render the profile update template
     return render_template("update_profile.html", user=user)
 
 
 # Routes for Inventory Management
 # Route to view full inventory
-@app.route("/view_full_inventory", methods=["GET"])
+@bp.route("/view_full_inventory", methods=["GET"])
 @login_required
+@replica_reads
 def view_full_inventory():
-    # Query all inventory items
-    inventory_items = Inventory.query.all()
-    # Render the HTML template and pass the inventory items to it
-    return render_template("full_inventory.html", inventory_items=inventory_items)
+    # Render an empty table; the rows are loaded from /inventory/rows as the
+    # user scrolls
+    return render_template("full_inventory.html")
+
+
+# Prepare a row of a lazy-loaded table for a JSON response
+def row_json(row):
+    return {
+        name: (
+            value.isoformat()
+            if isinstance(value, (date, datetime))
+            else str(value) if isinstance(value, Decimal) else value
+        )
+        for name, value in row._mapping.items()
+    }
+
+
+# One page of a table for the lazy-loaded pages, with only the requested
+# fields and an opaque cursor to the next page
+def rows_response(model):
+    fields = [
+        field.strip()
+        for field in request.args.get("fields", "").split(",")
+        if field.strip()
+    ]
+    try:
+        page = row_page(
+            model,
+            fields,
+            request.args.get("cursor"),
+            request.args.get("per_page", 50, type=int),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(
+        {"items": [row_json(row) for row in page["items"]], "next": page["next"]}
+    )
+
+
+# Route to page through inventory rows (JSON)
+@bp.route("/inventory/rows", methods=["GET"])
+@login_required
+@replica_reads
+def get_inventory_rows():
+    return rows_response(Inventory)
+
+
+# Route to page through deleted inventory rows (JSON)
+@bp.route("/deleted_inventory/rows", methods=["GET"])
+@login_required
+@replica_reads
+def get_deleted_inventory_rows():
+    return rows_response(DeletedInventory)
 
 
 # Route to add inventory
-@app.route("/add_inventory", methods=["GET", "POST"])
+@bp.route("/add_inventory", methods=["GET", "POST"])
 @login_required
 def add_inventory():
     if request.method == "POST":
@@ -248,16 +398,20 @@ def add_inventory():
             # Validate input values
             if not material or not product_name or total_litres <= 0:
                 flash("Invalid input values. Please check your entries.", "error")
-                return redirect(url_for("add_inventory"))
+                return redirect(url_for("main.add_inventory"))
 
             # Check if the inventory item already exists
             existing_inventory = Inventory.query.filter_by(material=material).first()
             if existing_inventory:
                 # Update existing inventory
+                previous_state = item_state(existing_inventory)
                 existing_inventory.total_litres += total_litres
                 existing_inventory.date_received = date_received
                 existing_inventory.best_before_date = best_before_date
                 existing_inventory.location = location
+                record_movement(existing_inventory, "receipt", total_litres)
+                reindex_inventory(existing_inventory.id)
+                record_changes((previous_state, item_state(existing_inventory)))
             else:
                 # Add new inventory item
                 new_inventory = Inventory(
@@ -269,65 +423,114 @@ def add_inventory():
                     location=location,
                 )
                 db.session.add(new_inventory)
+                # Flush to assign the new item's id before logging the receipt
+                db.session.flush()
+                record_movement(new_inventory, "receipt", total_litres)
+                reindex_inventory(new_inventory.id)
+                record_changes((None, item_state(new_inventory)))
 
             # Commit the changes to the database
             db.session.commit()
+            invalidate_material(material)
             flash("Inventory added successfully!", "success")
-            return redirect(url_for("dashboard"))
+            return redirect(url_for("main.dashboard"))
         except Exception as e:
             # Rollback the transaction in case of error
             db.session.rollback()
             flash(f"An error occurred: {str(e)}", "error")
-            return redirect(url_for("add_inventory"))
+            return redirect(url_for("main.add_inventory"))
     # Render the add inventory template
     return render_template("add_inventory.html")
 
 
+# Route to bulk import inventory from a CSV or Excel upload
+@bp.route("/inventory/import", methods=["POST"])
+@login_required
+def import_inventory_file():
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        return jsonify({"error": "No file uploaded"}), 400
+    # pandas is only loaded once a file is imported
+    from bulk_import import ImportFileError, import_inventory
+
+    try:
+        report = import_inventory(
+            upload.stream,
+            upload.filename,
+            current_app.config.get("IMPORT_CHUNK_SIZE", 1000),
+        )
+    except ImportFileError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(report)
+
+
 # Route to take inventory
-@app.route("/take_inventory", methods=["GET", "POST"])
+@bp.route("/take_inventory", methods=["GET", "POST"])
 @login_required
 def take_inventory():
     if request.method == "POST":
         # Get material code and quantity to take from the form
         material_code = request.form["material"]
         quantity_to_take = int(request.form["quantity"])
-        inventory_item = Inventory.query.filter_by(material=material_code).first()
+        # Resolve the material code through the lookup cache
+        cached_item = lookup_material(material_code)
 
         # Check if inventory item exists
-        if not inventory_item:
+        if not cached_item:
             flash("Inventory item not found", "danger")
-            return redirect(url_for("take_inventory"))
+            return redirect(url_for("main.take_inventory"))
 
-        # Validate quantity to take
-        if quantity_to_take <= 0 or inventory_item.total_litres < quantity_to_take:
+        if quantity_to_take <= 0:
             flash("Invalid or insufficient quantity", "danger")
-            return redirect(url_for("take_inventory"))
+            return redirect(url_for("main.take_inventory"))
 
-        # Update inventory and create a transaction record
-        inventory_item.total_litres -= quantity_to_take
-        transaction = InventoryTransaction(
-            inventory_id=inventory_item.id, quantity_taken=quantity_to_take
+        # Decrement the stock only if enough is left, then create the
+        # transaction record
+        remaining = take_stock(
+            cached_item["id"], cached_item["material"], quantity_to_take
         )
-        db.session.add(transaction)
+        if remaining is None:
+            db.session.rollback()
+            if db.session.get(Inventory, cached_item["id"]) is None:
+                # The item was deleted since it was cached
+                invalidate_material(material_code)
+                flash("Inventory item not found", "danger")
+            else:
+                flash("Invalid or insufficient quantity", "danger")
+            return redirect(url_for("main.take_inventory"))
         db.session.commit()
+        invalidate_material(material_code)
 
         flash(
-            f"Successfully took {quantity_to_take} litres. Remaining: {inventory_item.total_litres} litres",
+            f"Successfully took {quantity_to_take} litres. Remaining: {remaining} litres",
             "success",
         )
-        return redirect(url_for("take_inventory"))
+        return redirect(url_for("main.take_inventory"))
 
     # Render the take inventory template
     return render_template("take_inventory.html")
 
 
+# Route to take a whole pick list in one transaction
+@bp.route("/take_inventory/batch", methods=["POST"])
+@login_required
+def take_inventory_batch():
+    data = request.get_json(silent=True) or {}
+    try:
+        results = take_pick_list(data.get("lines"))
+    except PickListError as e:
+        # Nothing was taken
+        return jsonify({"errors": e.errors}), 409
+    return jsonify({"taken": results})
+
+
 # Route to get inventory details by material code
-@app.route("/get_inventory_details", methods=["POST"])
+@bp.route("/get_inventory_details", methods=["POST"])
 @login_required
 def get_inventory_details():
     # Get material code from the form
     material_code = request.form["material"]
-    inventory_item = Inventory.query.filter_by(material=material_code).first()
+    inventory_item = lookup_material(material_code)
 
     # Check if inventory item exists
     if not inventory_item:
@@ -336,61 +539,117 @@ def get_inventory_details():
     # Return inventory details as JSON
     return jsonify(
         {
-            "product_name": inventory_item.product_name,
-            "total_litres": inventory_item.total_litres,
-            "date_received": inventory_item.date_received.strftime("%Y-%m-%d"),
-            "best_before_date": inventory_item.best_before_date.strftime("%Y-%m-%d"),
-            "location": inventory_item.location,
+            "product_name": inventory_item["product_name"],
+            "total_litres": inventory_item["total_litres"],
+            "date_received": inventory_item["date_received"].strftime("%Y-%m-%d"),
+            "best_before_date": inventory_item["best_before_date"].strftime("%Y-%m-%d"),
+            "location": inventory_item["location"],
         }
     )
 
 
+# Route to get the dashboard counters, with an ETag for cheap polling
+@bp.route("/dashboard/summary", methods=["GET"])
+@login_required
+def get_dashboard_summary():
+    today = date.today()
+    # Answer unchanged polls from the version counter alone
+    etag = summary_etag(current_version(), today)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        summary = dashboard_summary(today)
+        etag = summary_etag(summary.pop("version"), today)
+        response = jsonify(summary)
+    response.set_etag(etag)
+    # Browsers must revalidate before reusing a cached summary
+    response.cache_control.no_cache = True
+    return response
+
+
+# Route to stream live stock-change, low-stock and expiry events. Each open
+# stream holds a connection, so run the app on gevent workers to serve many.
+@bp.route("/events", methods=["GET"])
+@login_required
+def stream_events():
+    subscription = current_app.extensions["event_relay"].subscribe(
+        request.headers.get("Last-Event-ID", type=int)
+    )
+    if subscription is None:
+        return jsonify({"error": "Too many event streams"}), 503
+    return current_app.response_class(
+        stream(subscription),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # Route to get total inventory count
-@app.route("/inventory/total", methods=["GET"])
+@bp.route("/inventory/total", methods=["GET"])
 @login_required
+@replica_reads
 def get_total_inventory():
     total_products = Inventory.query.count()
     return jsonify(total=total_products)
 
 
-# Route to get inventory with filtering and pagination
-@app.route("/inventory", methods=["GET"])
+# Route to get inventory with filtering and cursor pagination
+@bp.route("/inventory", methods=["GET"])
 @login_required
+@replica_reads
 def get_inventory():
-    query = Inventory.query
-    material = request.args.get("material")
-    product_name = request.args.get("product_name")
-    location = request.args.get("location")
-
-    # Apply filters if provided
-    if material:
-        query = query.filter(Inventory.material.ilike(f"%{material}%"))
-    if product_name:
-        query = query.filter(Inventory.product_name.ilike(f"%{product_name}%"))
-    if location:
-        query = query.filter(Inventory.location.ilike(f"%{location}%"))
-
-    # Pagination settings
-    page = request.args.get("page", 1, type=int)
+    filters = {field: request.args.get(field) for field in SEARCH_FIELDS}
     per_page = request.args.get("per_page", 10, type=int)
+    # Counting every match is optional, as it costs more than the page itself
+    with_total = request.args.get("count", "true").lower() != "false"
 
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-    inventory_items = pagination.items
+    try:
+        page = search_inventory(
+            filters, request.args.get("cursor"), per_page, with_total
+        )
+    except CursorError as e:
+        if request.args.get("format") == "json":
+            return jsonify({"error": str(e)}), 400
+        flash(str(e), "danger")
+        return redirect(url_for("main.get_inventory"))
+
+    if request.args.get("format") == "json":
+        return jsonify(
+            {
+                "items": [
+                    {
+                        "id": item.id,
+                        "material": str(item.material),
+                        "product_name": item.product_name,
+                        "location": item.location,
+                        "total_litres": str(item.total_litres),
+                    }
+                    for item in page["items"]
+                ],
+                "next": page["next"],
+                "prev": page["prev"],
+                "total": page["total"],
+            }
+        )
 
-    # Render the inventory list template with pagination
+    # Render the inventory list template with next/prev links
     return render_template(
-        "inventory_list.html", items=inventory_items, pagination=pagination
+        "inventory_list.html",
+        items=page["items"],
+        page=page,
+        filters={field: term for field, term in filters.items() if term},
+        per_page=per_page,
     )
 
 
 # Route to get inventory details by material code (JSON)
-@app.route("/get_inventory_by_material", methods=["POST"])
+@bp.route("/get_inventory_by_material", methods=["POST"])
 @login_required
 def get_inventory_by_material():
     try:
         # Get material code from the JSON request
         material_code = request.json["material"]
-        inventory_item = Inventory.query.filter_by(material=material_code).first()
+        inventory_item = lookup_material(material_code)
 
         # Check if inventory item exists
         if not inventory_item:
@@ -399,15 +658,15 @@ def get_inventory_by_material():
         # Return inventory details as JSON
         return jsonify(
             {
-                "id": inventory_item.id,
-                "material": inventory_item.material,
-                "product_name": inventory_item.product_name,
-                "total_litres": str(inventory_item.total_litres),
-                "date_received": inventory_item.date_received.strftime("%Y-%m-%d"),
-                "best_before_date": inventory_item.best_before_date.strftime(
+                "id": inventory_item["id"],
+                "material": inventory_item["material"],
+                "product_name": inventory_item["product_name"],
+                "total_litres": str(inventory_item["total_litres"]),
+                "date_received": inventory_item["date_received"].strftime("%Y-%m-%d"),
+                "best_before_date": inventory_item["best_before_date"].strftime(
                     "%Y-%m-%d"
                 ),
-                "location": inventory_item.location,
+                "location": inventory_item["location"],
             }
         )
     except Exception as e:
@@ -415,8 +674,100 @@ def get_inventory_by_material():
         return jsonify({"error": str(e)}), 500
 
 
+# Route to get material lookup cache statistics
+@bp.route("/inventory/lookup_cache", methods=["GET"])
+@login_required
+def material_cache_stats():
+    return jsonify(material_cache.stats())
+
+
+# Route to get connection pool usage and checkout waits for each database
+@bp.route("/db/pool", methods=["GET"])
+@login_required
+def db_pool_stats():
+    return jsonify(pool_stats(db.engines))
+
+
+# Route to scrape request, SQL, export, mail and pool metrics in the
+# Prometheus text format. Open unless METRICS_TOKEN is set.
+@bp.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    token = current_app.config["METRICS_TOKEN"]
+    if token and not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return jsonify({"error": "Unauthorized"}), 401
+    return current_app.response_class(
+        render_metrics(current_app.config["METRICS_DIR"]), content_type=CONTENT_TYPE
+    )
+
+
+# Parse an optional YYYY-MM-DD query parameter. The first and last days of
+# the calendar are refused, as the days around them cannot be computed.
+def date_arg(name, default):
+    value = request.args.get(name)
+    day = datetime.strptime(value, "%Y-%m-%d").date() if value else default
+    if not date.min < day < date.max:
+        raise ValueError(f"{name} is out of range")
+    return day
+
+
+# Route to get the stock of a material at the end of a given day
+@bp.route("/inventory/stock_on", methods=["GET"])
+@login_required
+@replica_reads
+def get_stock_on():
+    inventory_id = inventory_id_for_material(request.args.get("material"))
+    if inventory_id is None:
+        return jsonify({"error": "Inventory item not found"}), 404
+    try:
+        day = date_arg("date", date.today())
+    except ValueError:
+        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
+    return jsonify(
+        {
+            "inventory_id": inventory_id,
+            "date": day.isoformat(),
+            "total_litres": float(stock_on(inventory_id, day)),
+        }
+    )
+
+
+# Route to get the end-of-day stock of a material over a date range
+@bp.route("/inventory/stock_history", methods=["GET"])
+@login_required
+@replica_reads
+def get_stock_history():
+    inventory_id = inventory_id_for_material(request.args.get("material"))
+    if inventory_id is None:
+        return jsonify({"error": "Inventory item not found"}), 404
+    try:
+        end_date = date_arg("end_date", date.today())
+        start_date = date_arg("start_date", end_date - timedelta(days=30))
+    except (ValueError, OverflowError):
+        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
+    if start_date > end_date:
+        return jsonify({"error": "start_date must not be after end_date"}), 400
+    if (end_date - start_date).days >= MAX_HISTORY_DAYS:
+        return (
+            jsonify(
+                {"error": f"The date range spans more than {MAX_HISTORY_DAYS} days"}
+            ),
+            400,
+        )
+
+    history = stock_history(inventory_id, start_date, end_date)
+    return jsonify(
+        {
+            "inventory_id": inventory_id,
+            "dates": [day.isoformat() for day, _ in history],
+            "totals": [float(total) for _, total in history],
+        }
+    )
+
+
 # Route to update inventory
-@app.route("/update_inventory", methods=["GET", "POST"])
+@bp.route("/update_inventory", methods=["GET", "POST"])
 @login_required
 def update_inventory():
     if request.method == "POST":
@@ -426,31 +777,44 @@ def update_inventory():
             inventory_item = Inventory.query.get(inventory_item_id)
             if not inventory_item:
                 flash("Inventory item not found", "error")
-                return redirect(url_for("update_inventory"))
+                return redirect(url_for("main.update_inventory"))
 
             # Confirmation check before updating
             confirm = request.form.get("confirm_update")
             if confirm != "yes":
                 flash("Update cancelled by user.", "info")
-                return redirect(url_for("update_inventory", id=inventory_item_id))
+                return redirect(url_for("main.update_inventory", id=inventory_item_id))
 
             # Update inventory item details
+            previous_material = inventory_item.material
+            previous_state = item_state(inventory_item)
+            previous_total = inventory_item.total_litres
             inventory_item.material = request.form["material"]
             inventory_item.product_name = request.form["product_name"]
             inventory_item.total_litres = Decimal(request.form["total_litres"])
+            # Log a manual stock correction as an adjustment
+            if inventory_item.total_litres != previous_total:
+                record_movement(
+                    inventory_item,
+                    "adjustment",
+                    inventory_item.total_litres - previous_total,
+                )
             inventory_item.date_received = request.form["date_received"]
             inventory_item.best_before_date = request.form["best_before_date"]
             inventory_item.location = request.form["location"]
+            reindex_inventory(inventory_item.id)
+            record_changes((previous_state, item_state(inventory_item)))
 
             # Commit the changes to the database
             db.session.commit()
+            invalidate_material(previous_material, inventory_item.material)
             flash("Inventory item updated successfully!", "success")
         except Exception as e:
             # Rollback the transaction in case of error
             db.session.rollback()
             flash(f"An error occurred: {str(e)}", "error")
         finally:
-            return redirect(url_for("dashboard"))
+            return redirect(url_for("main.dashboard"))
     else:
         # Get inventory item ID from the query parameters
         inventory_item_id = request.args.get("id")
@@ -462,7 +826,7 @@ def update_inventory():
 
 
 # Route to delete inventory item
-@app.route("/delete_inventory", methods=["GET", "POST"])
+@bp.route("/delete_inventory", methods=["GET", "POST"])
 @login_required
 def delete_inventory():
     if request.method == "POST":
@@ -472,7 +836,7 @@ def delete_inventory():
         # Check if the inventory item exists
         if not inventory_item:
             flash("Inventory item not found", "danger")
-            return redirect(url_for("delete_inventory"))
+            return redirect(url_for("main.delete_inventory"))
 
         # Check for related transactions before deleting
         related_transactions = InventoryTransaction.query.filter_by(
@@ -480,7 +844,7 @@ def delete_inventory():
         ).all()
         if related_transactions:
             flash("Cannot delete inventory item with related transactions", "danger")
-            return redirect(url_for("delete_inventory"))
+            return redirect(url_for("main.delete_inventory"))
 
         # Store deleted inventory details for record-keeping
         deleted_inventory = DeletedInventory(
@@ -493,38 +857,38 @@ def delete_inventory():
             location=inventory_item.location,
         )
         db.session.add(deleted_inventory)
+        # Log the removal of any remaining stock
+        record_movement(inventory_item, "delete", -inventory_item.total_litres)
 
         # Delete the inventory item from the database
+        material_code = inventory_item.material
         db.session.delete(inventory_item)
+        reindex_inventory(inventory_item.id)
+        record_changes((item_state(inventory_item), None))
         db.session.commit()
+        invalidate_material(material_code)
         flash("Inventory item deleted successfully and details stored", "success")
-        return redirect(url_for("delete_inventory"))
+        return redirect(url_for("main.delete_inventory"))
 
-    # Get all inventory items for display
-    inventory_items = Inventory.query.all()
-    return render_template("delete_inventory.html", items=inventory_items)
+    # The items to choose from are loaded from /inventory/rows
+    return render_template("delete_inventory.html")
 
 
 # Route to view deleted inventory items
-@app.route("/deleted_inventory", methods=["GET"])
+@bp.route("/deleted_inventory", methods=["GET"])
 @login_required
 def view_deleted_inventory():
-    # Get all deleted inventory items
-    deleted_items = DeletedInventory.query.all()
-    return render_template("deleted_inventory.html", items=deleted_items)
+    # The rows are loaded from /deleted_inventory/rows
+    return render_template("deleted_inventory.html")
 
 
-# Route to get inventory items below a certain threshold
-@app.route("/inventory/below_threshold", methods=["GET"])
-def get_inventory_below_threshold():
-    # Set the threshold for low inventory
-    threshold = 50
-    # Query inventory items below the threshold
-    low_inventory_items = Inventory.query.filter(
-        Inventory.total_litres <= threshold
-    ).all()
-    # Prepare inventory list for JSON response or download
-    inventory_list = [
+# Cache scopes of the results that depend on stock and the threshold rules
+THRESHOLD_SCOPES = ("inventory", "thresholds")
+
+
+# Prepare inventory rows for a JSON response
+def inventory_json(statement):
+    return [
         {
             "id": item.id,
             "material": item.material,
@@ -534,106 +898,145 @@ def get_inventory_below_threshold():
             "best_before_date": item.best_before_date.isoformat(),
             "location": item.location,
         }
-        for item in low_inventory_items
+        for item in db.session.execute(statement)
     ]
 
+
+# Route to get inventory items below a certain threshold
+@bp.route("/inventory/below_threshold", methods=["GET"])
+@replica_reads
+def get_inventory_below_threshold():
     # Check if the request is for a downloadable report
     if request.args.get("download") == "true":
-        # Convert inventory list to a DataFrame and write to an Excel file
-        df = pd.DataFrame(inventory_list)
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            df.to_excel(writer, index=False, sheet_name="Low Inventory")
-        output.seek(0)
-        # Send the Excel file as a downloadable response
-        return send_file(
-            output, as_attachment=True, download_name="low_inventory_report.xlsx"
+        # Stream the matching rows straight into the export file
+        return export_response(
+            low_inventory_statement(),
+            "low_inventory_report",
+            "Low Inventory",
+            request.args.get("format", "xlsx"),
+            cache_scopes=THRESHOLD_SCOPES,
         )
 
-    # Return inventory list as JSON response
-    return jsonify(inventory_list)
+    # Return inventory items at or below their threshold as JSON response
+    return jsonify(
+        response_cache.get_or_build(
+            THRESHOLD_SCOPES, lambda: inventory_json(low_inventory_statement())
+        )
+    )
 
 
 # Route to get inventory items expiring soon
-@app.route("/inventory/expiring_soon", methods=["GET"])
+@bp.route("/inventory/expiring_soon", methods=["GET"])
 @login_required
+@replica_reads
 def get_inventory_expiring_soon():
-    # Calculate the date three months from now
-    three_months_from_now = datetime.now() + timedelta(days=90)
-    # Query inventory items expiring before the calculated date
-    expiring_items = Inventory.query.filter(
-        Inventory.best_before_date <= three_months_from_now
-    ).all()
-    # Prepare inventory list for JSON response or download
-    inventory_list = [
-        {
-            "id": item.id,
-            "material": item.material,
-            "product_name": item.product_name,
-            "total_litres": float(item.total_litres),
-            "date_received": item.date_received.isoformat(),
-            "best_before_date": item.best_before_date.isoformat(),
-            "location": item.location,
-        }
-        for item in expiring_items
-    ]
-
     # Check if the request is for a downloadable report
     if request.args.get("download") == "true":
-        # Convert inventory list to a DataFrame and write to an Excel file
-        df = pd.DataFrame(inventory_list)
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            df.to_excel(writer, index=False, sheet_name="Expiring Soon")
-        output.seek(0)
-        # Send the Excel file as a downloadable response
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name="expiring_soon_report.xlsx",
+        # Stream the matching rows straight into the export file
+        return export_response(
+            expiring_soon_statement(),
+            "expiring_soon_report",
+            "Expiring Soon",
+            request.args.get("format", "xlsx"),
+            cache_scopes=THRESHOLD_SCOPES,
         )
 
-    # Return inventory list as JSON response
-    return jsonify(inventory_list)
+    # Return inventory items inside their expiry window as JSON response
+    return jsonify(
+        response_cache.get_or_build(
+            THRESHOLD_SCOPES, lambda: inventory_json(expiring_soon_statement())
+        )
+    )
 
 
-# Reporting and Analytics Routes
-# Route to generate inventory levels report
-@app.route("/report/inventory_levels", methods=["GET"])
+# Apply a change to the threshold rules: drop the cached rules and bring the
+# dashboard counters and alerts in line with the new thresholds
+def thresholds_changed():
+    invalidate_rules()
+    rebuild_counters()
+    sync_alerts()
+
+
+# Route to list the threshold rules
+@bp.route("/thresholds", methods=["GET"])
 @login_required
-def inventory_levels_report():
-    # Query all inventory items
-    inventory_items = Inventory.query.all()
-    # Prepare report data
-    report = [
+def list_threshold_rules():
+    rules = ThresholdRule.query.order_by(ThresholdRule.id).all()
+    return jsonify(
         {
-            "product_name": item.product_name,
-            "total_litres": item.total_litres,
-            "location": item.location,
+            "rules": [rule_json(rule) for rule in rules],
+            "fallback": {
+                "low_stock_litres": str(LOW_STOCK_THRESHOLD),
+                "expiry_days": EXPIRY_WINDOW_DAYS,
+            },
         }
-        for item in inventory_items
-    ]
+    )
 
+
+# Route to create a threshold rule, or change the one with the same scope
+@bp.route("/thresholds", methods=["POST"])
+@admin_required
+def save_threshold_rule():
+    try:
+        rule = save_rule(request.get_json(silent=True))
+    except ThresholdRuleError as e:
+        return jsonify({"error": str(e)}), 400
+    db.session.commit()
+    thresholds_changed()
+    return jsonify(rule_json(rule))
+
+
+# Route to delete a threshold rule
+@bp.route("/thresholds/<int:rule_id>", methods=["DELETE"])
+@admin_required
+def delete_threshold_rule(rule_id):
+    rule = db.session.get(ThresholdRule, rule_id)
+    if rule is None:
+        return jsonify({"error": "Threshold rule not found"}), 404
+    delete_rule(rule)
+    db.session.commit()
+    thresholds_changed()
+    return jsonify({"message": "Threshold rule deleted"})
+
+
+# Reporting and Analytics Routes
+# Route to generate inventory levels report
+@bp.route("/report/inventory_levels", methods=["GET"])
+@login_required
+@replica_reads
+def inventory_levels_report():
     # Check if the request is for a downloadable report
     if request.args.get("download") == "true":
-        # Convert report data to a DataFrame and write to an Excel file
-        df = pd.DataFrame(report)
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            df.to_excel(writer, index=False, sheet_name="Inventory Levels")
-        output.seek(0)
-        # Send the Excel file as a downloadable response
-        return send_file(
-            output, as_attachment=True, download_name="inventory_levels_report.xlsx"
+        # Build large reports in the background when requested
+        if request.args.get("async") == "true":
+            return queue_report_job(
+                "inventory_levels", {}, request.args.get("format", "xlsx")
+            )
+        # Stream the report rows straight into the export file
+        return export_response(
+            inventory_levels_statement(),
+            "inventory_levels_report",
+            "Inventory Levels",
+            request.args.get("format", "xlsx"),
+            cache_scopes=("inventory",),
         )
 
+    # Prepare report data from a column-projected query
+    report = response_cache.get_or_build(
+        ("inventory",),
+        lambda: [
+            row._asdict() for row in db.session.execute(inventory_levels_statement())
+        ],
+    )
+
     # Render the inventory levels report template
     return render_template("inventory_levels_report.html", report=report)
 
 
 # Route to generate inventory taken report
-@app.route("/report/inventory_taken", methods=["GET", "POST"])
+@bp.route("/report/inventory_taken", methods=["GET", "POST"])
 @login_required
+@replica_reads
 def inventory_taken_report():
     if request.method == "POST":
         # Get start and end dates from the form
@@ -643,47 +1046,48 @@ def inventory_taken_report():
         # Validate date inputs
         if not start_date or not end_date:
             flash("Please provide both start date and end date", "danger")
-            return redirect(url_for("inventory_taken_report"))
+            return redirect(url_for("main.inventory_taken_report"))
+        params = {"start_date": start_date, "end_date": end_date}
 
         try:
             start_date = datetime.strptime(start_date, "%Y-%m-%d")
             end_date = datetime.strptime(end_date, "%Y-%m-%d")
         except ValueError:
             flash("Invalid date format. Use YYYY-MM-DD", "danger")
-            return redirect(url_for("inventory_taken_report"))
+            return redirect(url_for("main.inventory_taken_report"))
 
-        # Query transactions within the date range
-        transactions = InventoryTransaction.query.filter(
-            InventoryTransaction.date_taken >= start_date,
-            InventoryTransaction.date_taken <= end_date,
-        ).all()
+        # Check if the request is for a downloadable report
+        if request.form.get("download") == "true":
+            # Build large reports in the background when requested
+            if request.form.get("async") == "true":
+                return queue_report_job(
+                    "inventory_taken", params, request.form.get("format", "xlsx")
+                )
+            # Stream the report rows straight into the export file
+            return export_response(
+                inventory_taken_statement(start_date, end_date),
+                "inventory_taken_report",
+                "Inventory Taken",
+                request.form.get("format", "xlsx"),
+            )
+
+        # Query transactions within the date range joined to their product
+        # names in a single statement
+        transactions = db.session.execute(
+            inventory_taken_statement(start_date, end_date)
+        )
 
         # Prepare report data
         report = [
             {
                 "inventory_id": transaction.inventory_id,
-                "product_name": transaction.inventory.product_name,
+                "product_name": transaction.product_name,
                 "quantity_taken": transaction.quantity_taken,
                 "date_taken": transaction.date_taken.isoformat(),
             }
             for transaction in transactions
         ]
 
-        # Check if the request is for a downloadable report
-        if request.form.get("download") == "true":
-            # Convert report data to a DataFrame and write to an Excel file
-            df = pd.DataFrame(report)
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine="openpyxl") as writer:
-                df.to_excel(writer, index=False, sheet_name="Inventory Taken")
-            output.seek(0)
-            # Send the Excel file as a downloadable response
-            return send_file(
-                output,
-                as_attachment=True,
-                download_name="inventory_taken_report.xlsx",
-            )
-
         # Render the inventory taken report template
         return render_template("inventory_taken_report.html", report=report)
 
@@ -691,145 +1095,323 @@ def inventory_taken_report():
     return render_template("inventory_taken_report.html")
 
 
+# Route to get consumption totals per day, week or month, optionally grouped
+# by product or location
+@bp.route("/report/consumption", methods=["GET"])
+@login_required
+@replica_reads
+def consumption_analytics():
+    period = request.args.get("period", "day")
+    group_by = request.args.get("group_by") or None
+    rolling = request.args.get("rolling", type=int)
+
+    # Default to the last 30 days
+    try:
+        end_date = date_arg("end_date", date.today())
+        start_date = date_arg("start_date", end_date - timedelta(days=30))
+    except (ValueError, OverflowError):
+        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
+
+    # Validate report options
+    if start_date > end_date:
+        return jsonify({"error": "start_date must not be after end_date"}), 400
+    if end_date > MAX_END_DATE:
+        return (
+            jsonify(
+                {"error": f"end_date must not be after {MAX_END_DATE.isoformat()}"}
+            ),
+            400,
+        )
+    if period not in PERIODS:
+        return jsonify({"error": f"period must be one of {', '.join(PERIODS)}"}), 400
+    if group_by and group_by not in GROUP_COLUMNS:
+        return (
+            jsonify({"error": f"group_by must be one of {', '.join(GROUP_COLUMNS)}"}),
+            400,
+        )
+    if rolling is not None and rolling < 1:
+        return jsonify({"error": "rolling must be a positive number of buckets"}), 400
+    if bucket_count(start_date, end_date, period) > MAX_BUCKETS:
+        return (
+            jsonify({"error": f"The date range spans more than {MAX_BUCKETS} periods"}),
+            400,
+        )
+
+    return jsonify(consumption_report(start_date, end_date, period, group_by, rolling))
+
+
 # Route to generate user activity report
-@app.route("/report/user_activity", methods=["GET"])
+@bp.route("/report/user_activity", methods=["GET"])
+@replica_reads
 def user_activity_report():
-    # Query all users
-    users = User.query.all()
-    # Prepare report data
-    report = [
-        {
-            "username": user.username,
-            "email": user.email,
-            "role": user.role,
-        }
-        for user in users
-    ]
-
     # Check if the request is for a downloadable report
     if request.args.get("download") == "true":
-        # Convert report data to a DataFrame and write to an Excel file
-        df = pd.DataFrame(report)
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            df.to_excel(writer, index=False, sheet_name="User Activity")
-        output.seek(0)
-        # Send the Excel file as a downloadable response
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name="user_activity_report.xlsx",
+        # Stream the report rows straight into the export file
+        return export_response(
+            user_activity_statement(),
+            "user_activity_report",
+            "User Activity",
+            request.args.get("format", "xlsx"),
+            cache_scopes=("users",),
         )
 
+    # Prepare report data from a column-projected query
+    report = response_cache.get_or_build(
+        ("users",),
+        lambda: [
+            row._asdict() for row in db.session.execute(user_activity_statement())
+        ],
+    )
+
     # Render the user activity report template
     return render_template("user_activity_report.html", report=report)
 
 
+# Background Report Jobs
+
+
+# Describe a report job as JSON with links to its status and result
+def report_job_json(job):
+    status = {
+        key: job[key] for key in ("id", "report", "format", "status", "rows", "error")
+    }
+    status["status_url"] = url_for("main.report_job_status", job_id=job["id"])
+    if job["status"] == FINISHED:
+        status["download_url"] = url_for("main.download_report_job", job_id=job["id"])
+    return status
+
+
+# Queue a report job and return its id immediately
+def queue_report_job(report, params, fmt):
+    try:
+        job = report_jobs.submit(report, params, fmt)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    response = jsonify(report_job_json(job))
+    response.status_code = 202
+    response.headers["Location"] = url_for("main.report_job_status", job_id=job["id"])
+    return response
+
+
+# Route to submit a report for background generation
+@bp.route("/reports/jobs", methods=["POST"])
+@login_required
+def submit_report_job():
+    data = request.get_json(silent=True)
+    if data is not None:
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected a JSON object"}), 400
+        params = data.get("params") or {}
+        if not isinstance(params, dict):
+            return jsonify({"error": "params must be an object"}), 400
+    else:
+        data = request.form
+        params = {
+            key: value for key, value in data.items() if key not in ("report", "format")
+        }
+    return queue_report_job(data.get("report"), params, data.get("format", "xlsx"))
+
+
+# Route to get the status of a report job
+@bp.route("/reports/jobs/<job_id>", methods=["GET"])
+@login_required
+def report_job_status(job_id):
+    job = report_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Report job not found"}), 404
+    return jsonify(report_job_json(job))
+
+
+# Route to download the file built by a finished report job
+@bp.route("/reports/jobs/<job_id>/download", methods=["GET"])
+@login_required
+def download_report_job(job_id):
+    job = report_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Report job not found"}), 404
+    if job["status"] != FINISHED:
+        return jsonify({"error": "Report is not ready", "status": job["status"]}), 409
+    return send_file(
+        report_jobs.result_path(job),
+        as_attachment=True,
+        download_name=report_jobs.download_name(job),
+    )
+
+
+# Profiles
+
+
+# Route to list the saved request and job profiles
+@bp.route("/admin/profiles", methods=["GET"])
+@admin_required
+def list_profiles():
+    profiles = [
+        dict(profile, modified=datetime.fromtimestamp(profile["modified"]))
+        for profile in profiler.profiles()
+    ]
+    return render_template(
+        "profiles.html", profiles=profiles, mode=current_app.config["PROFILE_MODE"]
+    )
+
+
+# Route to download a saved profile
+@bp.route("/admin/profiles/<name>", methods=["GET"])
+@admin_required
+def download_profile(name):
+    return send_from_directory(profiler.directory, name, as_attachment=True)
+
+
 # Automated Email Notifications
 
 
-# Function to check inventory levels and send email alerts for low inventory
-def check_inventory_levels():
-    with app.app_context():
-        # Query inventory items with total litres below the threshold
-        low_inventory_items = Inventory.query.filter(Inventory.total_litres < 50).all()
-        if low_inventory_items:
-            # Prepare inventory list for the email attachment
-            inventory_list = [
-                {
-                    "id": item.id,
-                    "material": item.material,
-                    "product_name": item.product_name,
-                    "total_litres": float(item.total_litres),
-                    "date_received": item.date_received.isoformat(),
-                    "best_before_date": item.best_before_date.isoformat(),
-                    "location": item.location,
-                }
-                for item in low_inventory_items
-            ]
-
-            # Convert inventory list to a DataFrame and save to a BytesIO object
-            df = pd.DataFrame(inventory_list)
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine="openpyxl") as writer:
-                df.to_excel(writer, index=False, sheet_name="Low Inventory")
-            output.seek(0)
-
-            # Create the email message with attachment
-            msg = Message("Low Inventory Alert", recipients=[MAIL_USERNAME])
-            msg.body = "The following products are below the 50 liters threshold. Please find the attached report for details."
-            msg.attach(
-                "low_inventory_report.xlsx",
-                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                output.read(),
-            )
-            # Send the email
-            mail.send(msg)
-
-
-# Function to check for expiring products and send email alerts
-def check_expiring_products():
-    with app.app_context():
-        # Calculate the date three months from now
-        three_months_from_now = datetime.now() + timedelta(days=90)
-        # Query inventory items expiring before the calculated date
-        expiring_items = Inventory.query.filter(
-            Inventory.best_before_date <= three_months_from_now
-        ).all()
-        if expiring_items:
-            # Prepare inventory list for the email attachment
-            inventory_list = [
-                {
-                    "id": item.id,
-                    "material": item.material,
-                    "product_name": item.product_name,
-                    "total_litres": float(item.total_litres),
-                    "date_received": item.date_received.isoformat(),
-                    "best_before_date": item.best_before_date.isoformat(),
-                    "location": item.location,
-                }
-                for item in expiring_items
-            ]
-
-            # Convert inventory list to a DataFrame and save to a BytesIO object
-            df = pd.DataFrame(inventory_list)
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine="openpyxl") as writer:
-                df.to_excel(writer, index=False, sheet_name="Expiring Soon")
-            output.seek(0)
-
-            # Create the email message with attachment
-            msg = Message("Expiration Notice", recipients=[MAIL_USERNAME])
-            msg.body = "The following products are expiring within the next 3 months. Please find the attached report for details."
-            msg.attach(
-                "expiring_soon_report.xlsx",
-                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                output.read(),
-            )
-            # Send the email
-            mail.send(msg)
+# Decorator running a scheduled job in the context of this module's app, from
+# which the scheduler runner loads the jobs, profiled while its PROFILE_MODE
+# is on. Each run is timed under the function's name, which is also its job
+# id; APScheduler may report a short run as executed before it reports it as
+# submitted, so the job times itself.
+def scheduled_job(func):
+    profiled = profiler.job(func)
+
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            with app.app_context():
+                return profiled(*args, **kwargs)
+        except Exception:
+            job_failures.inc(job=func.__name__)
+            raise
+        finally:
+            job_seconds.observe(time.perf_counter() - started, job=func.__name__)
 
+    return decorated_function
 
-# Scheduling the Tasks
 
-# Initialize the scheduler
-scheduler = BackgroundScheduler()
-# Schedule the check_inventory_levels function to run every Friday at 10 AM WAT
-scheduler.add_job(
-    func=check_inventory_levels,
-    trigger=CronTrigger(day_of_week="fri", hour=10, minute=0, timezone="Africa/Lagos"),
-)
-# Schedule the check_expiring_products function to run every Friday at 10 AM WAT
-scheduler.add_job(
-    func=check_expiring_products,
-    trigger=CronTrigger(day_of_week="fri", hour=10, minute=0, timezone="Africa/Lagos"),
-)
-# Start the scheduler
-scheduler.start()
+# Function to raise expiry alerts for items that moved into the expiring soon
+# window overnight
+@scheduled_job
+def scan_expiring_products():
+    scan_expiring()
+
+
+# Function to email a digest of the low stock and expiry alerts raised or
+# cleared since the last one
+@scheduled_job
+def send_alert_digest():
+    started = datetime.utcnow()
+    alerts = pending_alerts(started)
+    if not alerts:
+        return
+    msg = Message(
+        "Inventory Alert Digest", recipients=[current_app.config["MAIL_USERNAME"]]
+    )
+    msg.body = digest_text(alerts)
+    # Queued in the same transaction that marks the alerts as notified
+    mail_queue.queue(msg)
+    mark_notified(alerts, started)
+
+
+# Function to materialize yesterday's stock snapshots
+@scheduled_job
+def build_inventory_snapshots():
+    build_snapshots()
+
+
+# Function to recompute the dashboard counters and alert states from the
+# inventory, correcting any drift left by writes that raced a rule change
+@scheduled_job
+def reconcile_counters_and_alerts():
+    rebuild_counters()
+    sync_alerts()
+
 
-# Initialize the database
-with app.app_context():
+# Function to remove expired report job files
+@scheduled_job
+def cleanup_report_jobs():
+    report_jobs.cleanup()
+
+
+# Function to delete live events old enough that no client replays them
+@scheduled_job
+def purge_stream_events():
+    purge_events()
+
+
+# Function to send queued email that is due, including retries
+@scheduled_job
+def send_queued_mail():
+    mail_queue.send_pending()
+
+
+# Command to run the scheduled jobs. Web workers do not schedule anything;
+# run one of these next to them. Further runners wait as standbys unless
+# --no-wait is given.
+@bp.cli.command("run-scheduler")
+@click.option("--wait/--no-wait", default=True)
+def run_scheduler_command(wait):
+    from scheduler import run_scheduler
+
+    if not run_scheduler(current_app._get_current_object(), wait):
+        raise click.ClickException("Another scheduler is already running")
+
+
+# Command to create the tables of a new database and mark it as migrated
+@bp.cli.command("init-db")
+def init_db():
     db.create_all()
+    stamp()
+
+
+# Command to send every due email in the outbound queue now
+@bp.cli.command("send-queued-mail")
+def send_queued_mail_command():
+    sent = mail_queue.send_pending()
+    stats = mail_queue.stats()
+    click.echo(
+        f"Sent {sent} emails; {stats['queued']} queued, {stats['failed']} failed"
+    )
+
+
+# Command to recompute the dashboard counters from the inventory table
+@bp.cli.command("rebuild-dashboard-counters")
+def rebuild_dashboard_counters():
+    rebuild_counters()
+
+
+# Create and configure an app. Settings come from config.py, then from
+# config_object when one is given. Nothing here connects to the database or
+# starts a thread, so gunicorn can preload the app before forking workers.
+def create_app(config_object=None):
+    app = Flask(__name__)
+    app.config.from_object("config")
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    if config_object:
+        app.config.from_object(config_object)
+
+    # Initialize Flask-Mail, SQLAlchemy and Flask-Migrate
+    configure_engines(app)
+    mail.init_app(app)
+    db.init_app(app)
+    migrate.init_app(app, db)
+    report_jobs.init_app(app)
+    mail_queue.init_app(app, mail)
+    # Size the material code lookup cache
+    init_material_cache(app)
+    broker.init_app(app)
+    # Time requests and count their SQL for /metrics
+    init_metrics(app)
+    # Admins can ask for a profile of one request with a header
+    profiler.init_app(app, allow_header=is_admin)
+    # Report results and Excel files, dropped by writes to their data
+    response_cache.init_app(app)
+
+    app.register_blueprint(bp)
+    return app
+
+
+# App for gunicorn (app:app), the flask command and the scheduled jobs
+app = create_app()
+
 
 # Run the Flask app
 if __name__ == "__main__":
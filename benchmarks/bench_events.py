@@ -0,0 +1,212 @@
+# Load test the live event stream: how many idle connections are held and
+# how long events take to reach every client.
+#
+# Against the in-process broker, with one thread per client:
+#
+#     python -m benchmarks.bench_events --clients 2000 --events 50
+#
+# Against a running server, e.g. one gevent worker:
+#
+#     gunicorn -k gevent -w 1 --worker-connections 10000 -b 127.0.0.1:8000 app:app
+#     python -m benchmarks.bench_events --url http://127.0.0.1:8000 \
+#         --username admin --password secret --material 1001 --clients 5000
+#
+# In server mode each event is triggered by taking one litre of --material
+# through /take_inventory/batch, so the item needs enough stock.
+import argparse
+import http.cookiejar
+import json
+import selectors
+import socket
+import statistics
+import threading
+import time
+import urllib.parse
+import urllib.request
+from benchmarks.common import current_rss_mb
+from events import EventBroker, stream
+
+
+# Latency percentiles in milliseconds
+def summarize(latencies):
+    if len(latencies) < 2:
+        return {"p50": None, "p95": None, "p99": None}
+    cuts = statistics.quantiles(latencies, n=100)
+    return {
+        name: round(cuts[pct - 1] * 1000, 2)
+        for name, pct in (("p50", 50), ("p95", 95), ("p99", 99))
+    }
+
+
+# Complete events in a chunk of the stream, as (type, data), and the
+# incomplete rest
+def read_events(buffer):
+    *complete, rest = buffer.split(b"\n\n")
+    events = []
+    for message in complete:
+        fields = dict(
+            line.split(b": ", 1) for line in message.split(b"\n") if b": " in line
+        )
+        if b"event" in fields:
+            events.append((fields[b"event"].decode(), json.loads(fields[b"data"])))
+    return events, rest
+
+
+# Subscribe clients to an in-process broker and time the fan-out
+def run_broker(clients, count, interval):
+    broker = EventBroker(queue_size=100, max_clients=clients)
+    latencies = []
+    lock = threading.Lock()
+    done = threading.Barrier(clients + 1)
+    rss_before = current_rss_mb()
+
+    def client():
+        subscription = broker.subscribe()
+        events = stream(subscription, heartbeat=60)
+        next(events)
+        done.wait()
+        received = 0
+        for chunk in events:
+            if not chunk.startswith("id:"):
+                continue
+            data = json.loads(chunk.rsplit("data: ", 1)[1])
+            with lock:
+                latencies.append(time.time() - data["at"])
+            received += 1
+            if received == count:
+                break
+        events.close()
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    done.wait()
+    held = broker.stats()["clients"]
+    rss_held = current_rss_mb()
+
+    for index in range(count):
+        broker.publish("stock-change", {"index": index, "at": time.time()})
+        time.sleep(interval)
+    for thread in threads:
+        thread.join()
+
+    return {
+        "mode": "broker",
+        "connections_held": held,
+        "events": count,
+        "deliveries": len(latencies),
+        "rss_per_connection_kb": round((rss_held - rss_before) * 1024 / held, 1),
+        "latency_ms": summarize(latencies),
+    }
+
+
+# Log in and return the session cookie header
+def login(url, username, password):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    opener.open(
+        f"{url}/login",
+        urllib.parse.urlencode({"username": username, "password": password}).encode(),
+    )
+    return opener, "; ".join(f"{cookie.name}={cookie.value}" for cookie in jar)
+
+
+# Hold open event streams against a server and time delivery of events
+# triggered by stock takes
+def run_server(url, username, password, material, clients, count, interval):
+    parsed = urllib.parse.urlsplit(url)
+    opener, cookie = login(url, username, password)
+    request = (
+        f"GET /events HTTP/1.1\r\nHost: {parsed.netloc}\r\n"
+        f"Accept: text/event-stream\r\nCookie: {cookie}\r\n\r\n"
+    ).encode()
+
+    selector = selectors.DefaultSelector()
+    buffers = {}
+    held = 0
+    for _ in range(clients):
+        try:
+            sock = socket.create_connection((parsed.hostname, parsed.port or 80))
+        except OSError:
+            break
+        sock.sendall(request)
+        headers = sock.recv(4096)
+        if not headers.startswith(b"HTTP/1.1 200"):
+            sock.close()
+            break
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+        buffers[sock] = headers.split(b"\r\n\r\n", 1)[1]
+        held += 1
+
+    latencies = []
+
+    # Read whatever has arrived on the streams until the given time
+    def drain(until):
+        while time.time() < until:
+            for key, _ in selector.select(timeout=0.05):
+                chunk = key.fileobj.recv(65536)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    continue
+                events, buffers[key.fileobj] = read_events(buffers[key.fileobj] + chunk)
+                now = time.time()
+                latencies.extend(
+                    now - data["at"]
+                    for event_type, data in events
+                    if event_type == "stock-change"
+                )
+
+    take = json.dumps({"lines": [{"material": material, "quantity": 1}]}).encode()
+    for _ in range(count):
+        opener.open(
+            urllib.request.Request(
+                f"{url}/take_inventory/batch",
+                take,
+                {"Content-Type": "application/json"},
+            )
+        )
+        drain(time.time() + interval)
+    # Give stragglers a few seconds after the last event
+    drain(time.time() + 5)
+
+    for sock in buffers:
+        sock.close()
+    return {
+        "mode": "server",
+        "connections_held": held,
+        "events": count,
+        "deliveries": len(latencies),
+        "expected_deliveries": held * count,
+        "latency_ms": summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the event stream")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.1)
+    parser.add_argument("--url", help="Test a running server instead of the broker")
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("--material")
+    args = parser.parse_args()
+
+    if args.url:
+        result = run_server(
+            args.url.rstrip("/"),
+            args.username,
+            args.password,
+            args.material,
+            args.clients,
+            args.events,
+            args.interval,
+        )
+    else:
+        result = run_broker(args.clients, args.events, args.interval)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Compare peak memory and time of the legacy pandas Excel export against the
+# streaming export engine.
+#
+#     python -m benchmarks.bench_export --rows 200000
+#
+# Each export runs in a fresh interpreter so peak RSS is measured per method.
+import argparse
+import io
+import json
+import subprocess
+import sys
+from benchmarks.common import (
+    current_rss_mb,
+    make_app,
+    peak_rss_mb,
+    seed_inventory,
+    timed,
+)
+from exports import write_export
+from models import db, Inventory
+from reports import inventory_statement
+
+METHODS = ("pandas", "xlsx", "csv")
+
+
+# The export path used by the report routes before the streaming engine
+def pandas_export(output):
+    import pandas as pd
+
+    inventory_list = [
+        {
+            "id": item.id,
+            "material": item.material,
+            "product_name": item.product_name,
+            "total_litres": float(item.total_litres),
+            "date_received": item.date_received.isoformat(),
+            "best_before_date": item.best_before_date.isoformat(),
+            "location": item.location,
+        }
+        for item in Inventory.query.all()
+    ]
+    df = pd.DataFrame(inventory_list)
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        df.to_excel(writer, index=False, sheet_name="Inventory")
+    return len(inventory_list)
+
+
+# Run a single export method and print its measurements as JSON
+def run_method(method):
+    app = make_app()
+    with app.app_context():
+        # Import the writers up front so only the export itself is measured
+        if method == "pandas":
+            import pandas  # noqa: F401
+            import openpyxl  # noqa: F401
+        rss_before = current_rss_mb()
+        output = io.BytesIO()
+        if method == "pandas":
+            rows, seconds = timed(pandas_export, output)
+        else:
+            rows, seconds = timed(
+                write_export, output, inventory_statement(), "Inventory", method
+            )
+        print(
+            json.dumps(
+                {
+                    "method": method,
+                    "rows": rows,
+                    "seconds": round(seconds, 3),
+                    "peak_rss_mb": round(peak_rss_mb(), 1),
+                    "rss_growth_mb": round(peak_rss_mb() - rss_before, 1),
+                    "output_mb": round(len(output.getvalue()) / 1024 / 1024, 2),
+                }
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark report exports")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--run", choices=METHODS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_method(args.run)
+        return
+
+    # Seed the benchmark database with the requested number of rows
+    app = make_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed_inventory(args.rows)
+
+    results = []
+    for method in METHODS:
+        completed = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_export", "--run", method],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        results.append(json.loads(completed.stdout))
+
+    print(f"{'method':<8} {'rows':>9} {'seconds':>8} {'peak MB':>8} {'growth MB':>10}")
+    for result in results:
+        print(
+            f"{result['method']:<8} {result['rows']:>9} {result['seconds']:>8} "
+            f"{result['peak_rss_mb']:>8} {result['rss_growth_mb']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
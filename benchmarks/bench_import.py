@@ -0,0 +1,99 @@
+# Compare bulk import throughput against adding rows one at a time the way
+# the add inventory form does.
+#
+#     python -m benchmarks.bench_import --rows 20000
+import argparse
+import io
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+from benchmarks.common import make_app, timed
+from bulk_import import import_inventory
+from ledger import record_movement
+from models import db, Inventory
+
+
+# Build a receipts CSV where about a third of the rows restock existing items
+def receipts_csv(rows, seed=42):
+    rng = random.Random(seed)
+    today = date.today()
+    lines = [
+        "material,product_name,total_litres,date_received,best_before_date,location"
+    ]
+    for index in range(rows):
+        material = 100000000 + (rng.randrange(rows // 3) if index % 3 == 0 else index)
+        lines.append(
+            f"{material},Product {material % 5000},{rng.randint(5, 20000)},"
+            f"{today.isoformat()},{(today + timedelta(days=rng.randint(30, 720))).isoformat()},"
+            f"Warehouse {rng.randrange(25)}"
+        )
+    return "\n".join(lines).encode()
+
+
+# The add inventory form's path: one lookup and one commit per row
+def per_row_import(content):
+    lines = content.decode().splitlines()[1:]
+    for line in lines:
+        material, product_name, total_litres, received, best_before, location = (
+            line.split(",")
+        )
+        total_litres = Decimal(total_litres)
+        existing = Inventory.query.filter_by(material=material).first()
+        if existing:
+            existing.total_litres += total_litres
+            existing.date_received = date.fromisoformat(received)
+            existing.best_before_date = date.fromisoformat(best_before)
+            existing.location = location
+            record_movement(existing, "receipt", total_litres)
+        else:
+            item = Inventory(
+                material=material,
+                product_name=product_name,
+                total_litres=total_litres,
+                date_received=date.fromisoformat(received),
+                best_before_date=date.fromisoformat(best_before),
+                location=location,
+            )
+            db.session.add(item)
+            db.session.flush()
+            record_movement(item, "receipt", total_litres)
+        db.session.commit()
+    return len(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark inventory imports")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    content = receipts_csv(args.rows)
+    app = make_app()
+    results = {}
+    with app.app_context():
+        for method in ("per_row", "bulk"):
+            db.drop_all()
+            db.create_all()
+            if method == "per_row":
+                _, seconds = timed(per_row_import, content)
+            else:
+                report, seconds = timed(
+                    import_inventory,
+                    io.BytesIO(content),
+                    "receipts.csv",
+                    args.chunk_size,
+                )
+                assert report["failed"] == 0, report["errors"][:5]
+            results[method] = (seconds, db.session.query(Inventory).count())
+            db.session.remove()
+
+    print(f"{'method':<8} {'rows':>7} {'items':>7} {'seconds':>8} {'rows/sec':>9}")
+    for method, (seconds, items) in results.items():
+        print(
+            f"{method:<8} {args.rows:>7} {items:>7} {seconds:>8.2f} "
+            f"{args.rows / seconds:>9.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
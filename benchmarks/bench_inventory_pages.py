@@ -0,0 +1,82 @@
+# Compare page latency of offset pagination and cursor pagination on the
+# first and a deep page of the inventory list, with and without a search.
+#
+#     python -m benchmarks.bench_inventory_pages --items 200000
+import argparse
+import statistics
+import time
+from sqlalchemy import select
+from benchmarks.common import make_app, seed_inventory
+from inventory_search import (
+    apply_filters,
+    encode_cursor,
+    reindex_inventory,
+    search_inventory,
+)
+from models import db, Inventory
+
+
+# Median latency of a function in milliseconds
+def median_ms(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return round(statistics.median(samples) * 1000, 2)
+
+
+# The old approach: LIKE filters, OFFSET paging and a count on every page
+def offset_page(filters, page, per_page):
+    statement = select(Inventory).where(
+        *(
+            getattr(Inventory, field).ilike(f"%{term}%")
+            for field, term in filters.items()
+        )
+    )
+    return db.paginate(statement, page=page, per_page=per_page, error_out=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark inventory list pages")
+    parser.add_argument("--items", type=int, default=200000)
+    parser.add_argument("--per-page", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app = make_app()
+    app.config["SECRET_KEY"] = "bench"
+    with app.app_context(), app.test_request_context():
+        db.drop_all()
+        db.create_all()
+        seed_inventory(args.items)
+        ids = db.session.scalars(select(Inventory.id)).all()
+        for start in range(0, len(ids), 5000):
+            reindex_inventory(*ids[start : start + 5000])
+        db.session.commit()
+
+        print(f"{'search':<10} {'page':<6} {'offset ms':>10} {'cursor ms':>10}")
+        for name, filters in (("none", {}), ("product", {"product_name": "uct 49"})):
+            statement, key_column = apply_filters(select(Inventory.id), filters)
+            matches = db.session.scalars(statement.order_by(key_column)).all()
+            deep = len(matches) // args.per_page
+            for page in (1, deep):
+                # Cursor pointing just before the same page
+                index = (page - 1) * args.per_page - 1
+                cursor = encode_cursor(matches[index], "next") if index >= 0 else None
+                offset = median_ms(
+                    lambda: offset_page(filters, page, args.per_page).items,
+                    args.repeat,
+                )
+                keyset = median_ms(
+                    lambda: search_inventory(
+                        filters, cursor, args.per_page, with_total=False
+                    ),
+                    args.repeat,
+                )
+                print(f"{name:<10} {page:<6} {offset:>10} {keyset:>10}")
+        db.session.remove()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Measure material code lookup latency with and without the lookup cache.
+#
+#     python -m benchmarks.bench_lookup --items 50000 --lookups 20000
+import argparse
+import random
+import statistics
+import time
+from benchmarks.common import make_app, seed_inventory
+from inventory_lookup import (
+    init_material_cache,
+    load_material,
+    lookup_material,
+    material_cache,
+)
+from models import db
+
+
+# Latency percentile in microseconds
+def percentile(samples, pct):
+    return round(statistics.quantiles(samples, n=100)[pct - 1] * 1e6, 1)
+
+
+# Time each lookup of the given material codes
+def measure(lookup, codes):
+    samples = []
+    for code in codes:
+        started = time.perf_counter()
+        lookup(code)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark material lookups")
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--hot", type=int, default=2000)
+    args = parser.parse_args()
+
+    app = make_app()
+    init_material_cache(app)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed_inventory(args.items)
+
+        # Scans repeat a working set of codes, with a few unknown barcodes
+        rng = random.Random(7)
+        hot = [100000000 + rng.randrange(args.items) for _ in range(args.hot)]
+        codes = [
+            rng.choice(hot) if rng.random() < 0.98 else 999000000 + rng.randrange(100)
+            for _ in range(args.lookups)
+        ]
+
+        material_cache.clear()
+        results = {
+            "uncached": measure(load_material, codes),
+            "cached": measure(lookup_material, codes),
+        }
+        db.session.remove()
+
+    print(f"{'mode':<9} {'p50 us':>8} {'p99 us':>8}")
+    for mode, samples in results.items():
+        print(f"{mode:<9} {percentile(samples, 50):>8} {percentile(samples, 99):>8}")
+    print("cache", material_cache.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Measure how long a worker takes to import the app and how much memory it
+# holds afterwards, using python -X importtime in a fresh interpreter per run.
+#
+#     python -m benchmarks.bench_startup --runs 5
+#
+# Run it from the repository root with config.py importable.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules that should only load when an import or export runs
+HEAVY_MODULES = ("pandas", "numpy", "openpyxl", "xlsxwriter")
+
+# Imports the app, then reports memory and which heavy modules were loaded
+PROBE = f"""
+import json, sys
+import app
+from benchmarks.common import current_rss_mb
+print(json.dumps({{
+    "rss_mb": current_rss_mb(),
+    "heavy_modules": [name for name in {HEAVY_MODULES!r} if name in sys.modules],
+}}))
+"""
+
+
+# Parse -X importtime output into the cumulative time of the app import and
+# of each module app.py imports itself, in microseconds. Children are listed
+# before their parent, indented two spaces per level.
+def parse_importtime(stderr):
+    children = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            if name.strip() == "app":
+                return int(cumulative), children
+            children = {}
+        elif depth == 1:
+            children[name.strip()] = int(cumulative)
+    raise ValueError("app was not imported")
+
+
+# Import the app once in a fresh interpreter
+def run_once(root):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    total, modules = parse_importtime(result.stderr)
+    probe["import_ms"] = total / 1000
+    probe["modules_ms"] = {name: elapsed / 1000 for name, elapsed in modules.items()}
+    return probe
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app import time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    runs = [run_once(root) for _ in range(args.runs)]
+
+    modules = {}
+    for run in runs:
+        for name, elapsed in run["modules_ms"].items():
+            modules.setdefault(name, []).append(elapsed)
+    slowest = sorted(
+        ((name, statistics.median(times)) for name, times in modules.items()),
+        key=lambda item: item[1],
+        reverse=True,
+    )[: args.top]
+
+    result = {
+        "runs": args.runs,
+        "import_ms": round(statistics.median(run["import_ms"] for run in runs), 1),
+        "rss_mb": round(statistics.median(run["rss_mb"] for run in runs), 1),
+        "heavy_modules": runs[-1]["heavy_modules"],
+        "slowest_imports_ms": {name: round(elapsed, 1) for name, elapsed in slowest},
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import os
+import random
+import resource
+import time
+from datetime import date, timedelta
+from flask import Flask
+from models import db, Inventory
+
+# Benchmarks run against their own SQLite file unless BENCH_DATABASE_URI is set
+DEFAULT_DATABASE_URI = "sqlite:///" + os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "bench.db"
+)
+
+
+# Create a bare Flask app bound to the benchmark database
+def make_app(database_uri=None):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri or os.environ.get(
+        "BENCH_DATABASE_URI", DEFAULT_DATABASE_URI
+    )
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    return app
+
+
+# Material code of the synthetic inventory item with the given index
+def material_code(index):
+    return 100000000 + index
+
+
+# One synthetic inventory row
+def inventory_row(index, rng, today):
+    return {
+        "material": material_code(index),
+        "product_name": f"Product {index % 5000}",
+        "total_litres": round(rng.uniform(1, 20000), 2),
+        "date_received": today - timedelta(days=rng.randint(0, 365)),
+        "best_before_date": today + timedelta(days=rng.randint(-30, 720)),
+        "location": f"Warehouse {index % 25}",
+    }
+
+
+# Fill the inventory table with synthetic rows using batched inserts
+def seed_inventory(count, batch_size=10000, seed=42):
+    rng = random.Random(seed)
+    today = date.today()
+    for start in range(0, count, batch_size):
+        db.session.execute(
+            Inventory.__table__.insert(),
+            [
+                inventory_row(index, rng, today)
+                for index in range(start, min(start + batch_size, count))
+            ],
+        )
+        db.session.commit()
+
+
+# Peak resident set size of the current process in MB
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Current resident set size of the current process in MB
+def current_rss_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+# Run a function and return its result with the elapsed wall time in seconds
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+# Latency of the sample at a percentile, nearest rank
+def percentile(ordered, pct):
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+# Summary of the timings of one result in milliseconds
+def summarize(samples):
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(total / len(ordered) * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "ops_per_second": round(len(ordered) / total, 1) if total else None,
+    }
@@ -0,0 +1,91 @@
+# Compare two benchmark result files written by benchmarks.run and flag the
+# results that got slower.
+#
+#     python -m benchmarks.compare benchmarks/results/base.json \
+#         benchmarks/results/head.json --threshold 0.1
+#
+# A result is slower when its p50 (or --metric) grew by more than the
+# threshold and by at least --min-ms, so sub-millisecond noise is not
+# flagged. Exits with status 1 if any result is slower.
+import argparse
+import json
+import sys
+
+# Data set properties that must match for the timings to be comparable
+COMPARABLE_META = ("database", "rows", "ops", "repeat")
+
+
+def load(path):
+    with open(path) as result_file:
+        return json.load(result_file)
+
+
+# One row per result: (name, base, head, relative change, status). Status is
+# "slower", "faster", "" within the threshold, "added" or "removed".
+def compare(base, head, metric="p50_ms", threshold=0.1, min_ms=0.05):
+    rows = []
+    base_results, head_results = base["results"], head["results"]
+    for name in list(base_results) + [
+        name for name in head_results if name not in base_results
+    ]:
+        if name not in head_results:
+            rows.append((name, base_results[name][metric], None, None, "removed"))
+            continue
+        if name not in base_results:
+            rows.append((name, None, head_results[name][metric], None, "added"))
+            continue
+        before, after = base_results[name][metric], head_results[name][metric]
+        change = (after - before) / before if before else 0.0
+        status = ""
+        if abs(after - before) >= min_ms:
+            if change > threshold:
+                status = "slower"
+            elif change < -threshold:
+                status = "faster"
+        rows.append((name, before, after, change, status))
+    return rows
+
+
+# Data set properties that differ between the two runs
+def meta_differences(base, head):
+    return [
+        key for key in COMPARABLE_META if base["meta"].get(key) != head["meta"].get(key)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark results")
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--metric", default="p50_ms")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--min-ms", type=float, default=0.05)
+    args = parser.parse_args()
+
+    base, head = load(args.base), load(args.head)
+    for key in meta_differences(base, head):
+        print(
+            f"warning: {key} differs: {base['meta'].get(key)} vs "
+            f"{head['meta'].get(key)}",
+            file=sys.stderr,
+        )
+
+    rows = compare(base, head, args.metric, args.threshold, args.min_ms)
+    print(
+        f"{base['meta']['commit'][:12]} -> {head['meta']['commit'][:12]}, {args.metric}"
+    )
+    print(f"{'result':<36} {'base':>10} {'head':>10} {'change':>8}  status")
+    for name, before, after, change, status in rows:
+        print(
+            f"{name:<36} {'-' if before is None else before:>10} "
+            f"{'-' if after is None else after:>10} "
+            f"{'' if change is None else format(change, '+.1%'):>8}  {status}"
+        )
+    slower = [row[0] for row in rows if row[4] == "slower"]
+    if slower:
+        print(f"{len(slower)} result(s) slower: {', '.join(slower)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
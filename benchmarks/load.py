@@ -0,0 +1,479 @@
+# Load test the app over HTTP with a mix of real user flows, and sweep
+# gunicorn setups to see where each one saturates.
+#
+# Against a server that is already running:
+#
+#     python -m benchmarks.generate --items 100000
+#     gunicorn -w 4 -b 127.0.0.1:8000 benchmarks.server:app
+#     python -m benchmarks.load --url http://127.0.0.1:8000 --concurrency 1,4,16,64
+#
+# Starting gunicorn for every worker class and worker count in turn:
+#
+#     python -m benchmarks.load --worker-class sync,gthread,gevent \
+#         --workers 1,2,4 --concurrency 1,4,16,64 --duration 30
+#
+# Each virtual user logs in through /login as one of the generated users,
+# then runs actions back to back, picked by weight from --mix. Every
+# concurrency level reports throughput, p50/p95/p99 latency and errors, in
+# total and per action. The JSON output holds one saturation curve (levels
+# by concurrency) per server setup. The client is a single Python process;
+# when its CPU use nears 100% the client, not the server, is the limit.
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import namedtuple
+from datetime import datetime
+from http.cookies import SimpleCookie
+from benchmarks.common import material_code, summarize
+from benchmarks.generate import BENCH_PASSWORD
+from benchmarks.run import RESULTS_DIR, git_revision
+
+# gunicorn runs from the repository root to import benchmarks.server
+REPO_DIR = os.path.dirname(os.path.dirname(RESULTS_DIR))
+
+# Report downloads that can be part of the mix
+DOWNLOADS = {
+    "levels_csv": "/report/inventory_levels?download=true&format=csv",
+    "levels_xlsx": "/report/inventory_levels?download=true&format=xlsx",
+    "user_activity_xlsx": "/report/user_activity?download=true&format=xlsx",
+}
+ACTIONS = ("scan", "take", "search", "dashboard") + tuple(DOWNLOADS)
+# Pickers scan and take, dashboards poll, office users search and download
+DEFAULT_MIX = (
+    "scan=40,take=10,search=15,dashboard=30,"
+    "levels_csv=2,levels_xlsx=2,user_activity_xlsx=1"
+)
+
+Reply = namedtuple("Reply", ["status", "headers", "body"])
+
+
+# One logged in user with its own connection and session cookie
+class VirtualUser:
+    def __init__(self, url, username, password, items, rng, timeout=60):
+        parsed = urllib.parse.urlsplit(url)
+        self.connection = http.client.HTTPConnection(
+            parsed.hostname, parsed.port or 80, timeout=timeout
+        )
+        self.username = username
+        self.password = password
+        self.items = items
+        self.rng = rng
+        self.cookies = {}
+        self.etag = None
+
+    # Send a request and read the whole response, keeping cookies. The
+    # connection is reopened after the server closes it, as sync workers do
+    # after every response.
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers["Cookie"] = "; ".join(
+                f"{name}={value}" for name, value in self.cookies.items()
+            )
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            reply = Reply(response.status, response.headers, response.read())
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            raise
+        for header in reply.headers.get_all("Set-Cookie") or ():
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        if response.will_close:
+            self.connection.close()
+        return reply
+
+    def post_form(self, path, fields):
+        return self.request(
+            "POST",
+            path,
+            urllib.parse.urlencode(fields),
+            {"Content-Type": "application/x-www-form-urlencoded"},
+        )
+
+    def login(self):
+        reply = self.post_form(
+            "/login", {"username": self.username, "password": self.password}
+        )
+        return reply.status == 302 and "/dashboard" in reply.headers["Location"]
+
+    def material(self):
+        return str(material_code(self.rng.randrange(self.items)))
+
+    # Look up a scanned material code
+    def scan(self):
+        reply = self.request(
+            "POST",
+            "/get_inventory_by_material",
+            json.dumps({"material": self.material()}),
+            {"Content-Type": "application/json"},
+        )
+        return reply.status == 200
+
+    # Take one litre through the form, then follow the redirect to the page
+    # that shows the result, as the browser does
+    def take(self):
+        reply = self.post_form(
+            "/take_inventory", {"material": self.material(), "quantity": 1}
+        )
+        location = urllib.parse.urlsplit(reply.headers.get("Location", "")).path
+        if reply.status != 302 or location != "/take_inventory":
+            return False
+        return self.request("GET", location).status == 200
+
+    # One page of the inventory list, searched by product name
+    def search(self):
+        query = urllib.parse.urlencode(
+            {"product_name": f"uct {self.rng.randrange(5000)}"}
+        )
+        return self.request("GET", f"/inventory?{query}").status == 200
+
+    # Poll the dashboard counters, revalidating the last response
+    def dashboard(self):
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        reply = self.request("GET", "/dashboard/summary", headers=headers)
+        self.etag = reply.headers.get("ETag", self.etag)
+        return reply.status in (200, 304)
+
+    def run(self, action):
+        if action in DOWNLOADS:
+            return self.request("GET", DOWNLOADS[action]).status == 200
+        return getattr(self, action)()
+
+
+# Parse "name=weight,..." into {action: weight}
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name not in ACTIONS:
+            raise ValueError(f"Unknown action {name!r}, expected one of {ACTIONS}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def parse_ints(text):
+    return [int(value) for value in text.split(",") if value.strip()]
+
+
+# Number of generated items, which have consecutive material codes
+def count_items(url, username, password, timeout):
+    user = VirtualUser(url, username, password, 0, None, timeout)
+    if not user.login():
+        raise RuntimeError(f"Cannot log in to {url} as {username}")
+    return json.loads(user.request("GET", "/inventory/total").body)["total"]
+
+
+def latency(samples):
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    summary = summarize(samples)
+    return {key: summary[key] for key in ("p50_ms", "p95_ms", "p99_ms", "max_ms")}
+
+
+def level_summary(samples, seconds):
+    errors = sum(1 for _, _, ok in samples if not ok)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else None,
+        # Successful requests per second
+        "throughput": round((len(samples) - errors) / seconds, 2),
+        **latency([elapsed for _, elapsed, _ in samples]),
+    }
+
+
+# Run the mix with a number of virtual users at once. Requests started in the
+# warmup are not counted.
+def run_level(
+    url,
+    concurrency,
+    duration,
+    warmup,
+    mix,
+    items,
+    users=10,
+    password=BENCH_PASSWORD,
+    think=0,
+    timeout=60,
+    seed=42,
+):
+    samples = []
+    login_failures = []
+    lock = threading.Lock()
+    window = {}
+
+    def open_window():
+        window["start"] = time.perf_counter() + warmup
+        window["end"] = window["start"] + duration
+        window["cpu"] = time.process_time()
+
+    ready = threading.Barrier(concurrency, action=open_window)
+    actions, weights = zip(*mix.items())
+
+    def virtual_user(index):
+        rng = random.Random(f"{seed}-{concurrency}-{index}")
+        user = VirtualUser(url, f"user{index % users}", password, items, rng, timeout)
+        try:
+            logged_in = user.login()
+        except (http.client.HTTPException, OSError):
+            logged_in = False
+        ready.wait()
+        if not logged_in:
+            with lock:
+                login_failures.append(index)
+            return
+        done = []
+        while True:
+            started = time.perf_counter()
+            if started >= window["end"]:
+                break
+            action = rng.choices(actions, weights)[0]
+            try:
+                ok = user.run(action)
+            except (http.client.HTTPException, OSError):
+                ok = False
+            if started >= window["start"]:
+                done.append((action, time.perf_counter() - started, ok))
+            if think:
+                time.sleep(rng.expovariate(1 / think))
+        user.connection.close()
+        with lock:
+            samples.extend(done)
+
+    threads = [
+        threading.Thread(target=virtual_user, args=(index,), daemon=True)
+        for index in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    cpu = time.process_time() - window["cpu"]
+    return {
+        "concurrency": concurrency,
+        "seconds": duration,
+        **level_summary(samples, duration),
+        "login_failures": len(login_failures),
+        "client_cpu_percent": round(cpu / (warmup + duration) * 100, 1),
+        "actions": {
+            action: level_summary(
+                [sample for sample in samples if sample[0] == action], duration
+            )
+            for action in actions
+        },
+    }
+
+
+# Peak throughput of a curve and the lowest concurrency reaching 90% of it,
+# past which more users mostly add latency
+def saturation(levels):
+    peak = max((level["throughput"] for level in levels), default=0)
+    knee = next(
+        (
+            level["concurrency"]
+            for level in levels
+            if peak and level["throughput"] >= 0.9 * peak
+        ),
+        None,
+    )
+    return {"peak_throughput": peak, "knee_concurrency": knee}
+
+
+# Start gunicorn serving the benchmark app and wait until it answers
+def start_server(worker_class, workers, port, threads, database_uri, log):
+    command = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "-k",
+        worker_class,
+        "-w",
+        str(workers),
+        "-b",
+        f"127.0.0.1:{port}",
+        # Large Excel downloads outlast the default 30 seconds
+        "--timeout",
+        "300",
+    ]
+    if worker_class == "gthread":
+        command += ["--threads", str(threads)]
+    env = dict(os.environ)
+    if database_uri:
+        env["BENCH_DATABASE_URI"] = database_uri
+    process = subprocess.Popen(
+        command + ["benchmarks.server:app"],
+        cwd=REPO_DIR,
+        env=env,
+        stdout=log,
+        stderr=log,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            log.seek(0)
+            raise RuntimeError(f"gunicorn exited:\n{log.read().decode()[-2000:]}")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", "/login")
+            status = connection.getresponse().status
+            connection.close()
+            if status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError("gunicorn did not answer within 60 seconds")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# Every concurrency level against one server, from the lowest up
+def run_curve(url, args, mix):
+    items = count_items(url, "user0", args.password, args.timeout)
+    levels = []
+    for concurrency in parse_ints(args.concurrency):
+        level = run_level(
+            url,
+            concurrency,
+            args.duration,
+            args.warmup,
+            mix,
+            items,
+            args.users,
+            args.password,
+            args.think,
+            args.timeout,
+            args.seed,
+        )
+        print_level(level)
+        levels.append(level)
+    return levels
+
+
+def print_header(setup):
+    print(f"\n{setup}")
+    print(
+        f"{'users':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+        f"{'errors':>7} {'client cpu':>11}"
+    )
+
+
+def print_level(level):
+    print(
+        f"{level['concurrency']:>6} {level['throughput']:>9} {level['p50_ms']!s:>9} "
+        f"{level['p95_ms']!s:>9} {level['p99_ms']!s:>9} "
+        f"{level['errors'] + level['login_failures']:>7} "
+        f"{level['client_cpu_percent']:>10}%",
+        flush=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the app over HTTP")
+    parser.add_argument("--url", help="Test a running server instead of gunicorn")
+    parser.add_argument("--worker-class", default="sync")
+    parser.add_argument("--workers", default="1")
+    parser.add_argument("--threads", type=int, default=4, help="For gthread")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--database-uri", default=None)
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--think", type=float, default=0, help="Mean seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--password", default=BENCH_PASSWORD)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    curves = []
+    if args.url:
+        url = args.url.rstrip("/")
+        print_header(url)
+        levels = run_curve(url, args, mix)
+        curves.append({"server": url, "levels": levels, **saturation(levels)})
+    else:
+        for worker_class in args.worker_class.split(","):
+            for workers in parse_ints(args.workers):
+                setup = f"{worker_class} x{workers}"
+                with tempfile.TemporaryFile() as log:
+                    try:
+                        process = start_server(
+                            worker_class,
+                            workers,
+                            args.port,
+                            args.threads,
+                            args.database_uri,
+                            log,
+                        )
+                    except RuntimeError as e:
+                        print(f"\n{setup}: {e}", file=sys.stderr)
+                        continue
+                    try:
+                        print_header(setup)
+                        levels = run_curve(f"http://127.0.0.1:{args.port}", args, mix)
+                    finally:
+                        stop_server(process)
+                curves.append(
+                    {
+                        "worker_class": worker_class,
+                        "workers": workers,
+                        "threads": args.threads if worker_class == "gthread" else 1,
+                        "levels": levels,
+                        **saturation(levels),
+                    }
+                )
+
+    revision = git_revision()
+    meta = {
+        "commit": revision,
+        "created": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "mix": mix,
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "think": args.think,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"load-{revision[:12]}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as result_file:
+        json.dump({"meta": meta, "curves": curves}, result_file, indent=2)
+
+    print()
+    for curve in curves:
+        setup = curve.get("server") or f"{curve['worker_class']} x{curve['workers']}"
+        print(
+            f"{setup}: peak {curve['peak_throughput']} req/s, "
+            f"reached at {curve['knee_concurrency']} users"
+        )
+    print(f"Wrote {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
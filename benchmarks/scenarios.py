@@ -0,0 +1,232 @@
+# Benchmark scenarios run by benchmarks.run against a generated data set.
+# Each takes (ops, repeat, rng) and returns {result name: [seconds, ...]}:
+# quick operations are timed ops times each, whole reports, exports and jobs
+# repeat times.
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import delete, func, select
+from alerts import digest_text, pending_alerts, scan_expiring, sync_alerts
+from benchmarks.common import material_code
+from exports import EXPORT_FORMATS, iter_rows, write_export
+from inventory_lookup import load_material, lookup_material, material_cache
+from inventory_search import encode_cursor, row_page, search_inventory
+from ledger import build_snapshots
+from models import db, DeletedInventory, Inventory, InventorySnapshot
+from pick_lists import take_pick_list, take_stock
+from reports import REPORTS
+
+# Lines of each pick list in the take burst
+PICK_LIST_LINES = 10
+
+
+# Time each call of a function, once per argument tuple
+def time_calls(func, calls):
+    samples = []
+    for args in calls:
+        started = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+# Time repeated calls of a function without arguments
+def time_repeat(func, repeat):
+    return time_calls(func, [()] * repeat)
+
+
+def live_items():
+    return db.session.scalar(select(func.max(Inventory.id))) or 0
+
+
+# Scanner lookups of material codes: a working set of codes repeated, with a
+# few unknown barcodes, through the database and through the lookup cache
+def lookup(ops, repeat, rng):
+    items = live_items()
+    # A working set a tenth the size of the burst, as in bench_lookup
+    hot = [material_code(rng.randrange(items)) for _ in range(max(ops // 10, 1))]
+    codes = [
+        (
+            str(
+                rng.choice(hot)
+                if rng.random() < 0.98
+                else 999000000 + rng.randrange(100)
+            ),
+        )
+        for _ in range(ops)
+    ]
+    material_cache.clear()
+    return {
+        "lookup.uncached": time_calls(load_material, codes),
+        "lookup.cached": time_calls(lookup_material, codes),
+    }
+
+
+# The first page and a page deep into the lazy-loaded inventory tables
+def listing(ops, repeat, rng):
+    pages = max(ops // 10, 1)
+    items = live_items()
+    cursors = [
+        (Inventory, None, encode_cursor(rng.randrange(items), "next"))
+        for _ in range(pages)
+    ]
+    return {
+        "listing.first_page": time_calls(row_page, [(Inventory,)] * pages),
+        "listing.deep_page": time_calls(row_page, cursors),
+        "listing.deleted_first_page": time_calls(
+            row_page, [(DeletedInventory,)] * pages
+        ),
+    }
+
+
+# Inventory list searches: a selective material code, a product name, two
+# fields at once, and the next page of a common match
+def search(ops, repeat, rng):
+    pages = max(ops // 10, 1)
+    items = live_items()
+
+    def filters(make):
+        return [(make(),) for _ in range(pages)]
+
+    common = search_inventory({"location": "warehouse 1"}, with_total=False)
+    return {
+        "search.material": time_calls(
+            search_inventory,
+            filters(lambda: {"material": str(material_code(rng.randrange(items)))[3:]}),
+        ),
+        "search.product": time_calls(
+            search_inventory,
+            filters(lambda: {"product_name": f"uct {rng.randrange(5000)}"}),
+        ),
+        "search.product_location": time_calls(
+            search_inventory,
+            filters(
+                lambda: {
+                    "product_name": f"product {rng.randrange(50)}",
+                    "location": f"warehouse {rng.randrange(25)}",
+                }
+            ),
+        ),
+        "search.next_page": time_calls(
+            search_inventory,
+            [({"location": "warehouse 1"}, common["next"])] * pages,
+        ),
+    }
+
+
+# Parameters of each report, as the report routes pass them
+def report_statements():
+    end = date.today()
+    start = end - timedelta(days=30)
+    params = {"inventory_taken": (start.isoformat(), end.isoformat())}
+    return {
+        name: (report["statement"](*params.get(name, ())), report["sheet_name"])
+        for name, report in REPORTS.items()
+    }
+
+
+def read_rows(statement):
+    for _ in iter_rows(statement):
+        pass
+
+
+# Every row of each report, read from the database
+def reports(ops, repeat, rng):
+    return {
+        f"report.{name}": time_calls(read_rows, [(statement,)] * repeat)
+        for name, (statement, _) in report_statements().items()
+    }
+
+
+def export_to_file(statement, sheet_name, fmt):
+    with tempfile.TemporaryFile() as output:
+        write_export(output, statement, sheet_name, fmt)
+
+
+# Each report written out in each export format
+def exports(ops, repeat, rng):
+    return {
+        f"export.{name}.{fmt}": time_calls(
+            export_to_file, [(statement, sheet_name, fmt)] * repeat
+        )
+        for name, (statement, sheet_name) in report_statements().items()
+        for fmt in EXPORT_FORMATS
+    }
+
+
+# The queries behind the digest email. The job also marks the alerts as
+# sent, which is left out so every repeat reads the same alerts.
+def alert_digest():
+    return digest_text(pending_alerts(datetime.utcnow()))
+
+
+def rebuild_snapshots():
+    db.session.execute(delete(InventorySnapshot))
+    db.session.commit()
+    started = time.perf_counter()
+    build_snapshots()
+    return time.perf_counter() - started
+
+
+# The scheduled alert jobs, and the nightly snapshot job built from scratch
+def alerts(ops, repeat, rng):
+    return {
+        "alerts.scan_expiring": time_repeat(scan_expiring, repeat),
+        "alerts.sync": time_repeat(sync_alerts, repeat),
+        "alerts.digest": time_repeat(alert_digest, repeat),
+        "alerts.snapshots": [rebuild_snapshots() for _ in range(repeat)],
+    }
+
+
+# A burst of scanner takes, each committed on its own, then of pick lists.
+# Takes are tiny so stock never runs out; this scenario changes the data, so
+# it runs last.
+def takes(ops, repeat, rng):
+    items = live_items()
+
+    def take_one(inventory_id):
+        take_stock(inventory_id, material_code(inventory_id - 1), Decimal("0.01"))
+        db.session.commit()
+
+    pick_lists = [
+        (
+            [
+                {
+                    "material": str(material_code(rng.randrange(items))),
+                    "quantity": "0.01",
+                }
+                for _ in range(PICK_LIST_LINES)
+            ],
+        )
+        for _ in range(max(ops // PICK_LIST_LINES, 1))
+    ]
+    return {
+        "take.single": time_calls(
+            take_one, [(rng.randrange(items) + 1,) for _ in range(ops)]
+        ),
+        "take.pick_list": time_calls(take_pick_list, pick_lists),
+    }
+
+
+# Scenarios in the order they run
+SCENARIOS = {
+    "lookup": lookup,
+    "listing": listing,
+    "search": search,
+    "reports": reports,
+    "exports": exports,
+    "alerts": alerts,
+    "takes": takes,
+}
+
+
+# Run the named scenarios, each with its own random stream so selecting
+# fewer scenarios does not change what the others do
+def run_scenarios(names, ops, repeat, seed=42):
+    results = {}
+    for name in names:
+        results.update(SCENARIOS[name](ops, repeat, random.Random(f"{seed}-{name}")))
+        db.session.remove()
+    return results
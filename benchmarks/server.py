@@ -0,0 +1,18 @@
+# The app bound to the benchmark database, for load tests against a real
+# server:
+#
+#     python -m benchmarks.generate --items 100000
+#     gunicorn -w 4 -b 127.0.0.1:8000 benchmarks.server:app
+#
+# Reads BENCH_DATABASE_URI like the other benchmarks; everything else comes
+# from config.py as usual.
+import os
+from app import create_app
+from benchmarks.common import DEFAULT_DATABASE_URI
+
+
+class BenchConfig:
+    SQLALCHEMY_DATABASE_URI = os.environ.get("BENCH_DATABASE_URI", DEFAULT_DATABASE_URI)
+
+
+app = create_app(BenchConfig)
@@ -0,0 +1,295 @@
+import io
+import os
+import zipfile
+from decimal import Decimal
+import pandas as pd
+from flask import current_app
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+from sqlalchemy import select
+from models import db, Inventory, InventoryMovement
+from inventory_lookup import invalidate_material
+from inventory_search import reindex_inventory
+from inventory_changes import item_state, record_changes
+
+COLUMNS = [
+    "material",
+    "product_name",
+    "total_litres",
+    "date_received",
+    "best_before_date",
+    "location",
+]
+
+# Rows validated and written per transaction
+CHUNK_SIZE = 1000
+# Row errors listed in the report; the total is always counted
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportFileError(ValueError):
+    pass
+
+
+# Stream a CSV upload as DataFrame chunks of raw strings
+def read_csv_chunks(fileobj, chunk_size):
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    yield from pd.read_csv(
+        text,
+        dtype=str,
+        keep_default_na=False,
+        skipinitialspace=True,
+        chunksize=chunk_size,
+    )
+
+
+# Stream an Excel upload row by row into DataFrame chunks of raw values
+def read_xlsx_chunks(fileobj, chunk_size):
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [
+            str(cell).strip() if cell is not None else "" for cell in next(rows, [])
+        ]
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield pd.DataFrame(chunk, columns=header, dtype=object)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header, dtype=object)
+    finally:
+        workbook.close()
+
+
+def read_chunks(fileobj, filename, chunk_size):
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".csv":
+        return read_csv_chunks(fileobj, chunk_size)
+    if extension == ".xlsx":
+        return read_xlsx_chunks(fileobj, chunk_size)
+    raise ImportFileError("Upload a .csv or .xlsx file")
+
+
+# Parse a date column, accepting YYYY-MM-DD text or Excel dates
+def parse_dates(column):
+    text = column.where(column.notna(), "").astype(str).str.strip().str[:10]
+    return pd.to_datetime(text, format="%Y-%m-%d", errors="coerce")
+
+
+# Validate a chunk with column-wise checks. Returns the clean rows and a list
+# of (row number, messages) for the rejected ones.
+def validate_chunk(chunk, first_row):
+    chunk = chunk.reset_index(drop=True)
+    text = {
+        name: chunk[name].where(chunk[name].notna(), "").astype(str).str.strip()
+        for name in ("material", "product_name", "location")
+    }
+    material = pd.to_numeric(text["material"], errors="coerce")
+    total_litres = pd.to_numeric(chunk["total_litres"], errors="coerce")
+    date_received = parse_dates(chunk["date_received"])
+    best_before_date = parse_dates(chunk["best_before_date"])
+
+    checks = [
+        (
+            material.isna() | (material % 1 != 0) | (material < 0) | (material >= 1e15),
+            "material must be a whole number of at most 15 digits",
+        ),
+        (
+            (text["product_name"] == "") | (text["product_name"].str.len() > 255),
+            "product_name is required (255 characters at most)",
+        ),
+        (
+            total_litres.isna() | (total_litres <= 0) | (total_litres >= 1e8),
+            "total_litres must be a positive number",
+        ),
+        (date_received.isna(), "date_received must be a YYYY-MM-DD date"),
+        (best_before_date.isna(), "best_before_date must be a YYYY-MM-DD date"),
+        (
+            (text["location"] == "") | (text["location"].str.len() > 255),
+            "location is required (255 characters at most)",
+        ),
+    ]
+    invalid = pd.Series(False, index=chunk.index)
+    for failed, _ in checks:
+        invalid |= failed
+
+    errors = [
+        (
+            first_row + index,
+            [message for failed, message in checks if failed.iat[index]],
+        )
+        for index in invalid[invalid].index
+    ]
+
+    valid = ~invalid
+    rows = pd.DataFrame(
+        {
+            "material": material[valid].astype("int64"),
+            "product_name": text["product_name"][valid],
+            "total_litres": total_litres[valid].round(2),
+            "date_received": date_received[valid].dt.date,
+            "best_before_date": best_before_date[valid].dt.date,
+            "location": text["location"][valid],
+        }
+    )
+    return rows, errors
+
+
+# Build an upsert for the connected database: new materials are inserted,
+# existing ones get the quantity added and the latest dates and location, the
+# same as adding them one at a time through the add inventory form
+def upsert_statement(dialect_name):
+    if dialect_name == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+
+        statement = insert(Inventory.__table__)
+        return statement.on_duplicate_key_update(
+            total_litres=Inventory.__table__.c.total_litres
+            + statement.inserted.total_litres,
+            date_received=statement.inserted.date_received,
+            best_before_date=statement.inserted.best_before_date,
+            location=statement.inserted.location,
+        )
+    if dialect_name in ("sqlite", "postgresql"):
+        if dialect_name == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+
+        statement = insert(Inventory.__table__)
+        return statement.on_conflict_do_update(
+            index_elements=["material"],
+            set_={
+                "total_litres": Inventory.__table__.c.total_litres
+                + statement.excluded.total_litres,
+                "date_received": statement.excluded.date_received,
+                "best_before_date": statement.excluded.best_before_date,
+                "location": statement.excluded.location,
+            },
+        )
+    raise ImportFileError(f"Bulk import is not supported on {dialect_name}")
+
+
+# Write one validated chunk and its receipts in a single transaction
+def apply_chunk(upsert, rows):
+    # Repeated materials within a chunk are combined into one upsert row
+    rows = rows.groupby("material", as_index=False, sort=False).agg(
+        {
+            "product_name": "first",
+            "total_litres": "sum",
+            "date_received": "last",
+            "best_before_date": "last",
+            "location": "last",
+        }
+    )
+    records = [
+        dict(record, total_litres=Decimal(str(round(record["total_litres"], 2))))
+        for record in rows.to_dict("records")
+    ]
+    materials = [record["material"] for record in records]
+
+    try:
+        # Items before the upsert, to tell which need reindexing and to
+        # update the dashboard counters
+        state = select(
+            Inventory.material,
+            Inventory.id,
+            Inventory.product_name,
+            Inventory.total_litres,
+            Inventory.best_before_date,
+            Inventory.location,
+        ).where(Inventory.material.in_(materials))
+        previous = {row.material: row for row in db.session.execute(state)}
+        db.session.execute(upsert, records)
+        current = {row.material: row for row in db.session.execute(state)}
+        # Log the receipts against the ids of the inserted or updated items
+        ids = {material: row.id for material, row in current.items()}
+        db.session.execute(
+            InventoryMovement.__table__.insert(),
+            [
+                {
+                    "inventory_id": ids[record["material"]],
+                    "material": record["material"],
+                    "kind": "receipt",
+                    "quantity": record["total_litres"],
+                }
+                for record in records
+            ],
+        )
+        # Only new items and moved ones change their searchable text; the
+        # upsert keeps the product name of existing items
+        reindex_inventory(
+            *(
+                ids[record["material"]]
+                for record in records
+                if record["material"] not in previous
+                or previous[record["material"]].location != record["location"]
+            )
+        )
+        record_changes(
+            *(
+                (item_state(previous.get(material)), item_state(row))
+                for material, row in current.items()
+            )
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_material(*materials)
+
+
+# Import inventory from an uploaded file and report what happened to each row
+def import_inventory(fileobj, filename, chunk_size=CHUNK_SIZE):
+    upsert = upsert_statement(db.engine.dialect.name)
+    report = {"rows": 0, "imported": 0, "failed": 0, "errors": []}
+    # Data starts on line 2, after the header
+    first_row = 2
+    chunks = read_chunks(fileobj, filename, chunk_size)
+    while True:
+        try:
+            chunk = next(chunks, None)
+        except (
+            pd.errors.ParserError,
+            pd.errors.EmptyDataError,
+            UnicodeDecodeError,
+            zipfile.BadZipFile,
+            InvalidFileException,
+        ) as e:
+            raise ImportFileError(f"Could not read the file: {e}")
+        if chunk is None:
+            break
+
+        missing = [name for name in COLUMNS if name not in chunk.columns]
+        if missing:
+            raise ImportFileError(f"Missing columns: {', '.join(missing)}")
+
+        rows, errors = validate_chunk(chunk, first_row)
+        if not rows.empty:
+            try:
+                apply_chunk(upsert, rows)
+            except Exception:
+                # The whole chunk was rolled back. The error may quote SQL or
+                # constraint names, so the rows only get a summary.
+                current_app.logger.exception(
+                    "Import of rows %d to %d failed",
+                    first_row,
+                    first_row + len(chunk) - 1,
+                )
+                errors.extend(
+                    (first_row + index, ["Could not be saved"]) for index in rows.index
+                )
+                errors.sort()
+            else:
+                report["imported"] += len(rows)
+
+        report["rows"] += len(chunk)
+        report["failed"] += len(errors)
+        room = MAX_REPORTED_ERRORS - len(report["errors"])
+        report["errors"].extend(
+            {"row": row, "errors": messages} for row, messages in errors[:room]
+        )
+        first_row += len(chunk)
+    return report
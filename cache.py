@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Sentinel for cache misses, so None can be cached as a value
+MISSING = object()
+
+
+# Thread-safe in-process cache with per-entry TTL and LRU eviction
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Bumped on every invalidation so loads that started earlier do not
+        # store a value read before the write
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, generation=None):
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    # Return the cached value for key, calling loader to fill it on a miss
+    def get_or_load(self, key, loader):
+        value = self.get(key, MISSING)
+        if value is not MISSING:
+            return value
+        generation = self.generation
+        value = loader()
+        self.set(key, value, generation)
+        return value
+
+    def invalidate(self, *keys):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+    # Drop every entry and start the statistics over
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,174 @@
+import random
+from datetime import date, timedelta
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import delete, event, func, or_, select
+from models import db, DashboardCounter, Inventory
+from thresholds import EXPIRY_WINDOW_DAYS, is_low_stock, low_stock_filter
+
+# Upper bounds in days of the expiring soon buckets
+EXPIRY_BUCKETS = (30, 60, EXPIRY_WINDOW_DAYS)
+
+
+# Counter changes for a list of (before, after) item states, where None
+# means the item did not exist
+def counter_deltas(changes):
+    deltas = {}
+
+    def add(name, bucket, amount):
+        deltas[(name, bucket)] = deltas.get((name, bucket), 0) + amount
+
+    for before, after in changes:
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None:
+                continue
+            add("skus", "", sign)
+            if is_low_stock(state):
+                add("low_stock", "", sign)
+            add("expiring", state.best_before_date, sign)
+            add("location_litres", state.location, sign * state.total_litres)
+    return {key: amount for key, amount in deltas.items() if amount}
+
+
+# Build an upsert that adds to counters, creating missing ones
+def increment_statement(dialect_name):
+    table = DashboardCounter.__table__
+    if dialect_name == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+
+        statement = insert(table)
+        return statement.on_duplicate_key_update(
+            value=table.c.value + statement.inserted.value
+        )
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    statement = insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=["name", "bucket", "shard"],
+        set_={"value": table.c.value + statement.excluded.value},
+    )
+
+
+# Shard of the counters the current transaction writes to. One shard per
+# transaction keeps its row locks in a single sorted run.
+def counter_shard():
+    if "dashboard_counter_shard" not in db.session.info:
+        shards = current_app.config.get("DASHBOARD_COUNTER_SHARDS", 16)
+        db.session.info["dashboard_counter_shard"] = random.randrange(shards)
+    return db.session.info["dashboard_counter_shard"]
+
+
+@event.listens_for(Session, "after_transaction_end")
+def forget_counter_shard(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("dashboard_counter_shard", None)
+
+
+# Apply the counter changes for changed items in the caller's transaction.
+# The version counter moves with every change, so it doubles as the ETag of
+# the summary.
+def apply_counter_changes(changes):
+    deltas = counter_deltas(changes)
+    deltas[("version", "")] = 1
+    shard = counter_shard()
+    # Always touch rows in the same order so concurrent writers cannot
+    # deadlock on them
+    db.session.execute(
+        increment_statement(db.session.get_bind().dialect.name),
+        [
+            {"name": name, "bucket": bucket, "shard": shard, "value": amount}
+            for (name, bucket), amount in sorted(deltas.items())
+        ],
+    )
+
+
+# Recompute every counter from the inventory table
+def rebuild_counters():
+    version = current_version()
+    db.session.execute(delete(DashboardCounter))
+    rows = [
+        {"name": "skus", "bucket": "", "value": Inventory.query.count()},
+        {
+            "name": "low_stock",
+            "bucket": "",
+            "value": db.session.scalar(
+                low_stock_filter(select(func.count(Inventory.id)))
+            ),
+        },
+        {"name": "version", "bucket": "", "value": version + 1},
+    ]
+    for name, column, total in (
+        ("expiring", Inventory.best_before_date, func.count(Inventory.id)),
+        ("location_litres", Inventory.location, func.sum(Inventory.total_litres)),
+    ):
+        rows.extend(
+            {"name": name, "bucket": str(bucket), "value": value}
+            for bucket, value in db.session.execute(
+                select(column, total).group_by(column)
+            )
+        )
+    db.session.execute(DashboardCounter.__table__.insert(), rows)
+    db.session.commit()
+
+
+def current_version():
+    value = db.session.scalar(
+        select(func.sum(DashboardCounter.value)).where(
+            DashboardCounter.name == "version", DashboardCounter.bucket == ""
+        )
+    )
+    return int(value or 0)
+
+
+# Strong ETag of the summary: it only changes with the counters, or with the
+# day, which moves items between expiry buckets
+def summary_etag(version, today):
+    return f"{version}-{today.isoformat()}"
+
+
+# Dashboard summary read from the counters in one query, adding up the
+# shards of each
+def dashboard_summary(today=None):
+    today = today or date.today()
+    cutoff = (today + timedelta(days=EXPIRY_BUCKETS[-1])).isoformat()
+    value = func.sum(DashboardCounter.value)
+    rows = db.session.execute(
+        select(DashboardCounter.name, DashboardCounter.bucket, value)
+        .where(
+            or_(
+                DashboardCounter.name != "expiring",
+                DashboardCounter.bucket <= cutoff,
+            )
+        )
+        .group_by(DashboardCounter.name, DashboardCounter.bucket)
+        .having(value != 0)
+    )
+
+    summary = {
+        "version": 0,
+        "total_skus": 0,
+        "low_stock": 0,
+        "expiring": {"expired": 0, **{str(days): 0 for days in EXPIRY_BUCKETS}},
+        "litres_by_location": {},
+    }
+    bounds = [
+        ((today + timedelta(days=days)).isoformat(), str(days))
+        for days in EXPIRY_BUCKETS
+    ]
+    for name, bucket, value in rows:
+        if name == "version":
+            summary["version"] = int(value)
+        elif name == "skus":
+            summary["total_skus"] = int(value)
+        elif name == "low_stock":
+            summary["low_stock"] = int(value)
+        elif name == "location_litres":
+            summary["litres_by_location"][bucket] = str(value)
+        elif bucket < today.isoformat():
+            summary["expiring"]["expired"] += int(value)
+        else:
+            label = next(label for bound, label in bounds if bucket <= bound)
+            summary["expiring"][label] += int(value)
+    return summary
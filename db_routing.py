@@ -0,0 +1,166 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+# Name of the read replica bind in SQLALCHEMY_BINDS
+REPLICA = "replica"
+
+
+# Build the engine options from the DB_* settings. Connections are checked
+# before use and recycled before MySQL's wait_timeout closes them, which is
+# what shows up as "MySQL server has gone away".
+def configure_engines(app):
+    app.config.setdefault("DB_POOL_SIZE", 10)
+    app.config.setdefault("DB_MAX_OVERFLOW", 20)
+    # Seconds a request waits for a free connection before failing
+    app.config.setdefault("DB_POOL_TIMEOUT", 10)
+    app.config.setdefault("DB_POOL_RECYCLE", 1800)
+    app.config.setdefault("DB_POOL_PRE_PING", True)
+    app.config.setdefault("SQLALCHEMY_REPLICA_URI", None)
+
+    options = {
+        "pool_pre_ping": app.config["DB_POOL_PRE_PING"],
+        "pool_recycle": app.config["DB_POOL_RECYCLE"],
+    }
+    # SQLite keeps the pool Flask-SQLAlchemy picks for it. An in-memory
+    # database lives on its one connection, which must never be replaced.
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        options = {"pool_pre_ping": False, "pool_recycle": -1}
+    elif url.get_backend_name() != "sqlite":
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_size=app.config["DB_POOL_SIZE"],
+            max_overflow=app.config["DB_MAX_OVERFLOW"],
+            pool_timeout=app.config["DB_POOL_TIMEOUT"],
+        )
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+    for key, value in options.items():
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"].setdefault(key, value)
+
+    # The replica shares the engine options of the primary
+    if app.config["SQLALCHEMY_REPLICA_URI"]:
+        app.config.setdefault("SQLALCHEMY_BINDS", {})
+        app.config["SQLALCHEMY_BINDS"][REPLICA] = app.config["SQLALCHEMY_REPLICA_URI"]
+
+
+# Checkout counts and the time spent waiting for a free connection,
+# shared by a pool and the pools that replace it when it is recreated
+class PoolMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, wait, timed_out=False):
+        with self.lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_total, 6),
+                "wait_seconds_max": round(self.wait_max, 6),
+            }
+
+
+# QueuePool that times each checkout, including the wait for a connection to
+# be returned when the pool and its overflow are in use
+class TimedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.metrics.record(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+# Usage of each engine's pool, keyed by bind name
+def pool_stats(engines):
+    stats = {}
+    for key, engine in engines.items():
+        pool = engine.pool
+        entry = {"pool": type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            entry.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=max(pool.overflow(), 0),
+                max_overflow=pool._max_overflow,
+            )
+        if isinstance(pool, TimedQueuePool):
+            entry.update(pool.metrics.stats())
+        stats[key or "primary"] = entry
+    return stats
+
+
+# Send the reads of the current app context to the replica, if one is
+# configured. Writes, flushes and locking reads still go to the primary.
+def use_replica():
+    g.read_replica = True
+
+
+# Send the reads of the block to the primary, even inside a read-only view
+@contextmanager
+def primary_reads():
+    previous = g.get("read_replica", False)
+    g.read_replica = False
+    try:
+        yield
+    finally:
+        g.read_replica = previous
+
+
+# Decorator for views that only read and can tolerate replication lag
+def replica_reads(view):
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        use_replica()
+        return view(*args, **kwargs)
+
+    return decorated_function
+
+
+def reads_from_replica(clause):
+    return (
+        has_app_context()
+        and g.get("read_replica", False)
+        and getattr(clause, "is_select", False)
+        and clause._for_update_arg is None
+    )
+
+
+# Session that sends plain SELECTs to the replica inside read-only views
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and reads_from_replica(clause):
+            engine = self._db.engines.get(REPLICA)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
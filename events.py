@@ -0,0 +1,295 @@
+import itertools
+import json
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import delete, event, insert, or_, select
+from sqlalchemy.orm import Session
+from models import db, StreamEvent
+
+# Seconds between keepalive comments on an idle stream
+HEARTBEAT_INTERVAL = 15
+# Recent events kept for clients reconnecting with Last-Event-ID
+HISTORY_SIZE = 256
+# Most events the relay reads from the table in one query
+RELAY_BATCH_SIZE = 1000
+# Widest jump in event ids whose skipped ids the relay waits for
+RELAY_MAX_GAP = 1000
+
+
+# One connected client. Its queue is bounded so a slow client cannot hold
+# on to an unbounded backlog; when it fills up the oldest event is dropped
+# and the client is told to resync.
+class Subscription:
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize)
+        self.lagged = False
+
+    def put(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.lagged = True
+                except queue.Empty:
+                    pass
+
+
+# In-process fan-out of events to the clients connected to this worker
+class EventBroker:
+    def __init__(self, queue_size=100, max_clients=5000):
+        self.queue_size = queue_size
+        self.max_clients = max_clients
+        self.subscriptions = set()
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.published = 0
+
+    # Size the broker from the app config
+    def init_app(self, app):
+        app.config.setdefault("EVENTS_QUEUE_SIZE", 100)
+        app.config.setdefault("EVENTS_MAX_CLIENTS", 5000)
+        app.config.setdefault("EVENTS_POLL_INTERVAL", 1)
+        app.config.setdefault("EVENTS_GAP_TIMEOUT", 60)
+        app.config.setdefault("EVENTS_KEEP_SECONDS", 3600)
+        self.queue_size = app.config["EVENTS_QUEUE_SIZE"]
+        self.max_clients = app.config["EVENTS_MAX_CLIENTS"]
+        app.extensions["event_relay"] = EventRelay(app, self)
+
+    # Register a client, replaying the events it missed since last_event_id.
+    # A client further behind than the history, or than the events left in
+    # the table, is told to resync first. Returns None when the broker is full.
+    def subscribe(self, last_event_id=None):
+        subscription = Subscription(self.queue_size)
+        with self.lock:
+            if len(self.subscriptions) >= self.max_clients:
+                return None
+            if last_event_id is not None:
+                if not self.history or self.history[0][0] > last_event_id + 1:
+                    subscription.lagged = True
+                for item in self.history:
+                    if item[0] > last_event_id:
+                        subscription.put(item)
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    # Replace the history, given as (id, event type, data) in id order
+    def remember(self, items):
+        with self.lock:
+            self.history.clear()
+            self.history.extend(items)
+
+    # Send an event to every client. Events relayed from the database keep
+    # their row id; others are numbered by the broker.
+    def publish(self, event_type, data, event_id=None):
+        with self.lock:
+            item = (
+                event_id if event_id is not None else next(self.ids),
+                event_type,
+                data,
+            )
+            self.history.append(item)
+            self.published += 1
+            for subscription in self.subscriptions:
+                subscription.put(item)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "clients": len(self.subscriptions),
+                "published": self.published,
+                "max_clients": self.max_clients,
+                "queue_size": self.queue_size,
+            }
+
+
+broker = EventBroker()
+
+
+# Relays committed events from the stream_event table to this worker's
+# broker, so its clients hear about writes served by every worker. A thread
+# started by the first stream polls for new rows every EVENTS_POLL_INTERVAL
+# seconds, and at once after a local commit, while any client is connected.
+# Event ids are row ids, so a client can resume on any worker.
+class EventRelay:
+    def __init__(self, app, broker):
+        self.app = app
+        self.broker = broker
+        self.thread = None
+        self.lock = threading.Lock()
+        self.wake_event = threading.Event()
+        # Highest id relayed, and the lower ids not yet committed when it was
+        # read, with when they were first missed
+        self.last_id = None
+        self.gaps = {}
+
+    # Register a client in the broker, catching up with the table first if
+    # nobody was listening and starting the relay thread if needed. Returns
+    # None when the broker is full. Tests relay synchronously with poll()
+    # instead.
+    def subscribe(self, last_event_id=None):
+        autostart = self.app.config.get("EVENTS_RELAY_AUTOSTART", not self.app.testing)
+        with self.lock:
+            if self.last_id is None or not self.broker.stats()["clients"]:
+                self.prime()
+            subscription = self.broker.subscribe(last_event_id)
+            if autostart and (self.thread is None or not self.thread.is_alive()):
+                self.thread = threading.Thread(
+                    target=self.run, name="event-relay", daemon=True
+                )
+                self.thread.start()
+        return subscription
+
+    # Load the latest events as the broker's history, for clients resuming
+    # from an event another worker sent them
+    def prime(self):
+        rows = db.session.execute(
+            select(StreamEvent.id, StreamEvent.event_type, StreamEvent.data)
+            .order_by(StreamEvent.id.desc())
+            .limit(HISTORY_SIZE)
+        ).all()
+        self.broker.remember(
+            [(row.id, row.event_type, json.loads(row.data)) for row in reversed(rows)]
+        )
+        self.last_id = rows[0].id if rows else 0
+        self.gaps = {}
+
+    def wake(self):
+        self.wake_event.set()
+
+    def run(self):
+        while True:
+            self.wake_event.wait(self.app.config["EVENTS_POLL_INTERVAL"])
+            self.wake_event.clear()
+            try:
+                with self.app.app_context():
+                    self.poll()
+            except Exception:
+                self.app.logger.exception("Event relay failed")
+
+    # Publish the events committed since the last poll. Ids are handed out
+    # before commit, so a lower id can commit after a higher one; skipped
+    # ids are looked for again for EVENTS_GAP_TIMEOUT seconds.
+    def poll(self):
+        with self.lock:
+            # Nobody is listening; the next client primes again
+            if not self.broker.stats()["clients"]:
+                return
+            criteria = StreamEvent.id > self.last_id
+            if self.gaps:
+                criteria = or_(criteria, StreamEvent.id.in_(list(self.gaps)))
+            rows = db.session.execute(
+                select(StreamEvent.id, StreamEvent.event_type, StreamEvent.data)
+                .where(criteria)
+                .order_by(StreamEvent.id)
+                .limit(RELAY_BATCH_SIZE)
+            ).all()
+            now = time.monotonic()
+            for row in rows:
+                self.gaps.pop(row.id, None)
+                if row.id > self.last_id:
+                    if row.id - self.last_id <= RELAY_MAX_GAP:
+                        for missing in range(self.last_id + 1, row.id):
+                            self.gaps[missing] = now
+                    self.last_id = row.id
+                self.broker.publish(row.event_type, json.loads(row.data), row.id)
+            timeout = self.app.config["EVENTS_GAP_TIMEOUT"]
+            self.gaps = {
+                missing: seen
+                for missing, seen in self.gaps.items()
+                if now - seen < timeout
+            }
+        if len(rows) == RELAY_BATCH_SIZE:
+            self.wake()
+
+
+# Format one server-sent event
+def format_event(event_id, event_type, data):
+    message = f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+    return f"id: {event_id}\n{message}" if event_id is not None else message
+
+
+# Server-sent event stream for a subscription. Idle streams get a keepalive
+# comment so proxies keep them open and closed clients are noticed.
+def stream(subscription, heartbeat=HEARTBEAT_INTERVAL):
+    try:
+        # Flush the headers and set the reconnect delay
+        yield "retry: 5000\n\n"
+        if subscription.lagged:
+            subscription.lagged = False
+            yield format_event(None, "resync", {})
+        while True:
+            try:
+                item = subscription.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if subscription.lagged:
+                subscription.lagged = False
+                yield format_event(None, "resync", {})
+            yield format_event(*item)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+# Queue an event to be stored in the stream_event table when the current
+# transaction commits, so clients never hear about changes that were rolled
+# back
+def queue_event(session, event_type, data):
+    data = dict(data, at=time.time())
+    session.info.setdefault("pending_events", []).append((event_type, data))
+
+
+# Delete events older than EVENTS_KEEP_SECONDS; clients further behind than
+# that resync instead of replaying them
+def purge_events():
+    db.session.execute(
+        delete(StreamEvent).where(
+            StreamEvent.created_at
+            < datetime.utcnow()
+            - timedelta(seconds=current_app.config["EVENTS_KEEP_SECONDS"])
+        )
+    )
+    db.session.commit()
+
+
+# Store the transaction's events in one statement, as part of it
+@event.listens_for(Session, "before_commit")
+def store_pending_events(session):
+    events = session.info.pop("pending_events", None)
+    if events:
+        session.execute(
+            insert(StreamEvent),
+            [
+                {"event_type": event_type, "data": json.dumps(data, default=str)}
+                for event_type, data in events
+            ],
+        )
+        session.info["events_stored"] = True
+
+
+# Have this worker's relay publish the events straight away; other workers
+# pick them up on their next poll
+@event.listens_for(Session, "after_commit")
+def wake_event_relay(session):
+    if session.info.pop("events_stored", False) and has_app_context():
+        relay = current_app.extensions.get("event_relay")
+        if relay is not None:
+            relay.wake()
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_pending_events(session):
+    session.info.pop("pending_events", None)
+    session.info.pop("events_stored", None)
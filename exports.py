@@ -0,0 +1,146 @@
+import csv
+import io
+import tempfile
+import time
+from contextlib import nullcontext
+from datetime import date, datetime
+from flask import Response, send_file, stream_with_context
+from cache import MISSING
+from db_routing import primary_reads
+from metrics import export_rows, export_seconds
+from models import db
+from response_cache import response_cache
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORT_FORMATS = ("xlsx", "csv")
+
+# Number of rows fetched from the database cursor at a time
+CHUNK_SIZE = 1000
+
+
+# Stream rows from a server-side cursor instead of loading them all with .all()
+def iter_rows(statement, chunk_size=CHUNK_SIZE):
+    result = db.session.execute(
+        statement.execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    yield tuple(result.keys())
+    for partition in result.partitions():
+        for row in partition:
+            yield tuple(row)
+
+
+# Convert a database value into a CSV cell
+def csv_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+# Write rows into an Excel sheet, holding only the current row in memory
+def write_xlsx(fileobj, statement, sheet_name):
+    # Loaded on first use to keep it out of worker startup
+    import xlsxwriter
+
+    rows = iter_rows(statement)
+    workbook = xlsxwriter.Workbook(
+        fileobj,
+        {
+            "constant_memory": True,
+            "default_date_format": "yyyy-mm-dd",
+            "remove_timezone": True,
+        },
+    )
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, next(rows))
+    row_count = 0
+    for row_count, row in enumerate(rows, start=1):
+        worksheet.write_row(row_count, 0, row)
+    workbook.close()
+    return row_count
+
+
+# Write rows into a CSV file
+def write_csv(fileobj, statement):
+    text = io.TextIOWrapper(fileobj, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    row_count = -1
+    for row_count, row in enumerate(iter_rows(statement)):
+        writer.writerow([csv_value(value) for value in row])
+    text.flush()
+    text.detach()
+    return row_count
+
+
+# Record how long an export took and how many rows it wrote
+def record_export(report, fmt, started, rows):
+    export_seconds.observe(time.perf_counter() - started, report=report, format=fmt)
+    export_rows.inc(rows, report=report, format=fmt)
+
+
+# Write a report into a binary file object and return the number of data rows
+def write_export(fileobj, statement, sheet_name, fmt="xlsx"):
+    started = time.perf_counter()
+    if fmt == "csv":
+        rows = write_csv(fileobj, statement)
+    else:
+        rows = write_xlsx(fileobj, statement, sheet_name)
+    record_export(sheet_name, fmt, started, rows)
+    return rows
+
+
+# Yield CSV output in chunks so the response starts before the query finishes
+def iter_csv(statement, sheet_name, chunk_size=CHUNK_SIZE):
+    started = time.perf_counter()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for index, row in enumerate(iter_rows(statement), start=1):
+        writer.writerow([csv_value(value) for value in row])
+        if index % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    # Every line but the header is a row
+    record_export(sheet_name, "csv", started, index - 1)
+    yield buffer.getvalue()
+
+
+# Build a download response for a report query in the requested format.
+# Excel files are cached while the cache scopes given are unchanged.
+def export_response(statement, filename, sheet_name, fmt="xlsx", cache_scopes=None):
+    if fmt == "csv":
+        return Response(
+            stream_with_context(iter_csv(statement, sheet_name)),
+            mimetype="text/csv",
+            headers={"Content-Disposition": f"attachment; filename={filename}.csv"},
+        )
+
+    key = response_cache.key(cache_scopes) if cache_scopes else None
+    if key:
+        data = response_cache.get(key)
+        if data is not MISSING:
+            return xlsx_response(io.BytesIO(data), filename)
+
+    # Excel files are zip archives, so the sheet is spooled to a temporary file
+    # on disk and then streamed to the client in chunks
+    output = tempfile.TemporaryFile()
+    started = time.perf_counter()
+    # A cached file is built from the primary, so a lagging replica is never
+    # stored under the newer generations of its key
+    with primary_reads() if key else nullcontext():
+        rows = write_xlsx(output, statement, sheet_name)
+    record_export(sheet_name, "xlsx", started, rows)
+    if key and output.tell() <= response_cache.max_bytes:
+        output.seek(0)
+        response_cache.set(key, output.read())
+    output.seek(0)
+    return xlsx_response(output, filename)
+
+
+# Send an Excel file as a download
+def xlsx_response(fileobj, filename):
+    return send_file(
+        fileobj,
+        mimetype=XLSX_MIMETYPE,
+        as_attachment=True,
+        download_name=f"{filename}.xlsx",
+    )
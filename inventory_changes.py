@@ -0,0 +1,93 @@
+from collections import namedtuple
+from decimal import Decimal
+from alerts import apply_alert_changes
+from dashboard_counters import apply_counter_changes
+from events import queue_event
+from models import db
+from thresholds import expiry_transition, low_stock_transition, thresholds_for
+
+# The parts of an inventory item the counters, alerts and events depend on,
+# with the thresholds that apply to it
+ItemState = namedtuple(
+    "ItemState",
+    [
+        "inventory_id",
+        "material",
+        "total_litres",
+        "best_before_date",
+        "location",
+        "low_stock_litres",
+        "expiry_days",
+    ],
+)
+
+
+def item_state(item):
+    if item is None:
+        return None
+    material = (
+        str(int(item.material))
+        if isinstance(item.material, Decimal)
+        else str(item.material)
+    )
+    # Forms assign dates as YYYY-MM-DD text before the row is reloaded
+    return ItemState(
+        item.id,
+        material,
+        Decimal(str(item.total_litres)),
+        str(item.best_before_date)[:10],
+        item.location,
+        *thresholds_for(material, item.product_name, item.location),
+    )
+
+
+# Queue live events for changed items: every change, plus items that drop to
+# the low stock threshold or into the expiring soon window
+def queue_change_events(changes):
+    for before, after in changes:
+        item = after or before
+        queue_event(
+            db.session,
+            "stock-change",
+            {
+                "inventory_id": item.inventory_id,
+                "material": item.material,
+                "total_litres": str(after.total_litres) if after else None,
+                "change": (
+                    "created"
+                    if before is None
+                    else "deleted" if after is None else "updated"
+                ),
+            },
+        )
+        if low_stock_transition(before, after) == "raised":
+            queue_event(
+                db.session,
+                "low-stock",
+                {
+                    "inventory_id": after.inventory_id,
+                    "material": after.material,
+                    "total_litres": str(after.total_litres),
+                    "low_stock_litres": str(after.low_stock_litres),
+                },
+            )
+        if expiry_transition(before, after) == "raised":
+            queue_event(
+                db.session,
+                "expiry",
+                {
+                    "inventory_id": after.inventory_id,
+                    "material": after.material,
+                    "best_before_date": after.best_before_date,
+                },
+            )
+
+
+# Record changes to inventory items, given as (before, after) item states
+# where None means the item did not exist. Updates the dashboard counters
+# and alert states in the caller's transaction, and queues live events for
+# when it commits.
+def record_changes(*changes):
+    apply_counter_changes(changes)
+    apply_alert_changes(changes)
+    queue_change_events(changes)
@@ -0,0 +1,50 @@
+from decimal import Decimal, InvalidOperation
+from cache import TTLCache
+from models import db, Inventory
+from reports import inventory_statement
+
+# Read-through cache of inventory items keyed by material code. Entries are
+# plain dicts rather than ORM objects so they can outlive the request session.
+material_cache = TTLCache()
+
+
+# Size the material cache from the app config
+def init_material_cache(app):
+    app.config.setdefault("MATERIAL_CACHE_SIZE", 4096)
+    app.config.setdefault("MATERIAL_CACHE_TTL", 60)
+    material_cache.maxsize = app.config["MATERIAL_CACHE_SIZE"]
+    material_cache.ttl = app.config["MATERIAL_CACHE_TTL"]
+
+
+# Canonical form of a material code, so "1000", "01000" and "1000.0" share
+# one entry. None if the code is not a whole number.
+def material_key(material_code):
+    try:
+        code = Decimal(str(material_code).strip())
+    except InvalidOperation:
+        return None
+    if not code.is_finite() or code != code.to_integral_value():
+        return None
+    return str(int(code))
+
+
+# Load an inventory item by material code from the database
+def load_material(material_code):
+    row = db.session.execute(
+        inventory_statement().where(Inventory.material == material_code)
+    ).first()
+    return dict(row._mapping) if row else None
+
+
+# Get an inventory item by material code, or None if it does not exist
+def lookup_material(material_code):
+    key = material_key(material_code)
+    if key is None:
+        return None
+    return material_cache.get_or_load(key, lambda: load_material(Decimal(key)))
+
+
+# Drop cached entries after a write to the given material codes
+def invalidate_material(*material_codes):
+    keys = (material_key(code) for code in material_codes if code is not None)
+    material_cache.invalidate(*(key for key in keys if key is not None))
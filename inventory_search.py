@@ -0,0 +1,234 @@
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import and_, delete, func, literal, select, union_all
+from cache import TTLCache
+from models import db, Inventory, InventoryTrigram, DeletedInventory
+
+# Fields of the inventory list that can be searched by substring
+SEARCH_FIELDS = ("material", "product_name", "location")
+MAX_PER_PAGE = 100
+# Trigram frequencies are only counted up to this many items; past it a
+# trigram is too common to be worth telling apart
+TRIGRAM_COUNT_CAP = 10000
+
+# Approximate number of items containing each (field, trigram), used to pick
+# the most selective trigram of a search
+trigram_counts = TTLCache(maxsize=8192, ttl=300)
+
+
+class CursorError(ValueError):
+    pass
+
+
+# Text stored in the index for a field value
+def search_text(value):
+    if value is None:
+        return ""
+    return str(value).strip().lower()
+
+
+# Every three character sequence in a piece of text
+def trigrams(text):
+    return {text[index : index + 3] for index in range(len(text) - 2)}
+
+
+# Rewrite the search index rows of the given items from their current values,
+# in the caller's transaction. Items that no longer exist are dropped from the
+# index.
+def reindex_inventory(*inventory_ids):
+    inventory_ids = [inventory_id for inventory_id in inventory_ids if inventory_id]
+    if not inventory_ids:
+        return
+    db.session.execute(
+        delete(InventoryTrigram).where(InventoryTrigram.inventory_id.in_(inventory_ids))
+    )
+    rows = db.session.execute(
+        select(
+            Inventory.id, *(getattr(Inventory, field) for field in SEARCH_FIELDS)
+        ).where(Inventory.id.in_(inventory_ids))
+    )
+    entries = [
+        {"field": field, "trigram": trigram, "inventory_id": row.id}
+        for row in rows
+        for field in SEARCH_FIELDS
+        for trigram in trigrams(search_text(getattr(row, field)))
+    ]
+    if entries:
+        db.session.execute(InventoryTrigram.__table__.insert(), entries)
+
+
+# Capped item counts of each (field, trigram), counting the uncached ones in
+# a single query
+def trigram_frequencies(keys):
+    counts = {key: trigram_counts.get(key) for key in keys}
+    missing = [key for key, count in counts.items() if count is None]
+    if missing:
+        generation = trigram_counts.generation
+        rows = db.session.execute(
+            union_all(
+                *(
+                    select(
+                        literal(index).label("key"),
+                        select(func.count())
+                        .select_from(
+                            select(InventoryTrigram.inventory_id)
+                            .where(
+                                InventoryTrigram.field == field,
+                                InventoryTrigram.trigram == trigram,
+                            )
+                            .limit(TRIGRAM_COUNT_CAP)
+                            .subquery()
+                        )
+                        .scalar_subquery()
+                        .label("items"),
+                    )
+                    for index, (field, trigram) in enumerate(missing)
+                )
+            )
+        )
+        for index, items in rows:
+            counts[missing[index]] = items
+            trigram_counts.set(missing[index], items, generation)
+    return counts
+
+
+# Add substring filters to an inventory query and return it with the column
+# to page by. The query is driven by the index entries of the rarest trigram
+# across the search terms, which are already in item id order; every term is
+# then checked as a substring. Terms shorter than three characters have no
+# trigrams and are only checked by the LIKE.
+def apply_filters(statement, filters):
+    filters = {
+        field: term.strip() for field, term in filters.items() if term and term.strip()
+    }
+    keys = [
+        (field, trigram)
+        for field, term in filters.items()
+        for trigram in sorted(trigrams(search_text(term)))
+    ]
+    key_column = Inventory.id
+    if keys:
+        counts = trigram_frequencies(keys)
+        field, trigram = min(keys, key=lambda key: counts[key])
+        statement = statement.join(
+            InventoryTrigram,
+            and_(
+                InventoryTrigram.inventory_id == Inventory.id,
+                InventoryTrigram.field == field,
+                InventoryTrigram.trigram == trigram,
+            ),
+        )
+        key_column = InventoryTrigram.inventory_id
+    for field, term in filters.items():
+        statement = statement.where(getattr(Inventory, field).ilike(f"%{term}%"))
+    return statement, key_column
+
+
+def cursor_serializer():
+    return URLSafeSerializer(current_app.secret_key, salt="inventory-cursor")
+
+
+def encode_cursor(inventory_id, direction):
+    return cursor_serializer().dumps([inventory_id, direction])
+
+
+# Read a next/prev token back into (id, direction)
+def decode_cursor(token):
+    try:
+        inventory_id, direction = cursor_serializer().loads(token)
+    except (BadSignature, TypeError, ValueError):
+        raise CursorError("Invalid cursor")
+    if not isinstance(inventory_id, int) or direction not in ("next", "prev"):
+        raise CursorError("Invalid cursor")
+    return inventory_id, direction
+
+
+# Fetch one page of a statement ordered by item id, seeking from the cursor
+# instead of skipping rows, so every page costs the same
+def keyset_page(statement, key_column, cursor=None, per_page=10):
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    inventory_id, direction = decode_cursor(cursor) if cursor else (None, "next")
+
+    if direction == "prev":
+        if inventory_id is not None:
+            statement = statement.where(key_column < inventory_id)
+        statement = statement.order_by(key_column.desc())
+    else:
+        if inventory_id is not None:
+            statement = statement.where(key_column > inventory_id)
+        statement = statement.order_by(key_column)
+
+    # One extra row tells whether there is another page in this direction
+    rows = db.session.execute(statement.limit(per_page + 1)).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == "prev":
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = inventory_id is not None, more
+
+    return {
+        "items": rows,
+        "next": encode_cursor(rows[-1].id, "next") if rows and has_next else None,
+        "prev": encode_cursor(rows[0].id, "prev") if rows and has_prev else None,
+    }
+
+
+# Search the inventory list and return one page, with the total number of
+# matches unless the caller skips the count
+def search_inventory(filters, cursor=None, per_page=10, with_total=True):
+    statement, key_column = apply_filters(
+        select(
+            Inventory.id,
+            Inventory.material,
+            Inventory.product_name,
+            Inventory.location,
+            Inventory.total_litres,
+        ),
+        filters,
+    )
+    page = keyset_page(statement, key_column, cursor, per_page)
+    page["total"] = None
+    if with_total:
+        count, _ = apply_filters(select(func.count(Inventory.id)), filters)
+        page["total"] = db.session.scalar(count)
+    return page
+
+
+# Columns the lazy-loaded tables can ask for, by model
+ROW_COLUMNS = {
+    Inventory: (
+        "id",
+        "material",
+        "product_name",
+        "total_litres",
+        "date_received",
+        "best_before_date",
+        "location",
+    ),
+    DeletedInventory: (
+        "id",
+        "original_id",
+        "material",
+        "product_name",
+        "total_litres",
+        "date_received",
+        "best_before_date",
+        "location",
+        "date_deleted",
+    ),
+}
+
+
+# One page of a table in id order, selecting only the requested columns
+def row_page(model, fields=None, cursor=None, per_page=50):
+    allowed = ROW_COLUMNS[model]
+    fields = fields or allowed
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    # The id is always needed for the cursor
+    fields = ["id"] + [field for field in fields if field != "id"]
+    statement = select(*(getattr(model, field) for field in fields))
+    return keyset_page(statement, model.id, cursor, per_page)
@@ -0,0 +1,144 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+from analytics import date_bucket
+from models import db, InventoryMovement, InventorySnapshot
+
+# Number of items whose previous snapshot is loaded per query
+SNAPSHOT_BATCH_SIZE = 500
+
+# Most days a stock history may span, which bounds the response size
+MAX_HISTORY_DAYS = 1000
+
+
+# Add a stock movement to the session, to be committed with the change itself
+def record_movement(inventory_item, kind, quantity):
+    db.session.add(
+        InventoryMovement(
+            inventory_id=inventory_item.id,
+            material=inventory_item.material,
+            kind=kind,
+            quantity=quantity,
+        )
+    )
+
+
+# Start of the day after the given date, i.e. the end of that day
+def day_end(day):
+    return datetime.combine(day + timedelta(days=1), time.min)
+
+
+# Latest inventory id recorded in the ledger for a material code, which also
+# finds items that have since been deleted
+def inventory_id_for_material(material_code):
+    return db.session.scalar(
+        select(InventoryMovement.inventory_id)
+        .where(InventoryMovement.material == material_code)
+        .order_by(InventoryMovement.id.desc())
+        .limit(1)
+    )
+
+
+# Materialize the end-of-day stock of every item that moved since the last
+# snapshot. Items that did not move keep their previous snapshot, so each run
+# only reads the ledger rows written since the previous run.
+def build_snapshots(snapshot_date=None):
+    snapshot_date = snapshot_date or datetime.utcnow().date() - timedelta(days=1)
+    watermark = db.session.scalar(select(func.max(InventorySnapshot.snapshot_date)))
+    if watermark and watermark >= snapshot_date:
+        return 0
+
+    # Net movement per item since the last snapshot
+    changes = select(
+        InventoryMovement.inventory_id, func.sum(InventoryMovement.quantity)
+    ).where(InventoryMovement.created_at < day_end(snapshot_date))
+    if watermark:
+        changes = changes.where(InventoryMovement.created_at >= day_end(watermark))
+    changes = dict(
+        db.session.execute(changes.group_by(InventoryMovement.inventory_id)).all()
+    )
+
+    # Previous snapshot of each changed item
+    latest = aliased(InventorySnapshot)
+    inventory_ids = list(changes)
+    for start in range(0, len(inventory_ids), SNAPSHOT_BATCH_SIZE):
+        batch = inventory_ids[start : start + SNAPSHOT_BATCH_SIZE]
+        previous = dict(
+            db.session.execute(
+                select(
+                    InventorySnapshot.inventory_id, InventorySnapshot.total_litres
+                ).where(
+                    InventorySnapshot.inventory_id.in_(batch),
+                    InventorySnapshot.snapshot_date
+                    == select(func.max(latest.snapshot_date))
+                    .where(latest.inventory_id == InventorySnapshot.inventory_id)
+                    .scalar_subquery(),
+                )
+            ).all()
+        )
+        db.session.execute(
+            InventorySnapshot.__table__.insert(),
+            [
+                {
+                    "inventory_id": inventory_id,
+                    "snapshot_date": snapshot_date,
+                    "total_litres": previous.get(inventory_id, Decimal(0))
+                    + changes[inventory_id],
+                }
+                for inventory_id in batch
+            ],
+        )
+    db.session.commit()
+    return len(inventory_ids)
+
+
+# Stock of an item at the end of a day: the latest snapshot on or before that
+# day plus the ledger movements recorded after it
+def stock_on(inventory_id, day):
+    snapshot = db.session.execute(
+        select(InventorySnapshot.snapshot_date, InventorySnapshot.total_litres)
+        .where(
+            InventorySnapshot.inventory_id == inventory_id,
+            InventorySnapshot.snapshot_date <= day,
+        )
+        .order_by(InventorySnapshot.snapshot_date.desc())
+        .limit(1)
+    ).first()
+
+    delta = select(func.coalesce(func.sum(InventoryMovement.quantity), 0)).where(
+        InventoryMovement.inventory_id == inventory_id,
+        InventoryMovement.created_at < day_end(day),
+    )
+    if snapshot:
+        delta = delta.where(
+            InventoryMovement.created_at >= day_end(snapshot.snapshot_date)
+        )
+    total = snapshot.total_litres if snapshot else Decimal(0)
+    return total + Decimal(db.session.scalar(delta))
+
+
+# End-of-day stock of an item for every day in a range
+def stock_history(inventory_id, start_date, end_date):
+    total = stock_on(inventory_id, start_date - timedelta(days=1))
+
+    day = date_bucket("day", InventoryMovement.created_at).label("day")
+    daily = dict(
+        db.session.execute(
+            select(day, func.sum(InventoryMovement.quantity))
+            .where(
+                InventoryMovement.inventory_id == inventory_id,
+                InventoryMovement.created_at >= day_end(start_date - timedelta(days=1)),
+                InventoryMovement.created_at < day_end(end_date),
+            )
+            .group_by(day)
+        ).all()
+    )
+
+    history = []
+    current = start_date
+    while current <= end_date:
+        total += Decimal(daily.get(current, 0))
+        history.append((current, total))
+        current += timedelta(days=1)
+    return history
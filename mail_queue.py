@@ -0,0 +1,260 @@
+import json
+import random
+import smtplib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from flask_mail import BadHeaderError, Message
+from sqlalchemy import delete, event, func, select, update
+from sqlalchemy.orm import Session
+from metrics import mail_messages, mail_send_seconds
+from models import db, OutboundEmail
+
+# Message states
+QUEUED = "queued"
+SENT = "sent"
+FAILED = "failed"
+
+
+# Whether an SMTP error will not go away by sending again later
+def is_permanent(error):
+    if isinstance(error, BadHeaderError):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+# The mail queue of one app in this process: the Flask-Mail instance it
+# sends with and its sender thread
+class MailQueueState:
+    def __init__(self, app, mail):
+        self.app = app
+        self.mail = mail
+        self.thread = None
+        self.lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self.purged_at = 0
+
+
+# Outbound email queue. Messages are stored in the caller's transaction, so
+# they go out only if it commits and requests never wait on the SMTP server.
+# A background thread sends due messages in batches over one reused SMTP
+# connection and retries failures with exponential backoff. Messages are
+# claimed before sending, so senders in several worker processes can share
+# the queue. Each app keeps its own state in app.extensions["mail_queue"].
+class MailQueue:
+    def __init__(self, app=None, mail=None):
+        if app is not None:
+            self.init_app(app, mail)
+
+    def init_app(self, app, mail):
+        app.config.setdefault("MAIL_QUEUE_BATCH_SIZE", 50)
+        app.config.setdefault("MAIL_QUEUE_POLL_INTERVAL", 30)
+        app.config.setdefault("MAIL_QUEUE_MAX_ATTEMPTS", 8)
+        # Seconds before the first retry, doubling with every attempt
+        app.config.setdefault("MAIL_QUEUE_RETRY_DELAY", 30)
+        app.config.setdefault("MAIL_QUEUE_MAX_RETRY_DELAY", 3600)
+        # Seconds a claimed message is held before another sender may retry
+        # it, in case the sender holding it died
+        app.config.setdefault("MAIL_QUEUE_LEASE", 300)
+        app.config.setdefault("MAIL_QUEUE_KEEP_DAYS", 7)
+        app.extensions["mail_queue"] = MailQueueState(app, mail)
+
+    @property
+    def state(self):
+        return current_app.extensions["mail_queue"]
+
+    # Add a message to the caller's session; the sender is woken when the
+    # session commits
+    def queue(self, message, session=None):
+        session = session or db.session
+        session.add(
+            OutboundEmail(
+                subject=message.subject,
+                sender=message.sender,
+                recipients=json.dumps(list(message.recipients)),
+                body=message.body,
+                html=message.html,
+            )
+        )
+        session.info["mail_queue"] = (self, self.state)
+
+    # Start the app's sender thread if needed and have it look for due
+    # messages. Tests send synchronously with send_pending() instead.
+    def wake(self, state):
+        app = state.app
+        if not app.config.get("MAIL_QUEUE_AUTOSTART", not app.testing):
+            return
+        with state.lock:
+            if state.thread is None or not state.thread.is_alive():
+                state.thread = threading.Thread(
+                    target=self.run, args=(state,), name="mail-queue", daemon=True
+                )
+                state.thread.start()
+        state.wake_event.set()
+
+    def run(self, state):
+        while True:
+            state.wake_event.clear()
+            try:
+                with state.app.app_context():
+                    self.send_pending()
+                    if time.time() - state.purged_at > 3600:
+                        self.purge()
+            except Exception:
+                state.app.logger.exception("Mail queue sender failed")
+            state.wake_event.wait(state.app.config["MAIL_QUEUE_POLL_INTERVAL"])
+
+    # Claim a batch of due messages for this sender. Claimed messages are not
+    # due again until the lease runs out.
+    def claim(self):
+        now = datetime.utcnow()
+        ids = db.session.scalars(
+            select(OutboundEmail.id)
+            .where(OutboundEmail.status == QUEUED, OutboundEmail.next_attempt_at <= now)
+            .order_by(OutboundEmail.next_attempt_at, OutboundEmail.id)
+            .limit(current_app.config["MAIL_QUEUE_BATCH_SIZE"])
+        ).all()
+        if not ids:
+            return []
+        token = uuid.uuid4().hex
+        db.session.execute(
+            update(OutboundEmail)
+            .where(
+                OutboundEmail.id.in_(ids),
+                OutboundEmail.status == QUEUED,
+                OutboundEmail.next_attempt_at <= now,
+            )
+            .values(
+                claimed_by=token,
+                next_attempt_at=now
+                + timedelta(seconds=current_app.config["MAIL_QUEUE_LEASE"]),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return db.session.scalars(
+            select(OutboundEmail)
+            .where(OutboundEmail.claimed_by == token)
+            .order_by(OutboundEmail.id)
+        ).all()
+
+    # Send every due message, batch after batch over one SMTP connection.
+    # Returns the number sent.
+    def send_pending(self):
+        batch = self.claim()
+        if not batch:
+            return 0
+        sent = 0
+        try:
+            with self.state.mail.connect() as connection:
+                while batch:
+                    sent += self.deliver(connection, batch)
+                    batch = self.claim()
+        except OSError as e:
+            # Connecting failed or the connection dropped (SMTP errors are
+            # OSErrors too): the rest of the batch waits for the next attempt
+            mail_messages.inc(len(batch), result="deferred")
+            self.retry(batch, e)
+        return sent
+
+    # Send a batch over an open connection, removing messages from it as they
+    # are dealt with. Errors of the connection itself are raised.
+    def deliver(self, connection, batch):
+        sent = 0
+        try:
+            while batch:
+                email = batch[0]
+                started = time.perf_counter()
+                try:
+                    connection.send(
+                        Message(
+                            email.subject,
+                            recipients=json.loads(email.recipients),
+                            body=email.body,
+                            html=email.html,
+                            sender=email.sender,
+                        )
+                    )
+                except smtplib.SMTPServerDisconnected:
+                    raise
+                except (smtplib.SMTPException, BadHeaderError) as e:
+                    # Rejected by the server; socket errors are raised
+                    self.retry([email], e)
+                    mail_messages.inc(result="rejected")
+                else:
+                    mail_send_seconds.observe(time.perf_counter() - started)
+                    mail_messages.inc(result="sent")
+                    email.status = SENT
+                    email.sent_at = datetime.utcnow()
+                    email.claimed_by = None
+                    sent += 1
+                batch.pop(0)
+        finally:
+            db.session.commit()
+        return sent
+
+    # Schedule messages for another attempt, or give up on them
+    def retry(self, emails, error):
+        now = datetime.utcnow()
+        for email in emails:
+            email.attempts += 1
+            email.last_error = str(error)[:1000]
+            email.claimed_by = None
+            if (
+                is_permanent(error)
+                or email.attempts >= current_app.config["MAIL_QUEUE_MAX_ATTEMPTS"]
+            ):
+                email.status = FAILED
+                continue
+            delay = min(
+                current_app.config["MAIL_QUEUE_RETRY_DELAY"]
+                * 2 ** (email.attempts - 1),
+                current_app.config["MAIL_QUEUE_MAX_RETRY_DELAY"],
+            )
+            # Jitter spreads out retries of messages that failed together
+            email.next_attempt_at = now + timedelta(
+                seconds=delay * random.uniform(0.8, 1.2)
+            )
+        db.session.commit()
+
+    # Delete sent messages older than the retention period
+    def purge(self):
+        db.session.execute(
+            delete(OutboundEmail).where(
+                OutboundEmail.status == SENT,
+                OutboundEmail.sent_at
+                < datetime.utcnow()
+                - timedelta(days=current_app.config["MAIL_QUEUE_KEEP_DAYS"]),
+            )
+        )
+        db.session.commit()
+        self.state.purged_at = time.time()
+
+    def stats(self):
+        counts = dict(
+            db.session.execute(
+                select(OutboundEmail.status, func.count()).group_by(
+                    OutboundEmail.status
+                )
+            ).all()
+        )
+        return {status: counts.get(status, 0) for status in (QUEUED, SENT, FAILED)}
+
+
+@event.listens_for(Session, "after_commit")
+def wake_mail_queue(session):
+    queued = session.info.pop("mail_queue", None)
+    if queued is not None:
+        mail_queue, state = queued
+        mail_queue.wake(state)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_mail_queue_wake(session):
+    session.info.pop("mail_queue", None)
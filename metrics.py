@@ -0,0 +1,490 @@
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from db_routing import pool_stats
+from models import db
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds of the latency buckets in seconds
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+EXPORT_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300)
+JOB_BUCKETS = (1, 5, 30, 60, 300, 900, 3600)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500)
+
+# Every metric of this process, in the order they are rendered
+REGISTRY = []
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield self.name, self.labels, key, value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=REQUEST_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.lock = threading.Lock()
+        # Per label set: [count per bucket, sum, count]
+        self.values = {}
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0, 0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self.values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        with self.lock:
+            values = {
+                key: (list(counts), total, count)
+                for key, (counts, total, count) in self.values.items()
+            }
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield (
+                    f"{self.name}_bucket",
+                    self.labels + ("le",),
+                    key + (number(bound),),
+                    cumulative,
+                )
+            yield f"{self.name}_sum", self.labels, key, total
+            yield f"{self.name}_count", self.labels, key, count
+
+
+# Values read when the metrics are scraped, from a function returning
+# {label values: value}. Totals kept elsewhere are exported as counters.
+class Gauge:
+    def __init__(self, name, documentation, labels, collect, kind="gauge"):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.collect = collect
+        REGISTRY.append(self)
+
+    def samples(self):
+        for key, value in sorted(self.collect().items()):
+            yield self.name, self.labels, key, value
+
+
+# All metrics in the Prometheus text format. With a directory, the totals
+# of every process writing its metrics there: counters and histograms are
+# summed over all of them, gauges over the ones still running.
+def render_metrics(directory=None):
+    samples = merged_samples(directory) if directory else None
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        if samples is None:
+            rows = metric.samples()
+        else:
+            rows = (
+                (name, labels, tuple(key), value)
+                for name, labels, key, value in samples.get(metric.name, ())
+            )
+        for name, labels, key, value in rows:
+            lines.append(f"{name}{label_text(labels, key)} {number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# Sharing metrics between the worker processes of a host. Each process
+# writes every sample of its registry to its own file in METRICS_DIR, every
+# METRICS_FLUSH_INTERVAL seconds and whenever it serves /metrics. The files
+# of processes that have exited are folded into one archive file, so their
+# counts stay in the totals.
+
+# File of this process, named when first written so that forked workers
+# each get their own
+process_file = {"pid": None, "path": None}
+flusher = {"pid": None, "thread": None}
+flusher_lock = threading.Lock()
+
+
+def own_file(directory):
+    if process_file["pid"] != os.getpid():
+        process_file["pid"] = os.getpid()
+        process_file["path"] = os.path.join(
+            directory, f"metrics-{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+        )
+    return process_file["path"]
+
+
+def write_samples(directory):
+    os.makedirs(directory, exist_ok=True)
+    samples = {
+        metric.name: [list(sample) for sample in metric.samples()]
+        for metric in REGISTRY
+    }
+    path = own_file(directory)
+    with open(path + ".part", "w") as output:
+        json.dump({"pid": os.getpid(), "samples": samples}, output)
+    os.replace(path + ".part", path)
+
+
+def read_samples(path):
+    try:
+        with open(path) as source:
+            return json.load(source)
+    except (OSError, ValueError):
+        return None
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Add one process's samples to totals keyed by metric and sample
+def add_samples(totals, samples, gauges=True):
+    kinds = {metric.name: metric.kind for metric in REGISTRY}
+    for metric_name, rows in samples.items():
+        if not gauges and kinds.get(metric_name) == "gauge":
+            continue
+        metric_totals = totals.setdefault(metric_name, {})
+        for name, labels, key, value in rows:
+            sample = (name, tuple(labels), tuple(key))
+            metric_totals[sample] = metric_totals.get(sample, 0) + value
+
+
+# Samples of every process writing to the directory, as
+# {metric name: [(name, labels, key, value)]} in the order they render
+def merged_samples(directory):
+    write_samples(directory)
+    archive = os.path.join(directory, "metrics-archive.json")
+    with open(os.path.join(directory, "metrics.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archived = {}
+        for metric_name, rows in (read_samples(archive) or {}).items():
+            archived[metric_name] = {
+                (name, tuple(labels), tuple(key)): value
+                for name, labels, key, value in rows
+            }
+        live = []
+        folded = []
+        for entry in os.scandir(directory):
+            if not (entry.name.startswith("metrics-") and entry.name.endswith(".json")):
+                continue
+            if entry.path == archive:
+                continue
+            data = read_samples(entry.path)
+            if data is None:
+                continue
+            if process_alive(data["pid"]):
+                live.append(data["samples"])
+            else:
+                # Counts of an exited process stay; its gauges go
+                add_samples(archived, data["samples"], gauges=False)
+                folded.append(entry.path)
+        if folded:
+            with open(archive + ".part", "w") as output:
+                json.dump(
+                    {
+                        metric_name: [
+                            [name, list(labels), list(key), value]
+                            for (name, labels, key), value in rows.items()
+                        ]
+                        for metric_name, rows in archived.items()
+                    },
+                    output,
+                )
+            os.replace(archive + ".part", archive)
+            for path in folded:
+                os.remove(path)
+    totals = archived
+    for samples in live:
+        add_samples(totals, samples)
+    return {
+        metric_name: [
+            (name, labels, key, value)
+            for (name, labels, key), value in sorted(rows.items(), key=sample_order)
+        ]
+        for metric_name, rows in totals.items()
+    }
+
+
+# Histogram buckets in bound order, then their sum and count, per label set
+def sample_order(item):
+    (name, labels, key), value = item
+    if labels and labels[-1] == "le":
+        bound = key[-1]
+        return (key[:-1], 0, float("inf") if bound == "+Inf" else float(bound))
+    suffix = 2 if name.endswith("_count") else 1
+    return (key, suffix, 0)
+
+
+# Write this process's samples every METRICS_FLUSH_INTERVAL seconds from a
+# daemon thread, started on the first request of each process
+def start_flushing(app):
+    with flusher_lock:
+        if flusher["pid"] == os.getpid() and flusher["thread"].is_alive():
+            return
+        flusher["pid"] = os.getpid()
+        flusher["thread"] = threading.Thread(
+            target=flush_samples, args=(app,), name="metrics-flush", daemon=True
+        )
+        flusher["thread"].start()
+
+
+def flush_samples(app):
+    while True:
+        time.sleep(app.config["METRICS_FLUSH_INTERVAL"])
+        directory = app.config["METRICS_DIR"]
+        if not directory:
+            return
+        try:
+            with app.app_context():
+                write_samples(directory)
+        except OSError:
+            app.logger.exception("Writing metrics failed")
+
+
+# Pool figures of each bind, read inside the app context of the scrape
+def pool_values(field):
+    def collect():
+        if not has_app_context():
+            return {}
+        return {
+            (bind,): stats[field]
+            for bind, stats in pool_stats(db.engines).items()
+            if field in stats
+        }
+
+    return collect
+
+
+request_seconds = Histogram(
+    "http_request_duration_seconds",
+    "Time to build each response",
+    ("endpoint", "method", "status"),
+)
+request_statements = Histogram(
+    "http_request_sql_statements",
+    "SQL statements run while building each response",
+    ("endpoint",),
+    STATEMENT_BUCKETS,
+)
+sql_statements = Counter("sql_statements_total", "SQL statements run", ("endpoint",))
+sql_seconds = Counter(
+    "sql_statement_seconds_total", "Time spent running SQL statements", ("endpoint",)
+)
+export_seconds = Histogram(
+    "export_duration_seconds",
+    "Time to write a report export",
+    ("report", "format"),
+    EXPORT_BUCKETS,
+)
+export_rows = Counter(
+    "export_rows_total", "Rows written to report exports", ("report", "format")
+)
+mail_send_seconds = Histogram(
+    "mail_send_duration_seconds", "Time to hand one email to the SMTP server"
+)
+mail_messages = Counter(
+    "mail_messages_total",
+    "Queued emails sent, rejected or deferred by a connection error",
+    ("result",),
+)
+cache_lookups = Counter(
+    "response_cache_lookups_total",
+    "Response cache lookups by result",
+    ("endpoint", "result"),
+)
+job_seconds = Histogram(
+    "scheduler_job_duration_seconds",
+    "Run time of scheduled jobs",
+    ("job",),
+    JOB_BUCKETS,
+)
+job_failures = Counter(
+    "scheduler_job_failures_total", "Scheduled job runs that raised", ("job",)
+)
+Gauge(
+    "db_pool_checked_out",
+    "Connections in use",
+    ("bind",),
+    pool_values("checked_out"),
+)
+Gauge("db_pool_size", "Connections kept open", ("bind",), pool_values("size"))
+Gauge(
+    "db_pool_overflow",
+    "Connections opened past the pool size",
+    ("bind",),
+    pool_values("overflow"),
+)
+Gauge(
+    "db_pool_checkouts_total",
+    "Connection checkouts",
+    ("bind",),
+    pool_values("checkouts"),
+    kind="counter",
+)
+Gauge(
+    "db_pool_timeouts_total",
+    "Checkouts that gave up waiting for a connection",
+    ("bind",),
+    pool_values("timeouts"),
+    kind="counter",
+)
+Gauge(
+    "db_pool_wait_seconds_total",
+    "Time spent waiting for a connection",
+    ("bind",),
+    pool_values("wait_seconds_total"),
+    kind="counter",
+)
+
+
+# Label for work done outside a request, such as report jobs and mail
+def current_endpoint():
+    if has_request_context():
+        return request.endpoint or "unmatched"
+    return "background"
+
+
+# The start time is kept on the execution context, which a failed statement
+# simply drops
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    endpoint = current_endpoint()
+    sql_statements.inc(endpoint=endpoint)
+    sql_seconds.inc(elapsed, endpoint=endpoint)
+    if not has_app_context() or "request_started" not in g:
+        return
+    g.sql_count += 1
+    g.sql_seconds += elapsed
+    # Kept only for the slow request log
+    if g.sql_by_statement is not None:
+        count, seconds = g.sql_by_statement.get(statement, (0, 0.0))
+        g.sql_by_statement[statement] = (count + 1, seconds + elapsed)
+
+
+def start_request():
+    g.request_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_seconds = 0.0
+    slow_log = current_app.config["SLOW_REQUEST_SECONDS"] is not None
+    g.sql_by_statement = {} if slow_log else None
+
+
+def finish_request(response):
+    if "request_started" not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = current_endpoint()
+    request_seconds.observe(
+        elapsed,
+        endpoint=endpoint,
+        method=request.method,
+        status=str(response.status_code),
+    )
+    request_statements.observe(g.sql_count, endpoint=endpoint)
+    if current_app.config["METRICS_DIR"]:
+        start_flushing(current_app._get_current_object())
+    threshold = current_app.config["SLOW_REQUEST_SECONDS"]
+    if threshold is not None and elapsed >= threshold:
+        log_slow_request(elapsed, response)
+    return response
+
+
+# Log a slow request with the statements that took longest
+def log_slow_request(elapsed, response):
+    statements = sorted(
+        g.sql_by_statement.items(), key=lambda item: item[1][1], reverse=True
+    )
+    top = statements[: current_app.config["SLOW_REQUEST_TOP_SQL"]]
+    lines = [
+        f"Slow request: {request.method} {request.path} ({current_endpoint()}) "
+        f"{response.status_code} in {elapsed:.3f}s, "
+        f"{g.sql_count} SQL statements in {g.sql_seconds:.3f}s"
+    ]
+    lines.extend(
+        f"  {seconds:.3f}s x{count}: {' '.join(statement.split())[:500]}"
+        for statement, (count, seconds) in top
+    )
+    current_app.logger.warning("\n".join(lines))
+
+
+# Time every request and count the SQL it runs. Requests slower than
+# SLOW_REQUEST_SECONDS are logged with their top SQL statements.
+def init_metrics(app):
+    app.config.setdefault("SLOW_REQUEST_SECONDS", None)
+    app.config.setdefault("SLOW_REQUEST_TOP_SQL", 5)
+    # Bearer token required to read /metrics, if set
+    app.config.setdefault("METRICS_TOKEN", None)
+    # Directory shared by the workers of a host, to serve their totals from
+    # any of them; without it each worker serves its own figures
+    app.config.setdefault("METRICS_DIR", None)
+    app.config.setdefault("METRICS_FLUSH_INTERVAL", 5)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
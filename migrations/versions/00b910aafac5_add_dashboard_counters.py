@@ -0,0 +1,86 @@
+"""add dashboard counters
+
+Revision ID: 00b910aafac5
+Revises: 1f5ae135d2f7
+Create Date: 2026-10-18 17:48:48.397288
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# Kept in step with thresholds.LOW_STOCK_THRESHOLD
+LOW_STOCK_THRESHOLD = 50
+
+
+# revision identifiers, used by Alembic.
+revision = '00b910aafac5'
+down_revision = '1f5ae135d2f7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    # db.create_all() may already have created the table on app start
+    if "dashboard_counter" not in sa.inspect(bind).get_table_names():
+        op.create_table(
+            "dashboard_counter",
+            sa.Column("name", sa.String(length=32), nullable=False),
+            sa.Column("bucket", sa.String(length=255), nullable=False),
+            sa.Column("value", sa.Numeric(precision=18, scale=2), nullable=False),
+            sa.PrimaryKeyConstraint("name", "bucket"),
+        )
+
+    # Start the counters from the current inventory
+    inventory = sa.table(
+        "inventory",
+        sa.column("id"),
+        sa.column("total_litres"),
+        sa.column("best_before_date"),
+        sa.column("location"),
+    )
+    counters = sa.table(
+        "dashboard_counter",
+        sa.column("name"),
+        sa.column("bucket"),
+        sa.column("value"),
+    )
+    op.execute(counters.delete())
+    rows = [
+        {
+            "name": "skus",
+            "bucket": "",
+            "value": bind.scalar(sa.select(sa.func.count(inventory.c.id))),
+        },
+        {
+            "name": "low_stock",
+            "bucket": "",
+            "value": bind.scalar(
+                sa.select(sa.func.count(inventory.c.id)).where(
+                    inventory.c.total_litres <= LOW_STOCK_THRESHOLD
+                )
+            ),
+        },
+        {"name": "version", "bucket": "", "value": 1},
+    ]
+    for name, column, total in (
+        ("expiring", inventory.c.best_before_date, sa.func.count(inventory.c.id)),
+        (
+            "location_litres",
+            inventory.c.location,
+            sa.func.sum(inventory.c.total_litres),
+        ),
+    ):
+        rows.extend(
+            {
+                "name": name,
+                "bucket": str(bucket)[:10] if name == "expiring" else bucket,
+                "value": value,
+            }
+            for bucket, value in bind.execute(sa.select(column, total).group_by(column))
+        )
+    op.bulk_insert(counters, rows)
+
+
+def downgrade():
+    op.drop_table("dashboard_counter")
@@ -0,0 +1,82 @@
+"""add inventory search trigrams
+
+Revision ID: 1f5ae135d2f7
+Revises: 7ce5d8301205
+Create Date: 2026-10-18 17:33:16.270021
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+SEARCH_FIELDS = ("material", "product_name", "location")
+BATCH_SIZE = 1000
+
+
+# revision identifiers, used by Alembic.
+revision = '1f5ae135d2f7'
+down_revision = '7ce5d8301205'
+branch_labels = None
+depends_on = None
+
+
+def trigrams(value):
+    text = str(value).strip().lower() if value is not None else ""
+    return {text[index : index + 3] for index in range(len(text) - 2)}
+
+
+def upgrade():
+    bind = op.get_bind()
+    # db.create_all() may already have created the table on app start
+    if "inventory_trigram" not in sa.inspect(bind).get_table_names():
+        op.create_table(
+            "inventory_trigram",
+            sa.Column(
+                "field",
+                sa.Enum("material", "product_name", "location"),
+                nullable=False,
+            ),
+            sa.Column("trigram", sa.String(length=3), nullable=False),
+            sa.Column("inventory_id", sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint("field", "trigram", "inventory_id"),
+        )
+        op.create_index(
+            "ix_inventory_trigram_inventory_id",
+            "inventory_trigram",
+            ["inventory_id"],
+            unique=False,
+        )
+
+    # Build the index for every existing item, in batches of ids
+    trigram_table = sa.table(
+        "inventory_trigram",
+        sa.column("field"),
+        sa.column("trigram"),
+        sa.column("inventory_id"),
+    )
+    op.execute(trigram_table.delete())
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.text(
+                "SELECT id, material, product_name, location FROM inventory "
+                "WHERE id > :last_id ORDER BY id LIMIT :limit"
+            ),
+            {"last_id": last_id, "limit": BATCH_SIZE},
+        ).all()
+        if not rows:
+            break
+        op.bulk_insert(
+            trigram_table,
+            [
+                {"field": field, "trigram": trigram, "inventory_id": row.id}
+                for row in rows
+                for field in SEARCH_FIELDS
+                for trigram in trigrams(getattr(row, field))
+            ],
+        )
+        last_id = rows[-1].id
+
+
+def downgrade():
+    op.drop_index("ix_inventory_trigram_inventory_id", table_name="inventory_trigram")
+    op.drop_table("inventory_trigram")
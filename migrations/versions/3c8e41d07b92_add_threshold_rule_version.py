@@ -0,0 +1,33 @@
+"""add threshold rule version
+
+Revision ID: 3c8e41d07b92
+Revises: 5a90b44790de
+Create Date: 2026-10-18 21:04:37.512918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c8e41d07b92'
+down_revision = '5a90b44790de'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all() may already have created the table on app start
+    if "threshold_rule_version" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    table = op.create_table(
+        "threshold_rule_version",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.bulk_insert(table, [{"id": 1, "version": 0}])
+
+
+def downgrade():
+    op.drop_table("threshold_rule_version")
@@ -0,0 +1,41 @@
+"""add stream events
+
+Revision ID: 4b7e2d9c1a53
+Revises: 8d1f5c2a6e47
+Create Date: 2026-10-18 21:40:12.318405
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7e2d9c1a53'
+down_revision = '8d1f5c2a6e47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all() may already have created the table on app start
+    if "stream_event" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        "stream_event",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("event_type", sa.String(length=32), nullable=False),
+        sa.Column("data", sa.Text(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_stream_event_created_at",
+        "stream_event",
+        ["created_at"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("ix_stream_event_created_at", table_name="stream_event")
+    op.drop_table("stream_event")
@@ -0,0 +1,59 @@
+"""add outbound email queue
+
+Revision ID: 5a90b44790de
+Revises: 66baaca6f0ee
+Create Date: 2026-10-18 18:17:17.689642
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a90b44790de'
+down_revision = '66baaca6f0ee'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all() may already have created the table on app start
+    if "outbound_email" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        "outbound_email",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("subject", sa.String(length=255), nullable=False),
+        sa.Column("sender", sa.String(length=255), nullable=True),
+        sa.Column("recipients", sa.Text(), nullable=False),
+        sa.Column("body", sa.Text(), nullable=True),
+        sa.Column("html", sa.Text(), nullable=True),
+        sa.Column("status", sa.Enum("queued", "sent", "failed"), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("next_attempt_at", sa.DateTime(), nullable=False),
+        sa.Column("claimed_by", sa.String(length=32), nullable=True),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("sent_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_outbound_email_status_next_attempt_at",
+        "outbound_email",
+        ["status", "next_attempt_at"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_outbound_email_claimed_by",
+        "outbound_email",
+        ["claimed_by"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("ix_outbound_email_claimed_by", table_name="outbound_email")
+    op.drop_index(
+        "ix_outbound_email_status_next_attempt_at", table_name="outbound_email"
+    )
+    op.drop_table("outbound_email")
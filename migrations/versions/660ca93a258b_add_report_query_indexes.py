@@ -0,0 +1,46 @@
+"""add report query indexes
+
+Revision ID: 660ca93a258b
+Revises: 
+Create Date: 2026-10-18 17:20:15.952671
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '660ca93a258b'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# Tables created by db.create_all() after the models declared these indexes
+# already have them, so only missing indexes are created.
+INDEXES = [
+    ("ix_inventory_total_litres", "inventory", ["total_litres"]),
+    ("ix_inventory_best_before_date", "inventory", ["best_before_date"]),
+    ("ix_inventory_transaction_date_taken", "inventory_transaction", ["date_taken"]),
+    (
+        "ix_inventory_transaction_inventory_id_date_taken",
+        "inventory_transaction",
+        ["inventory_id", "date_taken"],
+    ),
+]
+
+
+def existing_indexes(table):
+    return {index["name"] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        if name not in existing_indexes(table):
+            op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        if name in existing_indexes(table):
+            op.drop_index(name, table_name=table)
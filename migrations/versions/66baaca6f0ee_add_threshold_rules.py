@@ -0,0 +1,70 @@
+"""add threshold rules
+
+Revision ID: 66baaca6f0ee
+Revises: a2dc7fa874be
+Create Date: 2026-10-18 18:06:11.796830
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# The thresholds that were hard-coded until now, kept as the default rule
+LOW_STOCK_THRESHOLD = 50
+EXPIRY_WINDOW_DAYS = 90
+
+
+# revision identifiers, used by Alembic.
+revision = '66baaca6f0ee'
+down_revision = 'a2dc7fa874be'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    # db.create_all() may already have created the table on app start
+    if "threshold_rule" not in sa.inspect(bind).get_table_names():
+        op.create_table(
+            "threshold_rule",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("material", sa.Numeric(precision=15), nullable=True),
+            sa.Column("product_family", sa.String(length=255), nullable=True),
+            sa.Column("location", sa.String(length=255), nullable=True),
+            sa.Column(
+                "low_stock_litres", sa.Numeric(precision=10, scale=2), nullable=True
+            ),
+            sa.Column("expiry_days", sa.Integer(), nullable=True),
+            sa.PrimaryKeyConstraint("id"),
+        )
+
+    rules = sa.table(
+        "threshold_rule",
+        sa.column("material"),
+        sa.column("product_family"),
+        sa.column("location"),
+        sa.column("low_stock_litres"),
+        sa.column("expiry_days"),
+    )
+    has_default = bind.scalar(
+        sa.select(sa.func.count())
+        .select_from(rules)
+        .where(
+            rules.c.material.is_(None),
+            rules.c.product_family.is_(None),
+            rules.c.location.is_(None),
+        )
+    )
+    if not has_default:
+        op.bulk_insert(
+            rules,
+            [
+                {
+                    "low_stock_litres": LOW_STOCK_THRESHOLD,
+                    "expiry_days": EXPIRY_WINDOW_DAYS,
+                }
+            ],
+        )
+
+
+def downgrade():
+    op.drop_table("threshold_rule")
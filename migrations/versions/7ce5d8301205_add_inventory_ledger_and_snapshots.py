@@ -0,0 +1,106 @@
+"""add inventory ledger and snapshots
+
+Revision ID: 7ce5d8301205
+Revises: 660ca93a258b
+Create Date: 2026-10-18 17:25:41.508852
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7ce5d8301205'
+down_revision = '660ca93a258b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all() may already have created the tables on app start
+    tables = sa.inspect(op.get_bind()).get_table_names()
+
+    if "inventory_movement" not in tables:
+        op.create_table(
+            "inventory_movement",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("inventory_id", sa.Integer(), nullable=False),
+            sa.Column("material", sa.Numeric(precision=15), nullable=False),
+            sa.Column(
+                "kind",
+                sa.Enum("opening", "receipt", "take", "adjustment", "delete"),
+                nullable=False,
+            ),
+            sa.Column("quantity", sa.Numeric(precision=10, scale=2), nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index(
+            "ix_inventory_movement_created_at",
+            "inventory_movement",
+            ["created_at"],
+            unique=False,
+        )
+        op.create_index(
+            "ix_inventory_movement_material",
+            "inventory_movement",
+            ["material"],
+            unique=False,
+        )
+        op.create_index(
+            "ix_inventory_movement_inventory_id_created_at",
+            "inventory_movement",
+            ["inventory_id", "created_at"],
+            unique=False,
+        )
+
+    if "inventory_snapshot" not in tables:
+        op.create_table(
+            "inventory_snapshot",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("inventory_id", sa.Integer(), nullable=False),
+            sa.Column("snapshot_date", sa.Date(), nullable=False),
+            sa.Column(
+                "total_litres", sa.Numeric(precision=10, scale=2), nullable=False
+            ),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint(
+                "inventory_id",
+                "snapshot_date",
+                name="uq_inventory_snapshot_inventory_id_snapshot_date",
+            ),
+        )
+        op.create_index(
+            "ix_inventory_snapshot_snapshot_date",
+            "inventory_snapshot",
+            ["snapshot_date"],
+            unique=False,
+        )
+
+    # Open the ledger with the current stock of every item, less anything
+    # already logged since the app started writing to it
+    op.execute(
+        """
+        INSERT INTO inventory_movement (inventory_id, material, kind, quantity, created_at)
+        SELECT inventory.id, inventory.material, 'opening',
+               inventory.total_litres - COALESCE(logged.quantity, 0), CURRENT_TIMESTAMP
+        FROM inventory
+        LEFT JOIN (
+            SELECT inventory_id, SUM(quantity) AS quantity
+            FROM inventory_movement
+            GROUP BY inventory_id
+        ) logged ON logged.inventory_id = inventory.id
+        WHERE inventory.total_litres - COALESCE(logged.quantity, 0) <> 0
+        """
+    )
+
+
+def downgrade():
+    op.drop_index("ix_inventory_snapshot_snapshot_date", table_name="inventory_snapshot")
+    op.drop_table("inventory_snapshot")
+    op.drop_index(
+        "ix_inventory_movement_inventory_id_created_at", table_name="inventory_movement"
+    )
+    op.drop_index("ix_inventory_movement_material", table_name="inventory_movement")
+    op.drop_index("ix_inventory_movement_created_at", table_name="inventory_movement")
+    op.drop_table("inventory_movement")
@@ -0,0 +1,60 @@
+"""shard dashboard counters
+
+Revision ID: 8d1f5c2a6e47
+Revises: 3c8e41d07b92
+Create Date: 2026-10-18 23:12:05.184233
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d1f5c2a6e47'
+down_revision = '3c8e41d07b92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = sa.inspect(op.get_bind()).get_columns("dashboard_counter")
+    # db.create_all() may already have created the sharded table on app start
+    if "shard" in {column["name"] for column in columns}:
+        return
+    # The shard joins the primary key, so rebuild the table and keep the
+    # current totals in shard 0
+    op.rename_table("dashboard_counter", "dashboard_counter_unsharded")
+    op.create_table(
+        "dashboard_counter",
+        sa.Column("name", sa.String(length=32), nullable=False),
+        sa.Column("bucket", sa.String(length=255), nullable=False),
+        sa.Column("shard", sa.Integer(), nullable=False),
+        sa.Column("value", sa.Numeric(precision=18, scale=2), nullable=False),
+        sa.PrimaryKeyConstraint("name", "bucket", "shard"),
+    )
+    op.execute(
+        sa.text(
+            "INSERT INTO dashboard_counter (name, bucket, shard, value) "
+            "SELECT name, bucket, 0, value FROM dashboard_counter_unsharded"
+        )
+    )
+    op.drop_table("dashboard_counter_unsharded")
+
+
+def downgrade():
+    op.rename_table("dashboard_counter", "dashboard_counter_sharded")
+    op.create_table(
+        "dashboard_counter",
+        sa.Column("name", sa.String(length=32), nullable=False),
+        sa.Column("bucket", sa.String(length=255), nullable=False),
+        sa.Column("value", sa.Numeric(precision=18, scale=2), nullable=False),
+        sa.PrimaryKeyConstraint("name", "bucket"),
+    )
+    op.execute(
+        sa.text(
+            "INSERT INTO dashboard_counter (name, bucket, value) "
+            "SELECT name, bucket, SUM(value) FROM dashboard_counter_sharded "
+            "GROUP BY name, bucket"
+        )
+    )
+    op.drop_table("dashboard_counter_sharded")
@@ -0,0 +1,108 @@
+"""add inventory alerts
+
+Revision ID: a2dc7fa874be
+Revises: 00b910aafac5
+Create Date: 2026-10-18 17:56:33.021646
+
+"""
+from datetime import date, datetime, timedelta
+from alembic import op
+import sqlalchemy as sa
+
+# Kept in step with thresholds.LOW_STOCK_THRESHOLD and EXPIRY_WINDOW_DAYS
+LOW_STOCK_THRESHOLD = 50
+EXPIRY_WINDOW_DAYS = 90
+
+
+# revision identifiers, used by Alembic.
+revision = 'a2dc7fa874be'
+down_revision = '00b910aafac5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    # db.create_all() may already have created the table on app start
+    if "inventory_alert" not in sa.inspect(bind).get_table_names():
+        op.create_table(
+            "inventory_alert",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("inventory_id", sa.Integer(), nullable=False),
+            sa.Column("material", sa.Numeric(precision=15), nullable=False),
+            sa.Column("kind", sa.Enum("low_stock", "expiry"), nullable=False),
+            sa.Column("active", sa.Boolean(), nullable=False),
+            sa.Column(
+                "total_litres", sa.Numeric(precision=10, scale=2), nullable=False
+            ),
+            sa.Column("best_before_date", sa.Date(), nullable=False),
+            sa.Column("changed_at", sa.DateTime(), nullable=False),
+            sa.Column("notified_at", sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint(
+                "inventory_id", "kind", name="uq_inventory_alert_inventory_id_kind"
+            ),
+        )
+        op.create_index(
+            "ix_inventory_alert_notified_at",
+            "inventory_alert",
+            ["notified_at"],
+            unique=False,
+        )
+
+    # Raise alerts for items already low or expiring, to go out in the first
+    # digest
+    inventory = sa.table(
+        "inventory",
+        sa.column("id"),
+        sa.column("material"),
+        sa.column("total_litres"),
+        sa.column("best_before_date"),
+    )
+    alerts = sa.table(
+        "inventory_alert",
+        sa.column("inventory_id"),
+        sa.column("material"),
+        sa.column("kind"),
+        sa.column("active"),
+        sa.column("total_litres"),
+        sa.column("best_before_date"),
+        sa.column("changed_at"),
+    )
+    op.execute(alerts.delete())
+    now = datetime.utcnow()
+    for kind, condition in (
+        ("low_stock", inventory.c.total_litres <= LOW_STOCK_THRESHOLD),
+        (
+            "expiry",
+            inventory.c.best_before_date
+            <= date.today() + timedelta(days=EXPIRY_WINDOW_DAYS),
+        ),
+    ):
+        op.execute(
+            alerts.insert().from_select(
+                [
+                    "inventory_id",
+                    "material",
+                    "kind",
+                    "active",
+                    "total_litres",
+                    "best_before_date",
+                    "changed_at",
+                ],
+                sa.select(
+                    inventory.c.id,
+                    inventory.c.material,
+                    sa.literal(kind),
+                    sa.true(),
+                    inventory.c.total_litres,
+                    inventory.c.best_before_date,
+                    sa.literal(now, sa.DateTime()),
+                ).where(condition),
+            )
+        )
+
+
+def downgrade():
+    op.drop_index("ix_inventory_alert_notified_at", table_name="inventory_alert")
+    op.drop_table("inventory_alert")
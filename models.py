@@ -1,8 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from sqlalchemy import DDL, event
 from werkzeug.security import generate_password_hash, check_password_hash
+from db_routing import RoutingSession
 
-db = SQLAlchemy()
+# Sessions send the reads of read-only views to the replica, if configured
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 # Define the User model
@@ -25,18 +28,30 @@ class Inventory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     material = db.Column(db.Numeric(15), unique=True, nullable=False)
     product_name = db.Column(db.String(255), nullable=False)
-    total_litres = db.Column(db.Numeric(10, 2), nullable=False)
+    # Indexed for the low inventory threshold and expiry queries
+    total_litres = db.Column(db.Numeric(10, 2), nullable=False, index=True)
     date_received = db.Column(db.Date, nullable=False)
-    best_before_date = db.Column(db.Date, nullable=False)
+    best_before_date = db.Column(db.Date, nullable=False, index=True)
     location = db.Column(db.String(255), nullable=False)
 
 
 # define inventory transaction model
 class InventoryTransaction(db.Model):
+    # Serves per-item transaction lookups as well as per-item date ranges, so
+    # inventory_id does not need an index of its own
+    __table_args__ = (
+        db.Index(
+            "ix_inventory_transaction_inventory_id_date_taken",
+            "inventory_id",
+            "date_taken",
+        ),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     inventory_id = db.Column(db.Integer, db.ForeignKey("inventory.id"), nullable=False)
     quantity_taken = db.Column(db.Numeric(10, 2), nullable=False)
-    date_taken = db.Column(db.DateTime, default=datetime.utcnow)
+    # Indexed for the inventory taken report date range
+    date_taken = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     inventory = db.relationship(
         "Inventory", backref=db.backref("transactions", lazy=True)
     )
@@ -53,3 +68,157 @@ class DeletedInventory(db.Model):
     best_before_date = db.Column(db.Date, nullable=False)
     location = db.Column(db.String(255), nullable=False)
     date_deleted = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# define inventory movement model: an append-only ledger of every change to
+# stock. Rows are never updated or deleted, and are kept after an item is
+# deleted, so the ledger has no foreign key to inventory.
+class InventoryMovement(db.Model):
+    __table_args__ = (
+        db.Index(
+            "ix_inventory_movement_inventory_id_created_at",
+            "inventory_id",
+            "created_at",
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    inventory_id = db.Column(db.Integer, nullable=False)
+    material = db.Column(db.Numeric(15), nullable=False, index=True)
+    kind = db.Column(
+        db.Enum("opening", "receipt", "take", "adjustment", "delete"), nullable=False
+    )
+    # Signed change in litres: positive for receipts, negative for takes
+    quantity = db.Column(db.Numeric(10, 2), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+# define inventory snapshot model: stock of an item at the end of a day,
+# materialized nightly for items that moved since the previous snapshot
+class InventorySnapshot(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint(
+            "inventory_id",
+            "snapshot_date",
+            name="uq_inventory_snapshot_inventory_id_snapshot_date",
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    inventory_id = db.Column(db.Integer, nullable=False)
+    snapshot_date = db.Column(db.Date, nullable=False, index=True)
+    total_litres = db.Column(db.Numeric(10, 2), nullable=False)
+
+
+# define inventory trigram model: the search index for substring filters on
+# the inventory list. Each row says an item's field contains a three
+# character sequence; rows are rewritten with every change to the item.
+class InventoryTrigram(db.Model):
+    field = db.Column(db.Enum("material", "product_name", "location"), primary_key=True)
+    trigram = db.Column(db.String(3), primary_key=True)
+    inventory_id = db.Column(db.Integer, primary_key=True, index=True)
+
+
+# define dashboard counter model: running totals behind the dashboard summary,
+# adjusted in the same transaction as every change to inventory. The bucket
+# is empty for plain totals, or the date or location a total is kept for.
+class DashboardCounter(db.Model):
+    name = db.Column(db.String(32), primary_key=True)
+    bucket = db.Column(db.String(255), primary_key=True, default="")
+    # Writers add to one of several rows per counter, so they do not all
+    # queue on the same row lock; reads sum the shards
+    shard = db.Column(db.Integer, primary_key=True, default=0)
+    value = db.Column(db.Numeric(18, 2), nullable=False, default=0)
+
+
+# define inventory alert model: the low stock and expiry alert state of each
+# item. A row changes only when an item crosses into or out of a state, and
+# stays pending until it has been sent in an alert digest.
+class InventoryAlert(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint(
+            "inventory_id", "kind", name="uq_inventory_alert_inventory_id_kind"
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    inventory_id = db.Column(db.Integer, nullable=False)
+    material = db.Column(db.Numeric(15), nullable=False)
+    kind = db.Column(db.Enum("low_stock", "expiry"), nullable=False)
+    active = db.Column(db.Boolean, nullable=False)
+    # Stock and best before date when the state last changed
+    total_litres = db.Column(db.Numeric(10, 2), nullable=False)
+    best_before_date = db.Column(db.Date, nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Null until the change has been sent in a digest
+    notified_at = db.Column(db.DateTime, index=True)
+
+
+# define threshold rule model: the low stock and expiry thresholds of a
+# material, a product family (product names starting with it) or a location.
+# A rule with no scope is a default. Either threshold may be left unset to
+# take it from a less specific rule.
+class ThresholdRule(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    material = db.Column(db.Numeric(15))
+    product_family = db.Column(db.String(255))
+    location = db.Column(db.String(255))
+    low_stock_litres = db.Column(db.Numeric(10, 2))
+    expiry_days = db.Column(db.Integer)
+
+
+# define threshold rule version model: a single row whose version moves with
+# every change to the threshold rules, so each process can tell when the rules
+# it has cached are out of date
+class ThresholdRuleVersion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+# The row exists from the start, so writers always have one to lock
+event.listen(
+    ThresholdRuleVersion.__table__,
+    "after_create",
+    DDL("INSERT INTO threshold_rule_version (id, version) VALUES (1, 0)"),
+)
+
+
+# define stream event model: live events stored by the writes that raise
+# them, read by the event relay of every worker and kept for a while
+class StreamEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(32), nullable=False)
+    # JSON object
+    data = db.Column(db.Text, nullable=False)
+    created_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, index=True
+    )
+
+
+# define outbound email model: emails waiting to be sent by the mail queue,
+# kept for a while after sending
+class OutboundEmail(db.Model):
+    # Serves the sender's search for due messages
+    __table_args__ = (
+        db.Index(
+            "ix_outbound_email_status_next_attempt_at", "status", "next_attempt_at"
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(255))
+    # JSON list of addresses
+    recipients = db.Column(db.Text, nullable=False)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    status = db.Column(
+        db.Enum("queued", "sent", "failed"), nullable=False, default="queued"
+    )
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Sender that currently holds the message
+    claimed_by = db.Column(db.String(32), index=True)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
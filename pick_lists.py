@@ -0,0 +1,207 @@
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import insert, select, update
+from models import db, Inventory, InventoryTransaction, InventoryMovement
+from inventory_lookup import lookup_material, invalidate_material
+from inventory_changes import item_state, record_changes
+
+# Largest pick list accepted in one request
+MAX_PICK_LINES = 500
+
+
+class PickListError(ValueError):
+    def __init__(self, errors):
+        super().__init__("Pick list rejected")
+        self.errors = errors
+
+
+# Check the shape of each pick list line and parse its quantity
+def parse_lines(lines):
+    if not isinstance(lines, list) or not lines:
+        raise PickListError([{"error": "lines must be a non-empty list"}])
+    if len(lines) > MAX_PICK_LINES:
+        raise PickListError(
+            [{"error": f"A pick list can have at most {MAX_PICK_LINES} lines"}]
+        )
+
+    parsed, errors = [], []
+    for number, line in enumerate(lines, start=1):
+        material = (
+            str(line.get("material", "")).strip() if isinstance(line, dict) else ""
+        )
+        try:
+            quantity = Decimal(str(line.get("quantity")))
+            if not quantity.is_finite() or quantity <= 0:
+                raise InvalidOperation
+        except (InvalidOperation, AttributeError):
+            quantity = None
+        if not material or quantity is None:
+            errors.append(
+                {
+                    "line": number,
+                    "material": material or None,
+                    "error": "Each line needs a material and a positive quantity",
+                }
+            )
+        parsed.append((number, material, quantity))
+    if errors:
+        raise PickListError(errors)
+    return parsed
+
+
+# Take a quantity from one item with a single conditional UPDATE, so
+# concurrent takes cannot both pass the stock check and drive it negative.
+# Returns the remaining stock, or None if there was not enough. The caller
+# commits.
+def take_stock(inventory_id, material, quantity):
+    result = db.session.execute(
+        update(Inventory)
+        .where(Inventory.id == inventory_id, Inventory.total_litres >= quantity)
+        .values(total_litres=Inventory.total_litres - quantity)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return None
+
+    db.session.add(
+        InventoryTransaction(inventory_id=inventory_id, quantity_taken=quantity)
+    )
+    db.session.add(
+        InventoryMovement(
+            inventory_id=inventory_id,
+            material=material,
+            kind="take",
+            quantity=-quantity,
+        )
+    )
+    # The row is write-locked by the update until the commit
+    item = db.session.execute(
+        select(
+            Inventory.id,
+            Inventory.material,
+            Inventory.product_name,
+            Inventory.total_litres,
+            Inventory.best_before_date,
+            Inventory.location,
+        ).where(Inventory.id == inventory_id)
+    ).one()
+    after = item_state(item)
+    record_changes(
+        (
+            after._replace(total_litres=after.total_litres + Decimal(str(quantity))),
+            after,
+        )
+    )
+    return item.total_litres
+
+
+# Take every line of a pick list in one transaction, or none of them.
+# Affected rows are locked in id order so concurrent pick lists touching the
+# same items queue up instead of deadlocking.
+def take_pick_list(lines):
+    lines = parse_lines(lines)
+
+    # Resolve material codes to ids through the lookup cache
+    ids = {}
+    errors = []
+    for number, material, _ in lines:
+        cached_item = lookup_material(material)
+        if cached_item:
+            ids[material] = cached_item["id"]
+        else:
+            errors.append(
+                {
+                    "line": number,
+                    "material": material,
+                    "error": "Inventory item not found",
+                }
+            )
+    if errors:
+        raise PickListError(errors)
+
+    try:
+        items = {
+            item.id: item
+            for item in db.session.scalars(
+                select(Inventory)
+                .where(Inventory.id.in_(set(ids.values())))
+                .order_by(Inventory.id)
+                .with_for_update()
+                .execution_options(populate_existing=True)
+            )
+        }
+
+        # Check every line against the locked stock, counting repeated lines
+        # for the same item together
+        requested = {}
+        for number, material, quantity in lines:
+            item = items.get(ids[material])
+            if item is None:
+                # Deleted since it was cached
+                invalidate_material(material)
+                errors.append(
+                    {
+                        "line": number,
+                        "material": material,
+                        "error": "Inventory item not found",
+                    }
+                )
+                continue
+            requested[item.id] = requested.get(item.id, 0) + quantity
+            if item.total_litres < requested[item.id]:
+                errors.append(
+                    {
+                        "line": number,
+                        "material": material,
+                        "error": f"Insufficient quantity: {item.total_litres} litres available",
+                    }
+                )
+        if errors:
+            raise PickListError(errors)
+
+        previous_states = {
+            inventory_id: item_state(items[inventory_id]) for inventory_id in requested
+        }
+        for inventory_id, quantity in requested.items():
+            items[inventory_id].total_litres -= quantity
+        record_changes(
+            *(
+                (previous_states[inventory_id], item_state(items[inventory_id]))
+                for inventory_id in requested
+            )
+        )
+        db.session.execute(
+            insert(InventoryTransaction),
+            [
+                {"inventory_id": ids[material], "quantity_taken": quantity}
+                for _, material, quantity in lines
+            ],
+        )
+        db.session.execute(
+            insert(InventoryMovement),
+            [
+                {
+                    "inventory_id": ids[material],
+                    "material": items[ids[material]].material,
+                    "kind": "take",
+                    "quantity": -quantity,
+                }
+                for _, material, quantity in lines
+            ],
+        )
+        # Read the results before the commit expires the locked rows
+        results = [
+            {
+                "inventory_id": inventory_id,
+                "material": items[inventory_id].material,
+                "taken": quantity,
+                "remaining": items[inventory_id].total_litres,
+            }
+            for inventory_id, quantity in requested.items()
+        ]
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    invalidate_material(*ids)
+    return results
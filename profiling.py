@@ -0,0 +1,249 @@
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import wraps
+from flask import current_app, g, has_app_context, request
+
+MODES = ("cprofile", "sampling")
+
+
+# cProfile of the thread that starts it, saved for pstats or snakeviz
+class CProfileSession:
+    extension = ".prof"
+
+    def __init__(self, app):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def dump(self, path):
+        self.profile.dump_stats(path)
+
+
+# Samples the stack of the thread that starts it from a helper thread, saved
+# as collapsed stacks for flame graph tools. Costs one stack walk per
+# interval instead of a hook on every call.
+class SamplingSession:
+    extension = ".txt"
+
+    def __init__(self, app):
+        self.interval = app.config["PROFILE_SAMPLE_INTERVAL"]
+        self.stacks = Counter()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        target = threading.get_ident()
+        self.thread = threading.Thread(
+            target=self.sample, args=(target,), name="profile-sampler", daemon=True
+        )
+        self.thread.start()
+
+    def sample(self, target):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def dump(self, path):
+        with open(path, "w") as output:
+            for stack, count in self.stacks.most_common():
+                output.write(f"{stack} {count}\n")
+
+
+SESSIONS = {"cprofile": CProfileSession, "sampling": SamplingSession}
+EXTENSIONS = tuple(session.extension for session in SESSIONS.values())
+
+
+# The profiler of one app: who may ask for a profile and the slots of the
+# profiles running at once
+class ProfilerState:
+    def __init__(self, app, allow_header):
+        self.allow_header = allow_header
+        self.slots = threading.BoundedSemaphore(app.config["PROFILE_MAX_ACTIVE"])
+
+
+# Opt-in profiling of slow requests and of scheduled job runs. With
+# PROFILE_MODE off and no profile header a request costs one header lookup.
+# Each app keeps its own state in app.extensions["profiler"].
+class Profiler:
+    def __init__(self, app=None, allow_header=None):
+        if app is not None:
+            self.init_app(app, allow_header)
+
+    def init_app(self, app, allow_header=None):
+        # "cprofile" or "sampling" to profile every request and job run
+        app.config.setdefault("PROFILE_MODE", None)
+        # Requests in PROFILE_MODE are kept when at least this slow
+        app.config.setdefault("PROFILE_THRESHOLD", 1.0)
+        # Header asking to profile one request, e.g. "X-Profile: sampling"
+        app.config.setdefault("PROFILE_HEADER", "X-Profile")
+        app.config.setdefault(
+            "PROFILE_DIR", os.path.join(app.instance_path, "profiles")
+        )
+        # Newest profiles kept; older ones are deleted
+        app.config.setdefault("PROFILE_KEEP", 200)
+        # Requests and jobs profiled at once; others run unprofiled
+        app.config.setdefault("PROFILE_MAX_ACTIVE", 2)
+        app.config.setdefault("PROFILE_SAMPLE_INTERVAL", 0.005)
+        # Who may ask for a profile with the header; nobody by default
+        app.extensions["profiler"] = ProfilerState(app, allow_header or (lambda: False))
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.teardown_request(self.discard_request)
+
+    @property
+    def state(self):
+        return current_app.extensions["profiler"]
+
+    # Start a profile in the current thread, or None if enough are running
+    def start(self, mode):
+        slots = self.state.slots
+        if mode not in SESSIONS or not slots.acquire(blocking=False):
+            return None
+        session = SESSIONS[mode](current_app)
+        try:
+            session.start()
+        except ValueError:
+            # Another profiler is active in this thread
+            slots.release()
+            return None
+        return session
+
+    def stop(self, session):
+        try:
+            session.stop()
+        finally:
+            self.state.slots.release()
+
+    def start_request(self):
+        requested = request.headers.get(current_app.config["PROFILE_HEADER"])
+        if requested:
+            mode = requested if requested in MODES else "sampling"
+            if not self.state.allow_header():
+                return
+        else:
+            mode = current_app.config["PROFILE_MODE"]
+            if not mode:
+                return
+        g.profile = self.start(mode)
+        g.profile_requested = bool(requested)
+        g.profile_started = time.perf_counter()
+
+    def finish_request(self, response):
+        session = g.pop("profile", None)
+        if session is None:
+            return response
+        endpoint = request.endpoint or "unmatched"
+        if response.is_streamed:
+            # A streamed body is built after this hook, while the server sends
+            # it, so the profile runs until the response is closed. The saved
+            # name cannot be announced in headers that have already gone.
+            app = current_app._get_current_object()
+            requested, started = g.profile_requested, g.profile_started
+
+            def finish_stream():
+                with app.app_context():
+                    self.finish(session, endpoint, requested, started)
+
+            response.call_on_close(finish_stream)
+            return response
+        name = self.finish(session, endpoint, g.profile_requested, g.profile_started)
+        # Tell whoever asked for the profile where to find it
+        if name:
+            response.headers["X-Profile-Saved"] = name
+        return response
+
+    # Stop a request's profile and keep it if it was asked for or slow. Returns
+    # the name of an announced profile.
+    def finish(self, session, endpoint, requested, started):
+        self.stop(session)
+        elapsed = time.perf_counter() - started
+        if requested or elapsed >= current_app.config["PROFILE_THRESHOLD"]:
+            name = self.save(session, "request", endpoint, elapsed)
+            return name if requested else None
+        return None
+
+    # Stop a profile whose request ended without a response
+    def discard_request(self, error=None):
+        session = g.pop("profile", None)
+        if session is not None:
+            self.stop(session)
+
+    # Decorator profiling every run of a scheduled job while PROFILE_MODE is
+    # on in the app whose context it runs in
+    def job(self, func):
+        @wraps(func)
+        def decorated_function(*args, **kwargs):
+            mode = current_app.config["PROFILE_MODE"] if has_app_context() else None
+            session = self.start(mode) if mode else None
+            if session is None:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.stop(session)
+                self.save(session, "job", func.__name__, time.perf_counter() - started)
+
+        return decorated_function
+
+    @property
+    def directory(self):
+        directory = current_app.config["PROFILE_DIR"]
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    # Write a profile and delete the oldest beyond PROFILE_KEEP. Returns the
+    # file name.
+    def save(self, session, kind, name, elapsed):
+        name = re.sub(r"[^A-Za-z0-9_.]+", "_", name)
+        filename = (
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+            f"-{kind}-{name}-{round(elapsed * 1000)}ms{session.extension}"
+        )
+        path = os.path.join(self.directory, filename)
+        session.dump(path + ".part")
+        os.replace(path + ".part", path)
+        for old in self.profiles()[current_app.config["PROFILE_KEEP"] :]:
+            try:
+                os.remove(os.path.join(self.directory, old["name"]))
+            except FileNotFoundError:
+                pass
+        return filename
+
+    # Saved profiles, newest first
+    def profiles(self):
+        profiles = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(EXTENSIONS):
+                stat = entry.stat()
+                profiles.append(
+                    {
+                        "name": entry.name,
+                        "size": stat.st_size,
+                        "modified": stat.st_mtime,
+                    }
+                )
+        profiles.sort(key=lambda profile: (profile["modified"], profile["name"]))
+        return profiles[::-1]
@@ -0,0 +1,270 @@
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from db_routing import use_replica
+from exports import EXPORT_FORMATS, write_export
+from reports import REPORTS
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+
+# Heartbeats a queued or running job may miss before it is taken as dead
+MISSED_HEARTBEATS = 3
+
+
+# The report jobs of one app in this process: the thread pool building them
+# and the ids of those queued or running here
+class ReportJobState:
+    def __init__(self, app):
+        self.app = app
+        self.executor = ThreadPoolExecutor(
+            max_workers=app.config["REPORT_JOB_WORKERS"],
+            thread_name_prefix="report-job",
+        )
+        self.active = set()
+        self.lock = threading.Lock()
+        self.heartbeat_thread = None
+
+
+# Background report builder. Jobs run on a local thread pool and their status
+# and result files live in a shared directory, so any worker process can report
+# on or serve a job that another worker built. While a job is queued or
+# running its owner touches its status file, so a job whose worker died is
+# seen as dead rather than in flight. Each app keeps its own state in
+# app.extensions["report_jobs"].
+class ReportJobs:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault(
+            "REPORT_JOB_DIR", os.path.join(app.instance_path, "report_jobs")
+        )
+        app.config.setdefault("REPORT_JOB_TTL", 3600)
+        app.config.setdefault("REPORT_JOB_WORKERS", 2)
+        app.config.setdefault("REPORT_JOB_HEARTBEAT", 10)
+        app.extensions["report_jobs"] = ReportJobState(app)
+
+    @property
+    def state(self):
+        return current_app.extensions["report_jobs"]
+
+    @property
+    def directory(self):
+        directory = current_app.config["REPORT_JOB_DIR"]
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    # Submit a report, or return the in-flight job for identical parameters
+    def submit(self, report, params=None, fmt="xlsx"):
+        if report not in REPORTS:
+            raise ValueError(f"Unknown report: {report}")
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown format: {fmt}")
+        params = params or {}
+        # Build the query once up front so bad parameters fail the request
+        # rather than the job
+        try:
+            REPORTS[report]["statement"](**params)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid report parameters: {e}")
+        self.cleanup()
+
+        key = hashlib.sha1(
+            json.dumps([report, fmt, params], sort_keys=True).encode()
+        ).hexdigest()
+        job = {
+            "id": uuid.uuid4().hex,
+            "report": report,
+            "params": params,
+            "format": fmt,
+            "status": QUEUED,
+            "rows": None,
+            "error": None,
+            "created_at": time.time(),
+            "finished_at": None,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+        }
+
+        # The pending marker is linked into place atomically, so only one
+        # worker process queues a job for the same parameters at a time
+        marker = self.path(f"pending-{key}")
+        staged = f"{marker}.{job['id']}"
+        self.save(job)
+        with open(staged, "w") as marker_file:
+            marker_file.write(job["id"])
+        try:
+            while True:
+                try:
+                    os.link(staged, marker)
+                    break
+                except FileExistsError:
+                    existing = self.get(self.read_marker(marker))
+                    if existing and existing["status"] in (QUEUED, RUNNING):
+                        self.remove(self.path(f"{job['id']}.json"))
+                        return existing
+                    # The marked job has finished or vanished, so replace it
+                    self.remove(marker)
+        finally:
+            self.remove(staged)
+
+        state = self.state
+        with state.lock:
+            state.active.add(job["id"])
+        self.start_heartbeat(state)
+        state.executor.submit(self.run, state, job, marker)
+        return job
+
+    # Build the report file for a job inside an application context
+    def run(self, state, job, marker):
+        with state.app.app_context():
+            job["status"] = RUNNING
+            self.save(job)
+            result_path = self.result_path(job)
+            try:
+                report = REPORTS[job["report"]]
+                # Report queries only read, so they can run on the replica
+                use_replica()
+                with open(result_path + ".part", "wb") as output:
+                    job["rows"] = write_export(
+                        output,
+                        report["statement"](**job["params"]),
+                        report["sheet_name"],
+                        job["format"],
+                    )
+                os.replace(result_path + ".part", result_path)
+                job["status"] = FINISHED
+            except Exception:
+                # The error may quote SQL or paths, so clients only get a summary
+                current_app.logger.exception("Report job %s failed", job["id"])
+                self.remove(result_path + ".part")
+                job["status"] = FAILED
+                job["error"] = "The report could not be built"
+            finally:
+                # Release the marker first so a new submission never attaches
+                # to a job that has already finished
+                self.remove(marker)
+                job["finished_at"] = time.time()
+                self.save(job)
+                with state.lock:
+                    state.active.discard(job["id"])
+
+    # Start the thread touching the status files of this process's jobs
+    def start_heartbeat(self, state):
+        with state.lock:
+            if state.heartbeat_thread is None or not state.heartbeat_thread.is_alive():
+                state.heartbeat_thread = threading.Thread(
+                    target=self.heartbeat,
+                    args=(state,),
+                    name="report-job-heartbeat",
+                    daemon=True,
+                )
+                state.heartbeat_thread.start()
+
+    def heartbeat(self, state):
+        with state.app.app_context():
+            while True:
+                time.sleep(current_app.config["REPORT_JOB_HEARTBEAT"])
+                with state.lock:
+                    job_ids = list(state.active)
+                for job_id in job_ids:
+                    try:
+                        os.utime(self.path(f"{job_id}.json"))
+                    except OSError:
+                        pass
+
+    # Whether a queued or running job's worker has died: its process is gone
+    # from this host, or it has missed its heartbeats
+    def abandoned(self, job, modified):
+        if job.get("host") == socket.gethostname() and job.get("pid"):
+            try:
+                os.kill(job["pid"], 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+        timeout = current_app.config["REPORT_JOB_HEARTBEAT"] * MISSED_HEARTBEATS
+        return modified < time.time() - timeout
+
+    # Load a job's metadata, or None if it does not exist or has expired. A
+    # job whose worker died is marked failed.
+    def get(self, job_id):
+        if not job_id or not job_id.isalnum():
+            return None
+        try:
+            with open(self.path(f"{job_id}.json")) as job_file:
+                job = json.load(job_file)
+                modified = os.fstat(job_file.fileno()).st_mtime
+        except (OSError, ValueError):
+            return None
+        if job["status"] in (QUEUED, RUNNING) and self.abandoned(job, modified):
+            job["status"] = FAILED
+            job["error"] = "The report job stopped before it finished"
+            job["finished_at"] = time.time()
+            self.save(job)
+        return job
+
+    def result_path(self, job):
+        return self.path(f"{job['id']}.{job['format']}")
+
+    # Download file name of a finished job
+    def download_name(self, job):
+        return f"{REPORTS[job['report']]['filename']}.{job['format']}"
+
+    # Write job metadata atomically so readers never see a partial file
+    def save(self, job):
+        path = self.path(f"{job['id']}.json")
+        with open(path + ".tmp", "w") as job_file:
+            json.dump(job, job_file)
+        os.replace(path + ".tmp", path)
+
+    # Remove jobs and result files older than the configured TTL. Only a
+    # job's status file is touched by its heartbeat, so the pending marker and
+    # partial result of a job still queued or running are kept however old.
+    def cleanup(self):
+        expires_before = time.time() - current_app.config["REPORT_JOB_TTL"]
+        for name in os.listdir(self.directory):
+            path = self.path(name)
+            try:
+                if os.path.getmtime(path) >= expires_before:
+                    continue
+            except OSError:
+                continue
+            if name.startswith("pending-"):
+                job = self.get(self.read_marker(path))
+            elif name.endswith(".part"):
+                job = self.get(name.split(".")[0])
+            else:
+                job = None
+            if job and job["status"] in (QUEUED, RUNNING):
+                continue
+            self.remove(path)
+
+    @staticmethod
+    def read_marker(marker):
+        try:
+            with open(marker) as marker_file:
+                return marker_file.read().strip()
+        except OSError:
+            return None
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
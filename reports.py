@@ -0,0 +1,115 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import select
+from models import Inventory, User, InventoryTransaction
+from thresholds import expiring_filter, low_stock_filter
+
+
+# Column-projected queries behind each downloadable report. They return plain
+# rows instead of ORM objects so exports can stream them from the cursor.
+
+
+# Item columns shared by the inventory listings
+def inventory_statement():
+    return select(
+        Inventory.id,
+        Inventory.material,
+        Inventory.product_name,
+        Inventory.total_litres,
+        Inventory.date_received,
+        Inventory.best_before_date,
+        Inventory.location,
+    )
+
+
+# Inventory items at or below their low stock threshold, or a given one
+def low_inventory_statement(threshold=None):
+    if threshold is None:
+        return low_stock_filter(inventory_statement())
+    try:
+        threshold = Decimal(str(threshold))
+    except InvalidOperation:
+        raise ValueError("threshold must be a number")
+    return inventory_statement().where(Inventory.total_litres <= threshold)
+
+
+# Inventory items inside their expiring soon window, or within a given number
+# of days. The cutoff is a date, like the column, so the comparison can use
+# the index.
+def expiring_soon_statement(days=None):
+    if days is None:
+        return expiring_filter(inventory_statement())
+    cutoff = date.today() + timedelta(days=int(days))
+    return inventory_statement().where(Inventory.best_before_date <= cutoff)
+
+
+# Stock level of every inventory item
+def inventory_levels_statement():
+    return select(
+        Inventory.product_name,
+        Inventory.total_litres,
+        Inventory.location,
+    )
+
+
+# Inventory taken between two dates, joined to the product name
+def inventory_taken_statement(start_date, end_date):
+    return (
+        select(
+            InventoryTransaction.inventory_id,
+            Inventory.product_name,
+            InventoryTransaction.quantity_taken,
+            InventoryTransaction.date_taken,
+        )
+        .join(Inventory, InventoryTransaction.inventory_id == Inventory.id)
+        .where(
+            InventoryTransaction.date_taken >= start_date,
+            InventoryTransaction.date_taken <= end_date,
+        )
+    )
+
+
+# Registered users and their roles
+def user_activity_statement():
+    return select(User.username, User.email, User.role)
+
+
+# Parse a YYYY-MM-DD report parameter
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+# Inventory taken report built from string parameters
+def inventory_taken_report(start_date, end_date):
+    return inventory_taken_statement(parse_date(start_date), parse_date(end_date))
+
+
+# Registry of downloadable reports: query builder, sheet name and file name.
+# Query builders only take string parameters so they can be queued as jobs.
+REPORTS = {
+    "low_inventory": {
+        "statement": low_inventory_statement,
+        "sheet_name": "Low Inventory",
+        "filename": "low_inventory_report",
+    },
+    "expiring_soon": {
+        "statement": expiring_soon_statement,
+        "sheet_name": "Expiring Soon",
+        "filename": "expiring_soon_report",
+    },
+    "inventory_levels": {
+        "statement": inventory_levels_statement,
+        "sheet_name": "Inventory Levels",
+        "filename": "inventory_levels_report",
+    },
+    "inventory_taken": {
+        "statement": inventory_taken_report,
+        "sheet_name": "Inventory Taken",
+        "filename": "inventory_taken_report",
+    },
+    "user_activity": {
+        "statement": user_activity_statement,
+        "sheet_name": "User Activity",
+        "filename": "user_activity_report",
+    },
+}
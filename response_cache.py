@@ -0,0 +1,403 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import chain
+from flask import current_app, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from cache import MISSING, TTLCache
+from db_routing import primary_reads
+from metrics import cache_lookups
+from models import Inventory, ThresholdRule, User
+
+# Generation counter bumped by a committed write to each table. Cached
+# results are keyed by the generations of the scopes they depend on, so a
+# write makes every older entry unreachable instead of deleting it.
+TABLE_SCOPES = {
+    Inventory.__tablename__: "inventory",
+    User.__tablename__: "users",
+    ThresholdRule.__tablename__: "thresholds",
+}
+
+# Disk entries written between sweeps of expired and surplus files
+DISK_PRUNE_EVERY = 100
+
+# Tags of the two kinds of cached value: the raw bytes of a file, or a
+# result as JSON
+BYTES = b"bytes"
+JSON = b"json"
+
+
+# Values in report results that JSON has no type for, tagged so they are
+# read back as themselves
+def encode_value(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"__decimal__": str(value)}
+    raise TypeError(f"Cannot cache a {type(value).__name__}")
+
+
+def decode_value(obj):
+    if len(obj) == 1:
+        ((tag, text),) = obj.items()
+        if tag == "__datetime__":
+            return datetime.fromisoformat(text)
+        if tag == "__date__":
+            return date.fromisoformat(text)
+        if tag == "__decimal__":
+            return Decimal(text)
+    return obj
+
+
+# Cached values are stored as a tag line and a body, never pickled, so
+# whoever can write to a shared backend can only change the data served,
+# not run code in the workers reading it
+def dump_entry(value):
+    if isinstance(value, bytes):
+        return BYTES + b"\n" + value
+    return JSON + b"\n" + json.dumps(value, default=encode_value).encode()
+
+
+def load_entry(data):
+    tag, _, body = data.partition(b"\n")
+    if tag == BYTES:
+        return body
+    if tag == JSON:
+        return json.loads(body, object_hook=decode_value)
+    raise ValueError(f"Unknown cache entry type {tag[:20]!r}")
+
+
+# Per worker LRU with per worker generation counters, so with several
+# workers it only invalidates by TTL: writes served by other workers are
+# only seen once entries expire, after RESPONSE_CACHE_TTL. Use the disk or
+# redis backend to share invalidations between workers.
+class MemoryBackend:
+    errors = ()
+
+    def __init__(self, app):
+        self.entries = TTLCache(
+            app.config["RESPONSE_CACHE_SIZE"], app.config["RESPONSE_CACHE_TTL"]
+        )
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value):
+        self.entries.set(key, value)
+
+    def generations(self, scopes):
+        with self.lock:
+            return [self.counters.get(scope, 0) for scope in scopes]
+
+    def incr(self, scope):
+        with self.lock:
+            self.counters[scope] = self.counters.get(scope, 0) + 1
+
+
+# One file per entry in RESPONSE_CACHE_DIR, shared by the workers of a host.
+# Generation counters are small files changed under a lock.
+class DiskBackend:
+    errors = (OSError, ValueError)
+
+    def __init__(self, app):
+        self.directory = app.config["RESPONSE_CACHE_DIR"]
+        self.maxsize = app.config["RESPONSE_CACHE_SIZE"]
+        self.ttl = app.config["RESPONSE_CACHE_TTL"]
+        self.writes = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.entry")
+
+    def counter_path(self, scope):
+        return os.path.join(self.directory, f"generation-{scope}")
+
+    def get(self, key):
+        try:
+            with open(self.path(key), "rb") as entry:
+                expires = float(entry.readline())
+                return entry.read() if expires > time.time() else None
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        os.makedirs(self.directory, exist_ok=True)
+        handle, part = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        with os.fdopen(handle, "wb") as entry:
+            entry.write(f"{time.time() + self.ttl}\n".encode())
+            entry.write(value)
+        os.replace(part, self.path(key))
+        self.writes += 1
+        if self.writes % DISK_PRUNE_EVERY == 0:
+            self.prune()
+
+    # Delete expired entries and the oldest beyond RESPONSE_CACHE_SIZE
+    def prune(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".entry"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+        entries.sort(reverse=True)
+        expired = time.time() - self.ttl
+        for index, (modified, path) in enumerate(entries):
+            if index >= self.maxsize or modified < expired:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def generations(self, scopes):
+        values = []
+        for scope in scopes:
+            try:
+                with open(self.counter_path(scope)) as counter:
+                    fcntl.flock(counter, fcntl.LOCK_SH)
+                    values.append(int(counter.read() or 0))
+            except FileNotFoundError:
+                values.append(0)
+        return values
+
+    def incr(self, scope):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.counter_path(scope), "a+") as counter:
+            fcntl.flock(counter, fcntl.LOCK_EX)
+            counter.seek(0)
+            value = int(counter.read() or 0) + 1
+            counter.seek(0)
+            counter.truncate()
+            counter.write(str(value))
+
+
+# Entries in Redis or a server speaking its protocol, shared by every worker
+# and host. Entries expire after RESPONSE_CACHE_TTL.
+class RedisBackend:
+    def __init__(self, app):
+        # Loaded only when configured, as redis is an optional dependency
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RESPONSE_CACHE_BACKEND 'redis' needs the redis package")
+        self.errors = (redis.RedisError,)
+        self.client = redis.Redis.from_url(app.config["RESPONSE_CACHE_REDIS_URL"])
+        self.prefix = app.config["RESPONSE_CACHE_KEY_PREFIX"]
+        self.ttl = app.config["RESPONSE_CACHE_TTL"]
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def generations(self, scopes):
+        return [
+            int(value or 0)
+            for value in self.client.mget(
+                [f"{self.prefix}generation:{scope}" for scope in scopes]
+            )
+        ]
+
+    def incr(self, scope):
+        self.client.incr(f"{self.prefix}generation:{scope}")
+
+
+BACKENDS = {"memory": MemoryBackend, "disk": DiskBackend, "redis": RedisBackend}
+
+
+# The response cache of one app: its backend, or None when it is off, and
+# the largest result it stores
+class ResponseCacheState:
+    def __init__(self, backend, max_bytes):
+        self.backend = backend
+        self.max_bytes = max_bytes
+
+
+# Cache of route results and report files, keyed by the route, its query
+# parameters and the generations of the data it depends on. Values are
+# stored encoded, so a hit never shares objects with another request. Each
+# app keeps its own state in app.extensions["response_cache"].
+class ResponseCache:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # "memory", "disk" or "redis"; None turns the cache off. The memory
+        # default suits a single worker.
+        app.config.setdefault("RESPONSE_CACHE_BACKEND", "memory")
+        # Entries kept by the memory and disk backends
+        app.config.setdefault("RESPONSE_CACHE_SIZE", 256)
+        app.config.setdefault("RESPONSE_CACHE_TTL", 60)
+        # Larger results and files are served but not cached
+        app.config.setdefault("RESPONSE_CACHE_MAX_BYTES", 16 * 1024 * 1024)
+        app.config.setdefault(
+            "RESPONSE_CACHE_DIR", os.path.join(app.instance_path, "response_cache")
+        )
+        app.config.setdefault("RESPONSE_CACHE_REDIS_URL", "redis://localhost:6379/0")
+        app.config.setdefault("RESPONSE_CACHE_KEY_PREFIX", "ims:response:")
+        backend = app.config["RESPONSE_CACHE_BACKEND"]
+        if backend and backend not in BACKENDS:
+            raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND {backend!r}")
+        app.extensions["response_cache"] = ResponseCacheState(
+            BACKENDS[backend](app) if backend else None,
+            app.config["RESPONSE_CACHE_MAX_BYTES"],
+        )
+
+    # State of the current app, or None outside an app using the cache
+    @property
+    def state(self):
+        return (
+            current_app.extensions.get("response_cache") if has_app_context() else None
+        )
+
+    @property
+    def backend(self):
+        state = self.state
+        return state.backend if state else None
+
+    @property
+    def max_bytes(self):
+        state = self.state
+        return state.max_bytes if state else 0
+
+    def log_error(self, action, error):
+        if has_app_context():
+            current_app.logger.warning("Response cache %s failed: %s", action, error)
+
+    # Key of the current request's result given the scopes it depends on, or
+    # None if the cache is off or unavailable. Today's date is part of it for
+    # the reports relative to today.
+    def key(self, scopes):
+        backend = self.backend
+        if backend is None:
+            return None
+        try:
+            generations = backend.generations(scopes)
+        except backend.errors as e:
+            self.log_error("read", e)
+            return None
+        parts = (
+            request.endpoint,
+            sorted(request.args.items(multi=True)),
+            date.today().isoformat(),
+            list(zip(scopes, generations)),
+        )
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+    def get(self, key):
+        backend = self.backend
+        try:
+            data = backend.get(key)
+        except backend.errors as e:
+            self.log_error("read", e)
+            data = None
+        value = MISSING
+        if data is not None:
+            try:
+                value = load_entry(data)
+            except ValueError as e:
+                self.log_error("read", e)
+        cache_lookups.inc(
+            endpoint=request.endpoint, result="miss" if value is MISSING else "hit"
+        )
+        return value
+
+    def set(self, key, value):
+        data = dump_entry(value)
+        if len(data) > self.max_bytes:
+            return
+        backend = self.backend
+        try:
+            backend.set(key, data)
+        except backend.errors as e:
+            self.log_error("write", e)
+
+    # Result of the current request from the cache, built and stored on a
+    # miss. The key is taken before building, so a write committed meanwhile
+    # leaves the result under the older generation. Results are built on the
+    # primary, as a lagging replica could still return data from before the
+    # write that moved the generation on, and keep it cached under the new one.
+    def get_or_build(self, scopes, build):
+        key = self.key(scopes)
+        if key is None:
+            return build()
+        value = self.get(key)
+        if value is MISSING:
+            with primary_reads():
+                value = build()
+            self.set(key, value)
+        return value
+
+    # Make every cached result depending on the scopes unreachable
+    def bump(self, *scopes):
+        backend = self.backend
+        if backend is None:
+            return
+        for scope in scopes:
+            try:
+                backend.incr(scope)
+            except backend.errors as e:
+                self.log_error("invalidation", e)
+
+
+response_cache = ResponseCache()
+
+
+def mark_changed(session, *scopes):
+    session.info.setdefault("changed_scopes", set()).update(scopes)
+
+
+# Writes are noticed as they run, whether they are bulk statements or
+# flushed objects, and bumped only once their transaction commits
+@event.listens_for(Session, "do_orm_execute")
+def mark_statement_writes(orm_execute_state):
+    if (
+        orm_execute_state.is_insert
+        or orm_execute_state.is_update
+        or orm_execute_state.is_delete
+    ):
+        table = getattr(orm_execute_state.statement, "table", None)
+        scope = TABLE_SCOPES.get(getattr(table, "name", None))
+        if scope:
+            mark_changed(orm_execute_state.session, scope)
+
+
+@event.listens_for(Session, "after_flush")
+def mark_flushed_writes(session, flush_context):
+    for instance in chain(session.new, session.dirty, session.deleted):
+        scope = TABLE_SCOPES.get(instance.__table__.name)
+        if scope:
+            mark_changed(session, scope)
+
+
+@event.listens_for(Session, "after_commit")
+def bump_changed_scopes(session):
+    scopes = session.info.pop("changed_scopes", None)
+    if scopes:
+        response_cache.bump(*sorted(scopes))
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_changed_scopes(session):
+    session.info.pop("changed_scopes", None)
+
+
+# A table created again, as by init-db, starts out empty
+def bump_created_table(target, connection, **kw):
+    response_cache.bump(TABLE_SCOPES[target.name])
+
+
+for model in (Inventory, User, ThresholdRule):
+    event.listen(model.__table__, "after_create", bump_created_table)
@@ -0,0 +1,159 @@
+import fcntl
+import os
+import signal
+import threading
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from metrics import CONTENT_TYPE, render_metrics
+from models import db
+
+TIMEZONE = "Africa/Lagos"
+
+# Scheduled jobs as (id, function, trigger). Functions are given by import
+# path so the persistent job store can load them in the runner process, and
+# are named after their job id, under which they record their run times.
+JOBS = [
+    # Raise expiry alerts every night at 12:30 AM WAT
+    (
+        "scan_expiring_products",
+        "app:scan_expiring_products",
+        CronTrigger(hour=0, minute=30, timezone=TIMEZONE),
+    ),
+    # Send the alert digest every Friday at 10 AM WAT
+    (
+        "send_alert_digest",
+        "app:send_alert_digest",
+        CronTrigger(day_of_week="fri", hour=10, minute=0, timezone=TIMEZONE),
+    ),
+    # Build the daily stock snapshots every night at 1:15 AM WAT, after the UTC
+    # day they cover has ended
+    (
+        "build_inventory_snapshots",
+        "app:build_inventory_snapshots",
+        CronTrigger(hour=1, minute=15, timezone=TIMEZONE),
+    ),
+    # Recompute the dashboard counters and alerts every night at 1:45 AM WAT
+    (
+        "reconcile_counters_and_alerts",
+        "app:reconcile_counters_and_alerts",
+        CronTrigger(hour=1, minute=45, timezone=TIMEZONE),
+    ),
+    # Remove expired report job files every 30 minutes
+    (
+        "cleanup_report_jobs",
+        "app:cleanup_report_jobs",
+        IntervalTrigger(minutes=30, timezone=TIMEZONE),
+    ),
+    # Delete old live events every hour
+    (
+        "purge_stream_events",
+        "app:purge_stream_events",
+        IntervalTrigger(hours=1, timezone=TIMEZONE),
+    ),
+    # Retry queued email even while no web worker is sending
+    (
+        "send_queued_mail",
+        "app:send_queued_mail",
+        IntervalTrigger(minutes=1, timezone=TIMEZONE),
+    ),
+]
+
+
+# Take an exclusive lock on a file for the life of the process, so only one
+# runner schedules jobs; a second runner waits as a standby or gives up.
+# Returns the open lock file, or None if another runner holds the lock.
+def acquire_lock(path, wait=True):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock_file = open(path, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def create_scheduler(jobstore=None):
+    scheduler = BackgroundScheduler(
+        jobstores={
+            "default": jobstore
+            or SQLAlchemyJobStore(engine=db.engine, tablename="apscheduler_jobs")
+        },
+        # A run missed while no runner was up happens once when one starts,
+        # if it is no more than an hour late
+        job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": 3600},
+        timezone=TIMEZONE,
+    )
+    return scheduler
+
+
+# Bring the stored jobs in line with JOBS. Jobs whose schedule is unchanged
+# keep their stored next run time, so runs missed during a restart are
+# caught up; jobs no longer listed are removed.
+def sync_jobs(scheduler):
+    stored = {job.id: job for job in scheduler.get_jobs()}
+    for job_id, func, trigger in JOBS:
+        job = stored.pop(job_id, None)
+        if job is None:
+            scheduler.add_job(func, trigger, id=job_id)
+        elif job.func_ref != func or str(job.trigger) != str(trigger):
+            scheduler.remove_job(job_id)
+            scheduler.add_job(func, trigger, id=job_id)
+    for job_id in stored:
+        scheduler.remove_job(job_id)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve the runner's metrics in the Prometheus text format from a thread, as
+# the runner has no web server of its own
+def serve_metrics(app, port):
+    def metrics_app(environ, start_response):
+        with app.app_context():
+            body = render_metrics().encode()
+        start_response("200 OK", [("Content-Type", CONTENT_TYPE)])
+        return [body]
+
+    server = make_server("", port, metrics_app, handler_class=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Run the scheduled jobs until the process is stopped. Needs an application
+# context for the job store engine.
+def run_scheduler(app, wait=True):
+    app.config.setdefault(
+        "SCHEDULER_LOCK_FILE", os.path.join(app.instance_path, "scheduler.lock")
+    )
+    lock = acquire_lock(app.config["SCHEDULER_LOCK_FILE"], wait)
+    if lock is None:
+        return False
+
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stopping.set())
+
+    # Port for the job metrics, off by default
+    app.config.setdefault("SCHEDULER_METRICS_PORT", None)
+    metrics_server = None
+    if app.config["SCHEDULER_METRICS_PORT"]:
+        metrics_server = serve_metrics(app, app.config["SCHEDULER_METRICS_PORT"])
+
+    scheduler = create_scheduler()
+    scheduler.start(paused=True)
+    sync_jobs(scheduler)
+    scheduler.resume()
+    try:
+        stopping.wait()
+    finally:
+        scheduler.shutdown()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        lock.close()
+    return True
@@ -89,15 +89,25 @@ document.addEventListener('DOMContentLoaded', () => {
         const material = document.getElementById('filterMaterial').value;
         const productName = document.getElementById('filterProductName').value;
         const location = document.getElementById('filterLocation').value;
-        fetch(`/inventory?material=${material}&product_name=${productName}&location=${location}`)
+        const params = new URLSearchParams({
+            material: material,
+            product_name: productName,
+            location: location,
+            format: 'json',
+            count: 'false'
+        });
+        fetch(`/inventory?${params}`)
             .then(response => response.json())
             .then(data => {
                 const searchResults = document.getElementById('searchResults');
                 searchResults.innerHTML = '';
-                data.forEach(item => {
+                data.items.forEach(item => {
                     const div = document.createElement('div');
                     div.className = 'column is-one-quarter';
-                    div.innerHTML = `<div class="box">${item.name}</div>`;
+                    const box = document.createElement('div');
+                    box.className = 'box';
+                    box.textContent = item.product_name;
+                    div.appendChild(box);
                     searchResults.appendChild(div);
                 });
             })
@@ -116,22 +126,6 @@ document.addEventListener('DOMContentLoaded', () => {
             .catch(error => console.error('Error:', error));
     });
 
-    // Dynamic Content Update
-    function updateDashboard() {
-        fetch('/dashboard_data')
-            .then(response => response.json())
-            .then(data => {
-                document.querySelector('.total-items').textContent = `Total Items: ${data.total_items}`;
-                document.querySelector('.pending-tasks').textContent = `Pending Tasks: ${data.pending_tasks}`;
-                document.querySelector('.new-reports').textContent = `New Reports: ${data.new_reports}`;
-                document.querySelector('.items-to-delete').textContent = `Items to Delete: ${data.items_to_delete}`;
-            })
-            .catch(error => console.error('Error:', error));
-    }
-
-    updateDashboard();
-    setInterval(updateDashboard, 60000); // Update every minute
-
     // Error Handling
     function handleError(error) {
         console.error('Error:', error);
@@ -139,22 +133,86 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 });
 document.addEventListener('DOMContentLoaded', function() {
-    // Function to update the total number of products on the dashboard
-    function updateTotalProducts() {
-        fetch('/inventory/total')
-            .then(response => response.json())
-            .then(data => {
-                const totalProductsElement = document.querySelector('.total-items');
-                if (totalProductsElement) {
-                    totalProductsElement.textContent = `Total Sku: ${data.total}`;
+    // Dynamic Content Update: poll the summary with the ETag of the last
+    // response, so unchanged polls get an empty 304
+    let summaryEtag = null;
+    function updateDashboard() {
+        const headers = summaryEtag ? { 'If-None-Match': summaryEtag } : {};
+        fetch('/dashboard/summary', { headers: headers, cache: 'no-store' })
+            .then(response => {
+                if (response.status === 304) {
+                    return null;
                 }
+                summaryEtag = response.headers.get('ETag');
+                return response.json();
             })
-            .catch(error => console.error('Error fetching total products:', error));
+            .then(summary => {
+                if (!summary) {
+                    return;
+                }
+                document.querySelector('.total-items').textContent = `Total Sku: ${summary.total_skus}`;
+                // Let the charts redraw from the same data
+                document.dispatchEvent(new CustomEvent('dashboard-summary', { detail: summary }));
+            })
+            .catch(error => console.error('Error:', error));
+    }
+
+    // Live updates: refresh the summary when stock changes, batching bursts
+    // of events into one request
+    let live = false;
+    let refreshTimer = null;
+    function scheduleRefresh() {
+        if (!refreshTimer) {
+            refreshTimer = setTimeout(() => {
+                refreshTimer = null;
+                updateDashboard();
+            }, 1000);
+        }
+    }
+    if (window.EventSource) {
+        const events = new EventSource('/events');
+        events.onopen = () => { live = true; };
+        events.onerror = () => { live = false; };
+        ['stock-change', 'low-stock', 'expiry', 'resync'].forEach(type => {
+            events.addEventListener(type, scheduleRefresh);
+        });
     }
 
-    // Call the function to update the total products on page load
-    updateTotalProducts();
+    updateDashboard();
+    // Fall back to polling every minute while the event stream is down
+    setInterval(() => {
+        if (!live) {
+            updateDashboard();
+        }
+    }, 60000);
+
+    // Build report downloads in the background and fetch the file when ready
+    function pollReportJob(statusUrl) {
+        fetch(statusUrl)
+            .then(response => response.json())
+            .then(job => {
+                if (job.status === 'finished') {
+                    window.location.href = job.download_url;
+                } else if (job.status === 'failed') {
+                    console.error('Report failed:', job.error);
+                } else {
+                    setTimeout(() => pollReportJob(statusUrl), 2000);
+                }
+            })
+            .catch(error => console.error('Error fetching report status:', error));
+    }
 
-    // Optionally, set an interval to update the total products periodically
-    setInterval(updateTotalProducts, 60000); // Update every 60 seconds
+    document.querySelectorAll('[data-report-job]').forEach(link => {
+        link.addEventListener('click', event => {
+            event.preventDefault();
+            fetch('/reports/jobs', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ report: link.dataset.reportJob })
+            })
+                .then(response => response.json())
+                .then(job => pollReportJob(job.status_url))
+                .catch(error => console.error('Error submitting report:', error));
+        });
+    });
 });
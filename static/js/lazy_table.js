@@ -0,0 +1,65 @@
+// Fill a table body from a paginated JSON endpoint, one page at a time as
+// the end of the table scrolls into view. renderRow turns an item into a <tr>.
+function lazyTable(tbody, url, renderRow, perPage = 50) {
+    const columns = tbody.closest('table').querySelectorAll('thead th').length;
+    const sentinel = document.createElement('tr');
+    sentinel.innerHTML = `<td colspan="${columns}" class="has-text-centered has-text-grey">Loading…</td>`;
+    tbody.appendChild(sentinel);
+
+    let cursor = null;
+    let loading = false;
+
+    function isVisible() {
+        return sentinel.getBoundingClientRect().top < window.innerHeight;
+    }
+
+    function loadPage() {
+        if (loading) {
+            return;
+        }
+        loading = true;
+        const params = new URLSearchParams({ per_page: perPage });
+        if (cursor) {
+            params.set('cursor', cursor);
+        }
+        fetch(`${url}${url.includes('?') ? '&' : '?'}${params}`)
+            .then(response => response.json())
+            .then(data => {
+                const rows = document.createDocumentFragment();
+                data.items.forEach(item => rows.appendChild(renderRow(item)));
+                tbody.insertBefore(rows, sentinel);
+                cursor = data.next;
+                loading = false;
+                if (!cursor) {
+                    observer.disconnect();
+                    sentinel.remove();
+                } else if (isVisible()) {
+                    // The page did not fill the screen
+                    loadPage();
+                }
+            })
+            .catch(error => {
+                loading = false;
+                sentinel.firstChild.textContent = 'Could not load more rows.';
+                console.error('Error:', error);
+            });
+    }
+
+    const observer = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadPage();
+        }
+    });
+    observer.observe(sentinel);
+}
+
+// A table row with one cell per field, in order
+function cellRow(item, fields) {
+    const row = document.createElement('tr');
+    fields.forEach(field => {
+        const cell = document.createElement('td');
+        cell.textContent = item[field];
+        row.appendChild(cell);
+    });
+    return row;
+}
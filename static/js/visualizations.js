@@ -11,109 +11,84 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
-    fetch('/inventory/expiring_soon')
-        .then(response => response.json())
-        .then(data => {
-            if (data.length > 0) {
-                const ctx = document.getElementById('expiringSoonChart').getContext('2d');
-                new Chart(ctx, {
-                    type: 'pie',
-                    data: {
-                        labels: data.map(item => item.product_name),
-                        datasets: [{
-                            label: 'Total Litres',
-                            data: data.map(item => item.total_litres),
-                            backgroundColor: data.map(() => `rgba(${Math.floor(Math.random() * 255)}, ${Math.floor(Math.random() * 255)}, ${Math.floor(Math.random() * 255)}, 0.6)`),
-                            borderColor: data.map(() => `rgba(0, 0, 0, 0.1)`),
-                            borderWidth: 2
-                        }]
-                    },
-                    options: {
-                        responsive: true,
-                        maintainAspectRatio: false,  // Allow custom sizing
-                        plugins: {
-                            legend: {
-                                display: false // Hide the legend
-                            },
-                            tooltip: {
-                                callbacks: {
-                                    label: function(context) {
-                                        let label = context.label || '';
-                                        if (label) {
-                                            label += ': ';
-                                        }
-                                        label += context.raw;
-                                        return label;
-                                    }
-                                }
-                            }
-                        },
-                        animation: {
-                            animateScale: true,
-                            animateRotate: true
-                        },
-                        scales: {
-                            x: {
-                                display: false // Hide x-axis labels
-                            }
-                        }
+    // Draw a chart, or update it in place when it already exists
+    function drawChart(canvasId, config) {
+        const canvas = document.getElementById(canvasId);
+        if (!canvas) {
+            return;
+        }
+        const chart = Chart.getChart(canvas);
+        if (chart) {
+            chart.data = config.data;
+            chart.update();
+        } else {
+            new Chart(canvas.getContext('2d'), config);
+        }
+    }
+
+    // Charts are drawn from the dashboard summary polled by dashboard.js
+    document.addEventListener('dashboard-summary', event => {
+        const summary = event.detail;
+
+        const expiring = summary.expiring;
+        drawChart('expiringSoonChart', {
+            type: 'pie',
+            data: {
+                labels: ['Expired', 'Within 30 days', '31 to 60 days', '61 to 90 days'],
+                datasets: [{
+                    label: 'Products',
+                    data: [expiring.expired, expiring['30'], expiring['60'], expiring['90']],
+                    backgroundColor: [
+                        'rgba(255, 99, 132, 0.6)',
+                        'rgba(255, 159, 64, 0.6)',
+                        'rgba(255, 205, 86, 0.6)',
+                        'rgba(75, 192, 192, 0.6)'
+                    ],
+                    borderColor: 'rgba(0, 0, 0, 0.1)',
+                    borderWidth: 2
+                }]
+            },
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,  // Allow custom sizing
+                plugins: {
+                    legend: {
+                        position: 'bottom'
                     }
-                });
-            } else {
-                document.getElementById('expiringSoonChart').parentElement.innerHTML = '<p>No products expiring soon.</p>';
+                }
             }
         });
 
-    fetch('/inventory/below_threshold')
-        .then(response => response.json())
-        .then(data => {
-            if (data.length > 0) {
-                const ctx = document.getElementById('belowThresholdChart').getContext('2d');
-                new Chart(ctx, {
-                    type: 'line',
-                    data: {
-                        labels: data.map(item => item.product_name),
-                        datasets: [{
-                            label: 'Total Litres',
-                            data: data.map(item => item.total_litres),
-                            backgroundColor: 'rgba(54, 162, 235, 0.2)',
-                            borderColor: 'rgba(54, 162, 235, 1)',
-                            borderWidth: 1,
-                            fill: true,
-                            tension: 0.4
-                        }]
-                    },
-                    options: {
-                        responsive: true,
-                        plugins: {
-                            legend: {
-                                position: 'top',
-                            },
-                            tooltip: {
-                                callbacks: {
-                                    label: function(context) {
-                                        let label = context.label || '';
-                                        if (label) {
-                                            label += ': ';
-                                        }
-                                        label += context.raw;
-                                        return label;
-                                    }
-                                }
-                            }
-                        },
-                        scales: {
-                            y: {
-                                beginAtZero: true
-                            },
-                            x: {
-                                display: false // Hide x-axis labels
-                            }
-                        }
+        const lowStock = document.querySelector('.low-stock-count');
+        if (lowStock) {
+            lowStock.textContent = `Products below threshold: ${summary.low_stock}`;
+        }
+        const locations = Object.keys(summary.litres_by_location);
+        drawChart('belowThresholdChart', {
+            type: 'bar',
+            data: {
+                labels: locations,
+                datasets: [{
+                    label: 'Total Litres',
+                    data: locations.map(location => summary.litres_by_location[location]),
+                    backgroundColor: 'rgba(54, 162, 235, 0.2)',
+                    borderColor: 'rgba(54, 162, 235, 1)',
+                    borderWidth: 1
+                }]
+            },
+            options: {
+                responsive: true,
+                plugins: {
+                    legend: {
+                        position: 'top',
+                    }
+                },
+                scales: {
+                    y: {
+                        beginAtZero: true
                     }
-                });
-            } else {
-                document.getElementById('belowThresholdChart').parentElement.innerHTML = '<p>No products below threshold.</p>';
+                }
             }
         });
+    });
 });
@@ -0,0 +1,28 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+
+# Record every SQL statement sent to the engine while the block runs
+@contextmanager
+def count_queries(engine):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+class QueryCountMixin:
+    # Fail if the block issues more than max_queries SQL statements
+    @contextmanager
+    def assertMaxQueries(self, engine, max_queries):
+        with count_queries(engine) as statements:
+            yield statements
+        if len(statements) > max_queries:
+            self.fail(
+                f'{len(statements)} SQL statements issued, expected at most {max_queries}:\n'
+                + '\n'.join(statements)
+            )
@@ -0,0 +1,119 @@
+import io
+import unittest
+from datetime import date, timedelta
+from sqlalchemy import select
+from app import app, db, send_alert_digest
+from alerts import scan_expiring
+from models import InventoryAlert, OutboundEmail, User
+
+
+class AlertsTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        self.app = app.test_client()
+        with app.app_context():
+            db.create_all()
+            user = User(username='testuser', email='testuser@example.com', role='admin')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+        self.app.post('/login', data={
+            'username': 'testuser',
+            'password': 'password123'
+        })
+        today = date.today()
+        self.import_rows([
+            (1001, 'Engine Oil', 100, today + timedelta(days=400)),
+            (1002, 'Gear Oil', 200, today + timedelta(days=100)),
+            (1003, 'Coolant', 30, today + timedelta(days=20)),
+        ])
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def import_rows(self, rows):
+        lines = ['material,product_name,total_litres,date_received,best_before_date,location']
+        lines.extend(
+            f'{material},{name},{litres},2024-07-01,{best_before:%Y-%m-%d},Lagos'
+            for material, name, litres, best_before in rows
+        )
+        upload = io.BytesIO('\n'.join(lines).encode())
+        self.app.post('/inventory/import', data={'file': (upload, 'inventory.csv')})
+
+    def take(self, material, quantity):
+        response = self.app.post('/take_inventory/batch', json={
+            'lines': [{'material': material, 'quantity': quantity}]
+        })
+        self.assertEqual(response.status_code, 200)
+
+    def alerts(self):
+        with app.app_context():
+            return {
+                (int(alert.material), alert.kind): alert
+                for alert in db.session.scalars(select(InventoryAlert))
+            }
+
+    def digests(self):
+        with app.app_context():
+            return db.session.scalars(
+                select(OutboundEmail.body)
+                .where(OutboundEmail.subject == 'Inventory Alert Digest')
+                .order_by(OutboundEmail.id)
+            ).all()
+
+    def test_new_items_raise_alerts(self):
+        alerts = self.alerts()
+        self.assertEqual(set(alerts), {(1003, 'low_stock'), (1003, 'expiry')})
+        self.assertTrue(all(alert.active for alert in alerts.values()))
+
+    def test_alert_once_per_crossing(self):
+        self.take('1001', 60)
+        raised = self.alerts()[(1001, 'low_stock')]
+        self.assertTrue(raised.active)
+
+        # Further takes below the threshold leave the alert alone
+        self.take('1001', 10)
+        self.assertEqual(self.alerts()[(1001, 'low_stock')].changed_at, raised.changed_at)
+
+        # Restocking clears it, and dropping again raises it again
+        self.import_rows([(1001, 'Engine Oil', 100, date.today() + timedelta(days=400))])
+        self.assertFalse(self.alerts()[(1001, 'low_stock')].active)
+        self.take('1001', 100)
+        self.assertTrue(self.alerts()[(1001, 'low_stock')].active)
+        self.assertEqual(len(self.alerts()), 3)
+
+    def test_deleted_items_drop_their_alerts(self):
+        self.app.post('/delete_inventory', data={'item_id': 3})
+        self.assertEqual(self.alerts(), {})
+
+    def test_expiry_scan_raises_items_entering_the_window(self):
+        with app.app_context():
+            self.assertEqual(scan_expiring(date.today()), 0)
+            # Gear Oil enters the window as the days pass, once
+            self.assertEqual(scan_expiring(date.today() + timedelta(days=15)), 1)
+            self.assertEqual(scan_expiring(date.today() + timedelta(days=16)), 0)
+        self.assertTrue(self.alerts()[(1002, 'expiry')].active)
+
+    def test_digest_sends_each_change_once(self):
+        send_alert_digest()
+        digests = self.digests()
+        self.assertEqual(len(digests), 1)
+        self.assertIn('Coolant (Material: 1003', digests[0])
+        self.assertNotIn('Engine Oil', digests[0])
+
+        # Nothing changed since the last digest
+        send_alert_digest()
+        self.assertEqual(len(self.digests()), 1)
+
+        self.take('1001', 60)
+        send_alert_digest()
+        digests = self.digests()
+        self.assertEqual(len(digests), 2)
+        self.assertIn('Engine Oil (Material: 1001', digests[1])
+        self.assertNotIn('Coolant', digests[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from flask import url_for
+from app import app, create_app, mail_queue, profiler, report_jobs, response_cache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imports the app in a fresh interpreter and reports what that left behind
+PROBE = '''
+import json, sys, threading
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+connections = []
+# Counts connections opened by any pool, whichever class the engine uses
+event.listen(Pool, 'connect', lambda *args: connections.append(1))
+import app
+print(json.dumps({
+    'modules': [name for name in ('pandas', 'openpyxl', 'xlsxwriter') if name in sys.modules],
+    'threads': threading.active_count(),
+    'connections': len(connections),
+}))
+'''
+
+class AppFactoryTestCase(unittest.TestCase):
+    def test_import_is_light_and_fork_safe(self):
+        result = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, capture_output=True, text=True, check=True)
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        self.assertEqual(probe['modules'], [])
+        # Nothing a preloading server would share across forked workers
+        self.assertEqual(probe['threads'], 1)
+        self.assertEqual(probe['connections'], 0)
+
+    def test_routes_keep_their_urls(self):
+        with app.test_request_context():
+            self.assertEqual(url_for('main.dashboard'), '/dashboard')
+            self.assertEqual(url_for('main.take_inventory'), '/take_inventory')
+        commands = app.cli.list_commands(None)
+        self.assertIn('run-scheduler', commands)
+        self.assertIn('init-db', commands)
+
+    def test_apps_keep_their_own_state(self):
+        with tempfile.TemporaryDirectory() as directory:
+            class OtherConfig:
+                REPORT_JOB_DIR = directory
+                RESPONSE_CACHE_BACKEND = None
+                PROFILE_MAX_ACTIVE = 5
+
+            other = create_app(OtherConfig)
+            for name in ('report_jobs', 'mail_queue', 'profiler', 'response_cache'):
+                self.assertIsNot(other.extensions[name], app.extensions[name])
+            # Each app's settings apply in its own context, whichever came last
+            with other.app_context():
+                self.assertEqual(report_jobs.directory, directory)
+                self.assertIsNone(response_cache.backend)
+                self.assertIs(mail_queue.state.app, other)
+                self.assertEqual(profiler.state.slots._initial_value, 5)
+            with app.app_context():
+                self.assertNotEqual(report_jobs.directory, directory)
+                self.assertIsNotNone(response_cache.backend)
+                self.assertIs(mail_queue.state.app, app)
+                self.assertEqual(profiler.state.slots._initial_value, app.config['PROFILE_MAX_ACTIVE'])
+
+if __name__ == '__main__':
+    unittest.main()
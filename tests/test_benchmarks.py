@@ -0,0 +1,103 @@
+import os
+import tempfile
+import threading
+import unittest
+from sqlalchemy import func, select
+from werkzeug.serving import make_server
+from app import app, create_app, db
+from benchmarks.common import summarize
+from benchmarks.compare import compare
+from benchmarks.generate import generate
+from benchmarks.load import parse_mix, run_level, saturation
+from benchmarks.scenarios import SCENARIOS, run_scenarios
+from models import Inventory, InventoryMovement, InventoryTransaction, User
+
+def result(p50):
+    return {'p50_ms': p50}
+
+class BenchmarksTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def inventory_rows(self):
+        return db.session.execute(select(Inventory).order_by(Inventory.id)).scalars().all()
+
+    def test_generated_data_is_reproducible_and_consistent(self):
+        with app.app_context():
+            report = generate(200, users=3, seed=7)
+            self.assertEqual(report['rows']['deleted_inventory'], 10)
+            self.assertEqual(db.session.scalar(select(func.count(User.id))), 3)
+            self.assertEqual(
+                db.session.scalar(select(func.count(InventoryTransaction.id))),
+                report['rows']['inventory_transactions'])
+            first = [(item.material, item.total_litres) for item in self.inventory_rows()]
+            # The ledger of every live item adds up to its stock
+            ledger = dict(db.session.execute(
+                select(InventoryMovement.inventory_id, func.sum(InventoryMovement.quantity))
+                .group_by(InventoryMovement.inventory_id)).all())
+            for item in self.inventory_rows():
+                self.assertEqual(ledger[item.id], item.total_litres)
+            generate(200, users=3, seed=7)
+            self.assertEqual([(item.material, item.total_litres) for item in self.inventory_rows()], first)
+
+    def test_every_scenario_runs(self):
+        with app.app_context():
+            generate(100, users=3)
+            samples = run_scenarios(list(SCENARIOS), ops=20, repeat=1)
+        self.assertIn('lookup.cached', samples)
+        self.assertIn('export.inventory_levels.xlsx', samples)
+        self.assertIn('take.pick_list', samples)
+        summary = summarize(samples['take.single'])
+        self.assertEqual(summary['count'], 20)
+        self.assertLessEqual(summary['p50_ms'], summary['p99_ms'])
+
+    def test_compare_flags_slowdowns_past_the_threshold(self):
+        base = {'results': {'lookup': result(1.0), 'report': result(100.0), 'noise': result(0.01), 'gone': result(1.0)}}
+        head = {'results': {'lookup': result(1.05), 'report': result(150.0), 'noise': result(0.03), 'new': result(1.0)}}
+        statuses = {row[0]: row[4] for row in compare(base, head, threshold=0.1)}
+        self.assertEqual(statuses, {'lookup': '', 'report': 'slower', 'noise': '', 'gone': 'removed', 'new': 'added'})
+
+    def test_load_level_replays_the_mix_over_http(self):
+        # The server's threads each need their own connection, which an
+        # in-memory database cannot give them
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        class ServerConfig:
+            TESTING = True
+            WTF_CSRF_ENABLED = False
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(directory.name, 'load.db')
+
+        server_app = create_app(ServerConfig)
+        with server_app.app_context():
+            generate(100, users=2)
+        server = make_server('127.0.0.1', 0, server_app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            level = run_level(f'http://127.0.0.1:{server.server_port}', 2, duration=1, warmup=0,
+                              mix=parse_mix('scan=3,take=1,search=1,dashboard=2,levels_csv=1'),
+                              items=100, users=2)
+        finally:
+            server.shutdown()
+            with server_app.app_context():
+                db.engine.dispose()
+        self.assertEqual(level['login_failures'], 0)
+        self.assertGreater(level['requests'], 0)
+        self.assertEqual(level['errors'], 0)
+        self.assertEqual(set(level['actions']), {'scan', 'take', 'search', 'dashboard', 'levels_csv'})
+        self.assertLessEqual(level['p50_ms'], level['p99_ms'])
+
+    def test_saturation_finds_the_knee_of_the_curve(self):
+        levels = [{'concurrency': c, 'throughput': t} for c, t in ((1, 50), (4, 180), (16, 200), (64, 190))]
+        self.assertEqual(saturation(levels), {'peak_throughput': 200, 'knee_concurrency': 4})
+        with self.assertRaises(ValueError):
+            parse_mix('scan=1,delete=1')
+
+if __name__ == '__main__':
+    unittest.main()
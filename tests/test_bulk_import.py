@@ -0,0 +1,97 @@
+import io
+import unittest
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+from openpyxl import Workbook
+from app import app, db
+from models import User, Inventory, InventoryMovement
+
+CSV_HEADER = 'material,product_name,total_litres,date_received,best_before_date,location\n'
+
+class BulkImportTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        app.config['IMPORT_CHUNK_SIZE'] = 2
+        self.app = app.test_client()
+        with app.app_context():
+            db.create_all()
+            user = User(username='testuser', email='testuser@example.com', role='admin')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.add(Inventory(material=1000, product_name='Oil', total_litres=100,
+                                     date_received=date(2024, 1, 1), best_before_date=date(2025, 1, 1),
+                                     location='Warehouse1'))
+            db.session.commit()
+        self.app.post('/login', data={
+            'username': 'testuser',
+            'password': 'password123'
+        })
+
+    def tearDown(self):
+        app.config.pop('IMPORT_CHUNK_SIZE', None)
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def upload(self, content, filename):
+        return self.app.post('/inventory/import', data={
+            'file': (io.BytesIO(content), filename)
+        }, content_type='multipart/form-data')
+
+    def test_database_errors_are_not_shown(self):
+        content = CSV_HEADER + '4000,Wax,10,2024-07-01,2026-07-01,Warehouse1\n'
+        error = RuntimeError('INSERT INTO inventory violates uq_inventory_material')
+        with mock.patch('bulk_import.apply_chunk', side_effect=error), \
+                self.assertLogs(app.logger, 'ERROR'):
+            response = self.upload(content.encode(), 'receipts.csv')
+        report = response.get_json()
+        self.assertEqual(report['failed'], 1)
+        self.assertEqual(report['errors'], [{'row': 2, 'errors': ['Could not be saved']}])
+
+    def test_csv_import_upserts_and_reports_errors(self):
+        content = CSV_HEADER + (
+            '1000,Oil,50,2024-07-01,2026-07-01,Warehouse2\n'
+            '2000,Grease,20.5,2024-07-01,2026-07-01,Warehouse1\n'
+            'abc,Bad,10,2024-07-01,2026-07-01,Warehouse1\n'
+            '2000,Grease,4.5,2024-07-02,2026-08-01,Warehouse3\n'
+            '3000,,-1,07/01/2024,2026-07-01,Warehouse1\n'
+        )
+        response = self.upload(content.encode(), 'receipts.csv')
+        self.assertEqual(response.status_code, 200)
+        report = response.get_json()
+        self.assertEqual((report['rows'], report['imported'], report['failed']), (5, 3, 2))
+        self.assertEqual([error['row'] for error in report['errors']], [4, 6])
+        self.assertEqual(len(report['errors'][1]['errors']), 3)
+
+        with app.app_context():
+            oil = Inventory.query.filter_by(material=1000).first()
+            self.assertEqual(oil.total_litres, Decimal('150.00'))
+            self.assertEqual(oil.location, 'Warehouse2')
+            grease = Inventory.query.filter_by(material=2000).first()
+            self.assertEqual(grease.total_litres, Decimal('25.00'))
+            self.assertEqual(grease.best_before_date, date(2026, 8, 1))
+            self.assertEqual(InventoryMovement.query.filter_by(kind='receipt').count(), 3)
+
+    def test_xlsx_import(self):
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(CSV_HEADER.strip().split(','))
+        sheet.append([4000, 'Coolant', 30, date(2024, 7, 1), date(2026, 7, 1), 'Warehouse1'])
+        sheet.append([4001, 'Coolant', 'lots', date(2024, 7, 1), date(2026, 7, 1), 'Warehouse1'])
+        output = io.BytesIO()
+        workbook.save(output)
+
+        report = self.upload(output.getvalue(), 'receipts.xlsx').get_json()
+        self.assertEqual((report['imported'], report['failed']), (1, 1))
+        with app.app_context():
+            self.assertIsNotNone(Inventory.query.filter_by(material=4000).first())
+
+    def test_rejects_bad_files(self):
+        self.assertEqual(self.upload(b'material\n1\n', 'receipts.csv').status_code, 400)
+        self.assertEqual(self.upload(b'not a workbook', 'receipts.xlsx').status_code, 400)
+        self.assertEqual(self.upload(b'', 'receipts.txt').status_code, 400)
+        self.assertEqual(self.upload(b'', 'receipts.csv').status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from datetime import date
+from unittest import mock
+from app import app, db
+from cache import TTLCache
+from inventory_lookup import material_cache
+from models import User, Inventory
+
+class TTLCacheTestCase(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_ttl_expiry(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        with mock.patch('cache.time.monotonic', return_value=100):
+            cache.set('a', 1)
+        with mock.patch('cache.time.monotonic', return_value=111):
+            self.assertIsNone(cache.get('a'))
+
+    def test_invalidation_discards_inflight_load(self):
+        cache = TTLCache()
+
+        def loader():
+            cache.invalidate('a')
+            return 'stale'
+
+        self.assertEqual(cache.get_or_load('a', loader), 'stale')
+        self.assertIsNone(cache.get('a'))
+
+class MaterialLookupTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        self.app = app.test_client()
+        material_cache.clear()
+        with app.app_context():
+            db.create_all()
+            user = User(username='testuser', email='testuser@example.com', role='admin')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.add(Inventory(
+                material=1000,
+                product_name='Product1',
+                total_litres=100,
+                date_received=date(2024, 7, 23),
+                best_before_date=date(2025, 7, 23),
+                location='Warehouse1'
+            ))
+            db.session.commit()
+        self.app.post('/login', data={
+            'username': 'testuser',
+            'password': 'password123'
+        })
+
+    def tearDown(self):
+        material_cache.clear()
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_lookup_is_cached_and_invalidated_by_take(self):
+        for _ in range(3):
+            response = self.app.post('/get_inventory_by_material', json={'material': '1000'})
+            self.assertEqual(response.get_json()['total_litres'], '100.00')
+        stats = self.app.get('/inventory/lookup_cache').get_json()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+
+        self.app.post('/take_inventory', data={'material': '1000', 'quantity': '40'})
+        response = self.app.post('/get_inventory_by_material', json={'material': '1000'})
+        self.assertEqual(response.get_json()['total_litres'], '60.00')
+
+    def test_spellings_of_a_code_share_one_entry(self):
+        for code in ('1000', '01000', '1000.0', ' 1000 '):
+            response = self.app.post('/get_inventory_by_material', json={'material': code})
+            self.assertEqual(response.get_json()['total_litres'], '100.00')
+        stats = self.app.get('/inventory/lookup_cache').get_json()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (3, 1, 1))
+
+        self.app.post('/take_inventory', data={'material': '1000', 'quantity': '40'})
+        for code in ('01000', '1000.0'):
+            response = self.app.post('/get_inventory_by_material', json={'material': code})
+            self.assertEqual(response.get_json()['total_litres'], '60.00')
+
+    def test_invalid_codes_are_not_found(self):
+        for code in ('abc', '1000.5', 'NaN', ''):
+            response = self.app.post('/get_inventory_details', data={'material': code})
+            self.assertEqual(response.status_code, 404)
+
+    def test_unknown_material(self):
+        response = self.app.post('/get_inventory_details', data={'material': '9999'})
+        self.assertEqual(response.status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
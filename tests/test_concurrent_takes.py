@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from decimal import Decimal
+from flask import Flask
+from sqlalchemy import text
+from app import db
+from db_routing import configure_engines
+from models import Inventory, InventoryTransaction, InventoryMovement
+from pick_lists import take_stock
+
+# SQLite serialises writers itself, so on the test database this is only a
+# smoke test that concurrent takes keep the stock and ledger consistent.
+# Set STRESS_TEST_DATABASE_URI to a MySQL or PostgreSQL database (which the
+# test fills and empties) to check the conditional update under row locking.
+SMOKE_TAKES = 200
+SMOKE_THREADS = 4
+DATABASE_URI = os.environ.get('STRESS_TEST_DATABASE_URI')
+TAKES = int(os.environ.get('STRESS_TEST_TAKES', 2000))
+THREADS = int(os.environ.get('STRESS_TEST_THREADS', 16))
+
+class ConcurrentTakeMixin:
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.flask_app = Flask(__name__, instance_path=cls.directory)
+        cls.flask_app.config['SQLALCHEMY_DATABASE_URI'] = cls.database_uri or (
+            'sqlite:///' + os.path.join(cls.directory, 'takes.db'))
+        configure_engines(cls.flask_app)
+        db.init_app(cls.flask_app)
+
+    @classmethod
+    def tearDownClass(cls):
+        with cls.flask_app.app_context():
+            db.engine.dispose()
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def create_item(self, stock):
+        with self.flask_app.app_context():
+            db.create_all()
+            item = Inventory(
+                material=1000,
+                product_name='Product1',
+                total_litres=stock,
+                date_received=date(2024, 7, 1),
+                best_before_date=date(2026, 7, 1),
+                location='Warehouse1'
+            )
+            db.session.add(item)
+            db.session.commit()
+            self.inventory_id = item.id
+
+    def drop_tables(self):
+        with self.flask_app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def take_one(self, _):
+        with self.flask_app.app_context():
+            if db.engine.dialect.name == 'sqlite':
+                # Queue behind other writers rather than give up after the
+                # default five seconds on a busy machine
+                db.session.execute(text('PRAGMA busy_timeout = 60000'))
+            remaining = take_stock(self.inventory_id, 1000, 1)
+            if remaining is None:
+                db.session.rollback()
+                return False
+            db.session.commit()
+            return True
+
+    def assertNeverOversells(self, takes, threads):
+        stock = takes * 3 // 4
+        self.create_item(stock)
+        with ThreadPoolExecutor(threads) as executor:
+            taken = sum(executor.map(self.take_one, range(takes)))
+
+        self.assertEqual(taken, stock)
+        with self.flask_app.app_context():
+            item = db.session.get(Inventory, self.inventory_id)
+            self.assertEqual(item.total_litres, Decimal('0.00'))
+            self.assertEqual(InventoryTransaction.query.count(), stock)
+            self.assertEqual(InventoryMovement.query.filter_by(kind='take').count(), stock)
+
+# The takes run in threads with a connection each, so the smoke test uses a
+# database file rather than the one connection of an in-memory database
+class ConcurrentTakeSmokeTestCase(ConcurrentTakeMixin, unittest.TestCase):
+    database_uri = None
+
+    def tearDown(self):
+        self.drop_tables()
+
+    def test_concurrent_takes_smoke(self):
+        self.assertNeverOversells(SMOKE_TAKES, SMOKE_THREADS)
+
+@unittest.skipUnless(DATABASE_URI, 'STRESS_TEST_DATABASE_URI is not set')
+class ConcurrentTakeStressTestCase(ConcurrentTakeMixin, unittest.TestCase):
+    database_uri = DATABASE_URI
+
+    def tearDown(self):
+        self.drop_tables()
+
+    def test_concurrent_takes_never_oversell(self):
+        self.assertNeverOversells(TAKES, THREADS)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+from datetime import date, datetime
+from analytics import bucket_count
+from app import app, db
+from models import User, Inventory, InventoryTransaction
+from tests.query_counter import QueryCountMixin
+
+class ConsumptionTestCase(QueryCountMixin, unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        self.app = app.test_client()
+        with app.app_context():
+            db.create_all()
+            user = User(username='testuser', email='testuser@example.com', role='admin')
+            user.set_password('password123')
+            db.session.add(user)
+            oil = Inventory(material=1000, product_name='Oil', total_litres=500,
+                            date_received=date(2024, 1, 1), best_before_date=date(2025, 1, 1),
+                            location='Warehouse1')
+            grease = Inventory(material=1001, product_name='Grease', total_litres=500,
+                               date_received=date(2024, 1, 1), best_before_date=date(2025, 1, 1),
+                               location='Warehouse2')
+            db.session.add_all([oil, grease])
+            db.session.flush()
+            # Monday 2024-07-01 to Sunday 2024-07-07 is one week
+            for item, quantity, taken in [
+                (oil, 10, datetime(2024, 7, 1, 9)),
+                (oil, 5, datetime(2024, 7, 1, 17)),
+                (grease, 20, datetime(2024, 7, 7, 23)),
+                (oil, 7, datetime(2024, 7, 8, 8)),
+                (grease, 3, datetime(2024, 8, 2, 12)),
+            ]:
+                db.session.add(InventoryTransaction(
+                    inventory_id=item.id, quantity_taken=quantity, date_taken=taken
+                ))
+            db.session.commit()
+        self.app.post('/login', data={
+            'username': 'testuser',
+            'password': 'password123'
+        })
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_daily_totals(self):
+        response = self.app.get('/report/consumption?start_date=2024-07-01&end_date=2024-07-08')
+        data = response.get_json()
+        self.assertEqual(len(data['buckets']), 8)
+        self.assertEqual(data['series'], [
+            {'key': 'total', 'totals': [15.0, 0.0, 0.0, 0.0, 0.0, 0.0, 20.0, 7.0]}
+        ])
+
+    def test_weekly_totals_by_product(self):
+        with app.app_context():
+            engine = db.engine
+        with self.assertMaxQueries(engine, 1):
+            response = self.app.get(
+                '/report/consumption?start_date=2024-07-01&end_date=2024-07-14'
+                '&period=week&group_by=product'
+            )
+        data = response.get_json()
+        self.assertEqual(data['buckets'], ['2024-07-01', '2024-07-08'])
+        series = {item['key']: item['totals'] for item in data['series']}
+        self.assertEqual(series, {'Oil': [15.0, 7.0], 'Grease': [20.0, 0.0]})
+
+    def test_monthly_totals_by_location_with_rolling_average(self):
+        response = self.app.get(
+            '/report/consumption?start_date=2024-07-01&end_date=2024-08-31'
+            '&period=month&group_by=location&rolling=2'
+        )
+        data = response.get_json()
+        self.assertEqual(data['buckets'], ['2024-07-01', '2024-08-01'])
+        series = {item['key']: item for item in data['series']}
+        self.assertEqual(series['Warehouse2']['totals'], [20.0, 3.0])
+        self.assertEqual(series['Warehouse2']['rolling_average'], [20.0, 11.5])
+
+    def test_invalid_options(self):
+        self.assertEqual(self.app.get('/report/consumption?period=year').status_code, 400)
+        self.assertEqual(self.app.get('/report/consumption?group_by=user').status_code, 400)
+        self.assertEqual(self.app.get('/report/consumption?start_date=July').status_code, 400)
+
+    def test_dates_at_the_ends_of_the_calendar_are_rejected(self):
+        for query in (
+            'start_date=9999-12-01&end_date=9999-12-31&period=day',
+            'start_date=9999-12-01&end_date=9999-12-30&period=month',
+            'start_date=0001-01-01&end_date=0001-01-05',
+            'end_date=0001-01-05',
+        ):
+            self.assertEqual(self.app.get(f'/report/consumption?{query}').status_code, 400, query)
+
+    def test_date_range_is_capped(self):
+        url = '/report/consumption?start_date=1900-01-01&end_date=2024-07-31'
+        self.assertEqual(self.app.get(url + '&period=day').status_code, 400)
+        self.assertEqual(self.app.get(url + '&period=week').status_code, 400)
+        self.assertEqual(self.app.get(url + '&period=month').status_code, 400)
+        response = self.app.get('/report/consumption?start_date=2022-01-01&end_date=2024-07-31&period=week')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()['buckets']), bucket_count(date(2022, 1, 1), date(2024, 7, 31), 'week'))
+
+if __name__ == '__main__':
+    unittest.main()
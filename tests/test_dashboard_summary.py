@@ -0,0 +1,116 @@
+import io
+import unittest
+from itertools import count
+from unittest import mock
+from datetime import date, timedelta
+from app import app, db
+from dashboard_counters import dashboard_summary, rebuild_counters
+from models import DashboardCounter, User
+from tests.query_counter import QueryCountMixin
+
+class DashboardSummaryTestCase(QueryCountMixin, unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        self.app = app.test_client()
+        with app.app_context():
+            db.create_all()
+            user = User(username='testuser', email='testuser@example.com', role='admin')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+        self.app.post('/login', data={
+            'username': 'testuser',
+            'password': 'password123'
+        })
+        today = date.today()
+        rows = [
+            (1001, 'Engine Oil', 40, today - timedelta(days=5), 'Lagos'),
+            (1002, 'Gear Oil', 200, today + timedelta(days=20), 'Lagos'),
+            (1003, 'Hydraulic Fluid', 75, today + timedelta(days=45), 'Kano'),
+            (1004, 'Coolant', 300, today + timedelta(days=400), 'Kano'),
+        ]
+        lines = ['material,product_name,total_litres,date_received,best_before_date,location']
+        lines.extend(
+            f'{material},{name},{litres},2024-07-01,{best_before:%Y-%m-%d},{location}'
+            for material, name, litres, best_before, location in rows
+        )
+        upload = io.BytesIO('\n'.join(lines).encode())
+        self.app.post('/inventory/import', data={'file': (upload, 'inventory.csv')})
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def summary(self):
+        response = self.app.get('/dashboard/summary')
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_counters_follow_writes(self):
+        summary = self.summary()
+        self.assertEqual(summary['total_skus'], 4)
+        self.assertEqual(summary['low_stock'], 1)
+        self.assertEqual(summary['expiring'], {'expired': 1, '30': 1, '60': 1, '90': 0})
+        self.assertEqual(summary['litres_by_location'], {'Lagos': '240.00', 'Kano': '375.00'})
+
+        # Taking stock can push an item below the threshold
+        self.app.post('/take_inventory/batch', json={'lines': [
+            {'material': '1003', 'quantity': 30},
+            {'material': '1002', 'quantity': 10},
+        ]})
+        self.app.post('/delete_inventory', data={'item_id': 1})
+        summary = self.summary()
+        self.assertEqual(summary['total_skus'], 3)
+        self.assertEqual(summary['low_stock'], 1)
+        self.assertEqual(summary['expiring'], {'expired': 0, '30': 1, '60': 1, '90': 0})
+        self.assertEqual(summary['litres_by_location'], {'Lagos': '190.00', 'Kano': '345.00'})
+
+        # The running counters agree with counters rebuilt from scratch
+        with app.app_context():
+            rebuild_counters()
+        rebuilt = self.summary()
+        self.assertEqual(rebuilt, summary)
+
+    def test_shards_add_up(self):
+        before = self.summary()
+        # Each write transaction adds to its own shard of the counters
+        with mock.patch('dashboard_counters.random.randrange', side_effect=count(1)):
+            for material in ('1002', '1003', '1004'):
+                self.app.post('/take_inventory/batch', json={'lines': [{'material': material, 'quantity': 5}]})
+        with app.app_context():
+            shards = {counter.shard for counter in DashboardCounter.query.filter_by(name='version')}
+        self.assertLessEqual({1, 2, 3}, shards)
+
+        summary = self.summary()
+        self.assertEqual(summary['total_skus'], before['total_skus'])
+        self.assertEqual(summary['litres_by_location'], {'Lagos': '235.00', 'Kano': '365.00'})
+        with app.app_context():
+            rebuild_counters()
+        self.assertEqual(self.summary(), summary)
+
+    def test_buckets_move_with_the_day(self):
+        with app.app_context():
+            summary = dashboard_summary(date.today() + timedelta(days=30))
+        self.assertEqual(summary['expiring'], {'expired': 2, '30': 1, '60': 0, '90': 0})
+
+    def test_unchanged_polls_get_not_modified(self):
+        response = self.app.get('/dashboard/summary')
+        etag = response.headers['ETag']
+        self.assertFalse(response.headers['ETag'].startswith('W/'))
+
+        with app.app_context():
+            engine = db.engine
+        # Only the version counter is read
+        with self.assertMaxQueries(engine, 1):
+            response = self.app.get('/dashboard/summary', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        self.app.post('/take_inventory/batch', json={'lines': [{'material': '1004', 'quantity': 1}]})
+        response = self.app.get('/dashboard/summary', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+if __name__ == '__main__':
+    unittest.main()
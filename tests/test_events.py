@@ -0,0 +1,145 @@
+import json
+import unittest
+from datetime import date, timedelta
+from app import app, db
+from events import EventBroker, broker, format_event, queue_event, stream
+from models import User, Inventory, StreamEvent
+
+def parse(chunk):
+    fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+    return fields['event'], json.loads(fields['data'])
+
+class EventBrokerTestCase(unittest.TestCase):
+    def test_fan_out(self):
+        events = EventBroker(queue_size=10)
+        first, second = events.subscribe(), events.subscribe()
+        events.publish('stock-change', {'material': '1001'})
+        self.assertEqual(first.queue.get_nowait()[1:], ('stock-change', {'material': '1001'}))
+        self.assertEqual(second.queue.get_nowait()[1:], ('stock-change', {'material': '1001'}))
+        events.unsubscribe(first)
+        self.assertEqual(events.stats()['clients'], 1)
+
+    def test_slow_client_drops_oldest_and_resyncs(self):
+        events = EventBroker(queue_size=3)
+        subscription = events.subscribe()
+        for index in range(5):
+            events.publish('stock-change', {'index': index})
+        self.assertTrue(subscription.lagged)
+        kept = [subscription.queue.get_nowait()[2]['index'] for _ in range(3)]
+        self.assertEqual(kept, [2, 3, 4])
+
+    def test_replay_since_last_event_id(self):
+        events = EventBroker()
+        for index in range(3):
+            events.publish('stock-change', {'index': index})
+        subscription = events.subscribe(last_event_id=1)
+        self.assertEqual(subscription.queue.qsize(), 2)
+
+    def test_clients_behind_the_history_resync(self):
+        events = EventBroker()
+        for event_id in (5, 6, 7):
+            events.publish('stock-change', {'id': event_id}, event_id)
+        self.assertFalse(events.subscribe(last_event_id=4).lagged)
+        subscription = events.subscribe(last_event_id=2)
+        self.assertTrue(subscription.lagged)
+        self.assertEqual(subscription.queue.qsize(), 3)
+        chunks = stream(subscription)
+        next(chunks)
+        self.assertEqual(parse(next(chunks)), ('resync', {}))
+        self.assertTrue(next(chunks).startswith('id: 5\n'))
+        chunks.close()
+
+    def test_client_limit(self):
+        events = EventBroker(max_clients=1)
+        self.assertIsNotNone(events.subscribe())
+        self.assertIsNone(events.subscribe())
+
+    def test_format_event(self):
+        self.assertEqual(
+            format_event(7, 'low-stock', {'material': '1001'}),
+            'id: 7\nevent: low-stock\ndata: {"material": "1001"}\n\n'
+        )
+
+class EventStreamTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        self.app = app.test_client()
+        with app.app_context():
+            db.create_all()
+            user = User(username='testuser', email='testuser@example.com', role='admin')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.add(Inventory(
+                material=1001,
+                product_name='Engine Oil',
+                total_litres=60,
+                date_received=date(2024, 7, 1),
+                best_before_date=date.today() + timedelta(days=365),
+                location='Lagos'
+            ))
+            db.session.commit()
+        self.app.post('/login', data={
+            'username': 'testuser',
+            'password': 'password123'
+        })
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    # Publish new events as the relay thread would
+    def relay(self):
+        with app.app_context():
+            app.extensions['event_relay'].poll()
+
+    def test_events_are_streamed_after_commit(self):
+        response = self.app.get('/events', buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = iter(response.response)
+        self.assertEqual(next(chunks), b'retry: 5000\n\n')
+
+        # Rolled back changes are never published
+        with app.app_context():
+            queue_event(db.session, 'stock-change', {'material': 'rolled back'})
+            db.session.rollback()
+
+        self.app.post('/take_inventory/batch', json={'lines': [{'material': '1001', 'quantity': 15}]})
+        self.relay()
+        event_type, data = parse(next(chunks).decode())
+        self.assertEqual(event_type, 'stock-change')
+        self.assertEqual(data['material'], '1001')
+        self.assertEqual(data['total_litres'], '45.00')
+        event_type, data = parse(next(chunks).decode())
+        self.assertEqual(event_type, 'low-stock')
+
+        response.close()
+        self.assertEqual(broker.stats()['clients'], 0)
+
+    def test_events_from_other_workers_are_relayed(self):
+        with app.app_context():
+            db.session.add(StreamEvent(event_type='stock-change', data='{"material": "1"}'))
+            db.session.commit()
+        response = self.app.get('/events', buffered=False, headers={'Last-Event-ID': '0'})
+        chunks = iter(response.response)
+        next(chunks)
+        # Replayed from the table by id
+        self.assertTrue(next(chunks).startswith(b'id: 1\n'))
+
+        # Stored by another worker, so nothing here wakes the relay
+        with app.app_context():
+            db.session.add(StreamEvent(event_type='low-stock', data='{"material": "2"}'))
+            db.session.commit()
+        self.relay()
+        chunk = next(chunks).decode()
+        self.assertTrue(chunk.startswith('id: 2\n'))
+        self.assertEqual(parse(chunk.split('\n', 1)[1]), ('low-stock', {'material': '2'}))
+        response.close()
+
+    def test_login_required(self):
+        self.app.get('/logout')
+        response = self.app.get('/events')
+        self.assertEqual(response.status_code, 302)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import csv
+import io
+import unittest
+from datetime import date, timedelta
+from openpyxl import load_workbook
+from app import app, db
+from models import User, Inventory
+
+class ExportTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        self.app = app.test_client()
+        with app.app_context():
+            db.create_all()
+            user = User(username='testuser', email='testuser@example.com', role='admin')
+            user.set_password('password123')
+            db.session.add(user)
+            for index, litres in enumerate([10, 40, 500]):
+                db.session.add(Inventory(
+                    material=1000 + index,
+                    product_name=f'Product{index}',
+                    total_litres=litres,
+                    date_received=date.today(),
+                    best_before_date=date.today() + timedelta(days=30 * (index + 1) * 2),
+                    location='Warehouse1'
+                ))
+            db.session.commit()
+        self.app.post('/login', data={
+            'username': 'testuser',
+            'password': 'password123'
+        })
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_below_threshold_xlsx_download(self):
+        response = self.app.get('/inventory/below_threshold?download=true')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('low_inventory_report.xlsx', response.headers['Content-Disposition'])
+        sheet = load_workbook(io.BytesIO(response.data))['Low Inventory']
+        rows = list(sheet.iter_rows(values_only=True))
+        self.assertEqual(rows[0][:3], ('id', 'material', 'product_name'))
+        self.assertEqual(len(rows), 3)
+
+    def test_inventory_levels_csv_download(self):
+        response = self.app.get('/report/inventory_levels?download=true&format=csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/csv')
+        rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+        self.assertEqual(rows[0], ['product_name', 'total_litres', 'location'])
+        self.assertEqual(len(rows), 4)
+
+    def test_expiring_soon_xlsx_download(self):
+        response = self.app.get('/inventory/expiring_soon?download=true')
+        self.assertEqual(response.status_code, 200)
+        sheet = load_workbook(io.BytesIO(response.data))['Expiring Soon']
+        self.assertEqual(sheet.max_row, 2)
+
+if __name__ == '__main__':
+    unittest.main()
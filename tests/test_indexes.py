@@ -0,0 +1,155 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from flask import Flask
+from sqlalchemy import select
+from models import db, Inventory, InventoryTransaction, ThresholdRule
+from reports import (
+    inventory_statement,
+    low_inventory_statement,
+    expiring_soon_statement,
+    inventory_taken_statement,
+)
+from thresholds import invalidate_rules
+
+# Number of seeded transactions. Enough for the planner to prefer the indexes;
+# set INDEX_TEST_TRANSACTIONS=1000000 to check the plans at production scale.
+TRANSACTIONS = int(os.environ.get('INDEX_TEST_TRANSACTIONS', 20000))
+ITEMS = 10000
+
+class IndexUsageTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.app = Flask(__name__)
+        cls.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(cls.directory, 'indexes.db')
+        db.init_app(cls.app)
+        invalidate_rules()
+        with cls.app.app_context():
+            db.create_all()
+            cls.seed()
+
+    @classmethod
+    def tearDownClass(cls):
+        with cls.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        invalidate_rules()
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    @classmethod
+    def seed(cls):
+        rng = random.Random(42)
+        today = date.today()
+        db.session.execute(Inventory.__table__.insert(), [
+            {
+                'material': 100000000 + index,
+                'product_name': f'Product {index}',
+                'total_litres': round(rng.uniform(1, 20000), 2),
+                'date_received': today - timedelta(days=rng.randint(0, 365)),
+                'best_before_date': today + timedelta(days=rng.randint(-30, 720)),
+                'location': f'Warehouse {index % 25}',
+            }
+            for index in range(ITEMS)
+        ])
+        start = datetime.now() - timedelta(days=365)
+        for offset in range(0, TRANSACTIONS, 50000):
+            db.session.execute(InventoryTransaction.__table__.insert(), [
+                {
+                    'inventory_id': rng.randint(1, ITEMS),
+                    'quantity_taken': rng.randint(1, 200),
+                    'date_taken': start + timedelta(seconds=rng.randint(0, 365 * 86400)),
+                }
+                for _ in range(min(50000, TRANSACTIONS - offset))
+            ])
+        # A default rule and a few narrower ones, as the routes resolve
+        # thresholds through them
+        db.session.add_all([
+            ThresholdRule(low_stock_litres=100),
+            ThresholdRule(material=100000005, low_stock_litres=300, expiry_days=30),
+            ThresholdRule(product_family='Product 1', expiry_days=120),
+            ThresholdRule(location='Warehouse 3', low_stock_litres=150),
+        ])
+        db.session.commit()
+        # Give the planner real statistics, as a production database has
+        db.session.execute(db.text('ANALYZE'))
+
+    def query_plan(self, statement):
+        with self.app.app_context():
+            compiled = statement.compile(dialect=db.engine.dialect)
+            params = [
+                float(value) if isinstance(value, Decimal) else value
+                for value in (compiled.params[name] for name in compiled.positiontup)
+            ]
+            with db.engine.connect() as connection:
+                # Run the report query once so slow plans show up in the timing
+                connection.exec_driver_sql(str(compiled), tuple(params)).fetchall()
+                rows = connection.exec_driver_sql(
+                    'EXPLAIN QUERY PLAN ' + str(compiled), tuple(params)
+                ).fetchall()
+        return '\n'.join(row[-1] for row in rows)
+
+    def assertUsesIndex(self, statement, table, *index_names):
+        plan = self.query_plan(statement)
+        self.assertNotIn(f'SCAN {table}\n', plan + '\n')
+        self.assertTrue(
+            any(
+                f'SEARCH {table} USING {kind}INDEX {name} ' in plan
+                for name in index_names
+                for kind in ('', 'COVERING ')
+            ),
+            plan,
+        )
+
+    def test_low_inventory_uses_total_litres_index(self):
+        self.assertUsesIndex(low_inventory_statement(50), 'inventory', 'ix_inventory_total_litres')
+
+    def test_low_inventory_with_rules_uses_total_litres_index(self):
+        # The query the below threshold routes and alert scans run
+        with self.app.app_context():
+            statement = low_inventory_statement()
+        self.assertUsesIndex(statement, 'inventory', 'ix_inventory_total_litres')
+
+    def test_expiring_soon_with_rules_uses_best_before_date_index(self):
+        with self.app.app_context():
+            statement = expiring_soon_statement()
+        self.assertUsesIndex(statement, 'inventory', 'ix_inventory_best_before_date')
+
+    def test_scheduled_low_inventory_uses_total_litres_index(self):
+        statement = inventory_statement().where(Inventory.total_litres < 50)
+        self.assertUsesIndex(statement, 'inventory', 'ix_inventory_total_litres')
+
+    def test_expiring_soon_uses_best_before_date_index(self):
+        self.assertUsesIndex(expiring_soon_statement(days=90), 'inventory', 'ix_inventory_best_before_date')
+
+    def test_inventory_taken_uses_date_taken_index(self):
+        end_date = datetime.now()
+        statement = inventory_taken_statement(end_date - timedelta(days=30), end_date)
+        # SQLite may drive the join from either transaction index, but never
+        # from a scan of the transaction table
+        self.assertUsesIndex(
+            statement,
+            'inventory_transaction',
+            'ix_inventory_transaction_date_taken',
+            'ix_inventory_transaction_inventory_id_date_taken',
+        )
+
+    def test_item_transactions_use_composite_index(self):
+        statement = select(InventoryTransaction.id).where(
+            InventoryTransaction.inventory_id == 42
+        )
+        self.assertUsesIndex(statement, 'inventory_transaction', 'ix_inventory_transaction_inventory_id_date_taken')
+
+    def test_item_transactions_in_range_use_composite_index(self):
+        statement = select(InventoryTransaction.quantity_taken).where(
+            InventoryTransaction.inventory_id == 42,
+            InventoryTransaction.date_taken >= datetime.now() - timedelta(days=30),
+        )
+        self.assertUsesIndex(statement, 'inventory_transaction', 'ix_inventory_transaction_inventory_id_date_taken')
+
+if __name__ == '__main__':
+    unittest.main()
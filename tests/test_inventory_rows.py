@@ -0,0 +1,87 @@
+import unittest
+from datetime import date
+from app import app, db
+from models import User, Inventory, DeletedInventory
+from tests.query_counter import QueryCountMixin
+
+ITEMS = 120
+
+class InventoryRowsTestCase(QueryCountMixin, unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        self.app = app.test_client()
+        with app.app_context():
+            db.create_all()
+            user = User(username='testuser', email='testuser@example.com', role='admin')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.execute(Inventory.__table__.insert(), [
+                {
+                    'material': 1000 + index,
+                    'product_name': f'Product{index}',
+                    'total_litres': 25,
+                    'date_received': date(2024, 7, 1),
+                    'best_before_date': date(2026, 7, 1),
+                    'location': 'Warehouse1'
+                }
+                for index in range(ITEMS)
+            ])
+            db.session.add(DeletedInventory(
+                original_id=999,
+                material=999,
+                product_name='Old Product',
+                total_litres=5,
+                date_received=date(2023, 1, 1),
+                best_before_date=date(2024, 1, 1),
+                location='Warehouse2'
+            ))
+            db.session.commit()
+        self.app.post('/login', data={
+            'username': 'testuser',
+            'password': 'password123'
+        })
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_pages_ship_without_rows(self):
+        for url in ('/view_full_inventory', '/delete_inventory', '/deleted_inventory'):
+            response = self.app.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(b'Product1', response.data)
+            self.assertNotIn(b'Old Product', response.data)
+
+    def test_rows_are_paged_with_projection(self):
+        with app.app_context():
+            engine = db.engine
+        items = []
+        cursor = None
+        while True:
+            params = {'fields': 'material,product_name', 'per_page': 50}
+            if cursor:
+                params['cursor'] = cursor
+            with self.assertMaxQueries(engine, 2):
+                data = self.app.get('/inventory/rows', query_string=params).get_json()
+            items.extend(data['items'])
+            cursor = data['next']
+            if not cursor:
+                break
+        self.assertEqual(len(items), ITEMS)
+        self.assertEqual(set(items[0]), {'id', 'material', 'product_name'})
+        self.assertEqual(items[0]['product_name'], 'Product0')
+
+    def test_deleted_rows(self):
+        data = self.app.get('/deleted_inventory/rows').get_json()
+        self.assertEqual(len(data['items']), 1)
+        self.assertEqual(data['items'][0]['date_received'], '2023-01-01')
+        self.assertEqual(data['items'][0]['total_litres'], '5.00')
+        self.assertIsNone(data['next'])
+
+    def test_unknown_field(self):
+        response = self.app.get('/inventory/rows', query_string={'fields': 'password_hash'})
+        self.assertEqual(response.status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+from datetime import date
+from app import app, db
+from inventory_search import reindex_inventory, trigrams
+from models import User, Inventory, InventoryTrigram
+from tests.query_counter import QueryCountMixin
+
+ITEMS = 45
+
+class InventorySearchTestCase(QueryCountMixin, unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        self.app = app.test_client()
+        with app.app_context():
+            db.create_all()
+            user = User(username='testuser', email='testuser@example.com', role='admin')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+        self.app.post('/login', data={
+            'username': 'testuser',
+            'password': 'password123'
+        })
+        with open_import_file() as upload:
+            response = self.app.post('/inventory/import', data={'file': (upload, 'inventory.csv')})
+        self.assertEqual(response.get_json()['imported'], ITEMS)
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def search(self, **params):
+        params.setdefault('format', 'json')
+        response = self.app.get('/inventory', query_string=params)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_trigrams(self):
+        self.assertEqual(trigrams('oil'), {'oil'})
+        self.assertEqual(trigrams('lagos'), {'lag', 'ago', 'gos'})
+        self.assertEqual(trigrams('ab'), set())
+
+    def test_cursor_walks_every_page_both_ways(self):
+        pages = [self.search(per_page=10)]
+        while pages[-1]['next']:
+            pages.append(self.search(per_page=10, cursor=pages[-1]['next']))
+        ids = [item['id'] for page in pages for item in page['items']]
+        self.assertEqual(len(pages), 5)
+        self.assertEqual(len(ids), ITEMS)
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(pages[0]['total'], ITEMS)
+        self.assertIsNone(pages[0]['prev'])
+
+        back = self.search(per_page=10, cursor=pages[-1]['prev'])
+        self.assertEqual(back['items'], pages[-2]['items'])
+        self.assertEqual(back['next'] is not None, True)
+
+    def test_count_can_be_skipped(self):
+        self.assertIsNone(self.search(count='false')['total'])
+
+    def test_search_uses_trigram_index(self):
+        page = self.search(product_name='engine', location='lagos', per_page=100)
+        self.assertEqual(page['total'], 15)
+        self.assertTrue(all(item['product_name'].startswith('Engine') for item in page['items']))
+        self.assertTrue(all(item['location'] == 'Lagos Depot' for item in page['items']))
+        # Trigrams found in both words but not as a substring
+        self.assertEqual(self.search(product_name='oilengine')['total'], 0)
+        # Short terms fall back to a scan
+        self.assertEqual(self.search(material='00', per_page=100)['total'], ITEMS)
+
+    def test_deep_pages_cost_the_same_as_the_first(self):
+        with app.app_context():
+            engine = db.engine
+        page = self.search(per_page=1, count='false')
+        for _ in range(ITEMS - 1):
+            with self.assertMaxQueries(engine, 2):
+                page = self.search(per_page=1, count='false', cursor=page['next'])
+        self.assertIsNone(page['next'])
+
+    def test_index_follows_updates_and_deletes(self):
+        with app.app_context():
+            item = Inventory.query.filter_by(product_name='Hydraulic Fluid 1').first()
+            item_id = item.id
+            item.product_name = 'Gear Lubricant'
+            reindex_inventory(item_id)
+            db.session.commit()
+        self.assertEqual([item['id'] for item in self.search(product_name='lubricant')['items']], [item_id])
+        self.app.post('/delete_inventory', data={'item_id': item_id})
+        self.assertEqual(self.search(product_name='lubricant')['total'], 0)
+        with app.app_context():
+            self.assertEqual(InventoryTrigram.query.filter_by(inventory_id=item_id).count(), 0)
+
+    def test_invalid_cursor(self):
+        response = self.app.get('/inventory', query_string={'format': 'json', 'cursor': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+def open_import_file():
+    import io
+    names = ['Engine Oil', 'Hydraulic Fluid', 'Gear Oil']
+    locations = ['Lagos Depot', 'Abuja Depot', 'Kano Store']
+    lines = ['material,product_name,total_litres,date_received,best_before_date,location']
+    for index in range(ITEMS):
+        lines.append(
+            f'{100000 + index},{names[index % 3]} {index},50,2024-07-01,2026-07-01,'
+            f'{locations[index % 3]}'
+        )
+    return io.BytesIO('\n'.join(lines).encode())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from app import app, db
+from ledger import MAX_HISTORY_DAYS, build_snapshots, stock_on, stock_history
+from models import User, Inventory, InventoryMovement, InventorySnapshot
+
+class LedgerTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        self.app = app.test_client()
+        with app.app_context():
+            db.create_all()
+            user = User(username='testuser', email='testuser@example.com', role='admin')
+            user.set_password('password123')
+            db.session.add(user)
+            item = Inventory(material=1000, product_name='Oil', total_litres=70,
+                             date_received=date(2024, 7, 1), best_before_date=date(2026, 7, 1),
+                             location='Warehouse1')
+            db.session.add(item)
+            db.session.flush()
+            self.inventory_id = item.id
+            for kind, quantity, created_at in [
+                ('receipt', 100, datetime(2024, 7, 1, 8)),
+                ('take', -20, datetime(2024, 7, 1, 15)),
+                ('take', -30, datetime(2024, 7, 3, 10)),
+                ('receipt', 50, datetime(2024, 7, 5, 9)),
+                ('take', -30, datetime(2024, 7, 5, 23, 59)),
+            ]:
+                db.session.add(InventoryMovement(
+                    inventory_id=item.id, material=1000, kind=kind,
+                    quantity=quantity, created_at=created_at
+                ))
+            db.session.commit()
+        self.app.post('/login', data={
+            'username': 'testuser',
+            'password': 'password123'
+        })
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_snapshots_are_incremental(self):
+        with app.app_context():
+            self.assertEqual(build_snapshots(date(2024, 7, 2)), 1)
+            # Rebuilding a day that already has snapshots is a no-op
+            self.assertEqual(build_snapshots(date(2024, 7, 2)), 0)
+            self.assertEqual(build_snapshots(date(2024, 7, 4)), 1)
+            snapshots = InventorySnapshot.query.order_by(InventorySnapshot.snapshot_date).all()
+            self.assertEqual(
+                [(s.snapshot_date, s.total_litres) for s in snapshots],
+                [(date(2024, 7, 2), Decimal('80.00')), (date(2024, 7, 4), Decimal('50.00'))],
+            )
+
+    def test_stock_on_matches_with_and_without_snapshots(self):
+        expected = {
+            date(2024, 6, 30): 0,
+            date(2024, 7, 1): 80,
+            date(2024, 7, 3): 50,
+            date(2024, 7, 5): 70,
+            date(2024, 8, 1): 70,
+        }
+        with app.app_context():
+            before = {day: stock_on(self.inventory_id, day) for day in expected}
+            build_snapshots(date(2024, 7, 3))
+            after = {day: stock_on(self.inventory_id, day) for day in expected}
+        self.assertEqual(before, expected)
+        self.assertEqual(after, expected)
+
+    def test_stock_history(self):
+        with app.app_context():
+            build_snapshots(date(2024, 7, 2))
+            history = stock_history(self.inventory_id, date(2024, 7, 2), date(2024, 7, 5))
+        self.assertEqual([total for _, total in history], [80, 50, 50, 70])
+
+    def test_take_route_logs_movement(self):
+        self.app.post('/take_inventory', data={'material': '1000', 'quantity': '5'})
+        response = self.app.get(f'/inventory/stock_on?material=1000&date={date.today().isoformat()}')
+        self.assertEqual(response.get_json()['total_litres'], 65.0)
+        response = self.app.get('/inventory/stock_history?material=1000&start_date=2024-07-04&end_date=2024-07-05')
+        self.assertEqual(response.get_json()['totals'], [50.0, 70.0])
+        self.assertEqual(self.app.get('/inventory/stock_on?material=9999').status_code, 404)
+
+    def test_history_range_is_capped(self):
+        url = '/inventory/stock_history?material=1000&start_date=1000-01-01&end_date=2900-01-01'
+        self.assertEqual(self.app.get(url).status_code, 400)
+        end_date = date(2024, 7, 5) + timedelta(days=MAX_HISTORY_DAYS - 1)
+        url = f'/inventory/stock_history?material=1000&start_date=2024-07-05&end_date={end_date.isoformat()}'
+        response = self.app.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()['totals']), MAX_HISTORY_DAYS)
+
+    def test_dates_at_the_ends_of_the_calendar_are_rejected(self):
+        for url in (
+            '/inventory/stock_on?material=1000&date=9999-12-31',
+            '/inventory/stock_on?material=1000&date=0001-01-01',
+            '/inventory/stock_history?material=1000&start_date=0001-01-01&end_date=0001-01-05',
+            '/inventory/stock_history?material=1000&end_date=0001-01-05',
+            '/inventory/stock_history?material=1000&start_date=9999-12-01&end_date=9999-12-31',
+        ):
+            self.assertEqual(self.app.get(url).status_code, 400, url)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from app import app, db, mail_queue
+from models import OutboundEmail, User
+from tests.smtp_server import SMTPStandIn
+
+class MailQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        self.app = app.test_client()
+        # Point the mail connection at the local stand-in
+        self.mail_state = app.extensions['mail']
+        self.saved_state = (self.mail_state.server, self.mail_state.port, self.mail_state.suppress, self.mail_state.use_tls)
+        with app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        self.mail_state.server, self.mail_state.port, self.mail_state.suppress, self.mail_state.use_tls = self.saved_state
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def use_server(self, server):
+        self.mail_state.server = '127.0.0.1'
+        self.mail_state.port = server.port
+        self.mail_state.suppress = False
+        self.mail_state.use_tls = False
+
+    def register(self, username):
+        return self.app.post('/register', data={
+            'username': username,
+            'email': f'{username}@example.com',
+            'password': 'password123',
+            'role': 'staff'
+        })
+
+    def emails(self):
+        with app.app_context():
+            return db.session.scalars(select(OutboundEmail).order_by(OutboundEmail.id)).all()
+
+    def test_requests_queue_mail_without_smtp(self):
+        # Nothing listens on the configured SMTP port, yet registering works
+        response = self.register('newuser')
+        self.assertEqual(response.status_code, 302)
+        emails = self.emails()
+        self.assertEqual(len(emails), 1)
+        self.assertEqual(emails[0].subject, 'Welcome to StockGuard')
+        self.assertEqual(emails[0].status, 'queued')
+        with app.app_context():
+            self.assertIsNotNone(User.query.filter_by(username='newuser').first())
+
+    def test_batches_share_one_connection(self):
+        for index in range(5):
+            self.register(f'user{index}')
+        app.config['MAIL_QUEUE_BATCH_SIZE'] = 2
+        try:
+            with SMTPStandIn() as server:
+                self.use_server(server)
+                with app.app_context():
+                    self.assertEqual(mail_queue.send_pending(), 5)
+                    # Nothing is sent twice
+                    self.assertEqual(mail_queue.send_pending(), 0)
+        finally:
+            app.config['MAIL_QUEUE_BATCH_SIZE'] = 50
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(
+            sorted(recipients[0] for recipients, _ in server.messages),
+            [f'user{index}@example.com' for index in range(5)]
+        )
+        self.assertTrue(all(email.status == 'sent' for email in self.emails()))
+
+    def test_failures_retry_with_backoff(self):
+        self.register('first')
+        self.register('second')
+        with SMTPStandIn() as server:
+            self.use_server(server)
+            server.reject = ['451 Try again later']
+            with app.app_context():
+                self.assertEqual(mail_queue.send_pending(), 1)
+            failed = self.emails()[0]
+            self.assertEqual((failed.status, failed.attempts), ('queued', 1))
+            self.assertIn('451', failed.last_error)
+            self.assertGreater(failed.next_attempt_at, datetime.utcnow() + timedelta(seconds=20))
+
+            with app.app_context():
+                # Not due yet
+                self.assertEqual(mail_queue.send_pending(), 0)
+                db.session.execute(update(OutboundEmail).values(next_attempt_at=datetime.utcnow()))
+                db.session.commit()
+                server.reject = ['550 No such user']
+                self.assertEqual(mail_queue.send_pending(), 0)
+        # Permanent errors are not retried
+        self.assertEqual(self.emails()[0].status, 'failed')
+        self.assertEqual(len(server.messages), 1)
+
+    def test_unreachable_server_defers_the_batch(self):
+        self.register('newuser')
+        with SMTPStandIn() as server:
+            port = server.port
+        self.mail_state.server = '127.0.0.1'
+        self.mail_state.port = port
+        self.mail_state.suppress = False
+        self.mail_state.use_tls = False
+        with app.app_context():
+            self.assertEqual(mail_queue.send_pending(), 0)
+        email = self.emails()[0]
+        self.assertEqual((email.status, email.attempts), ('queued', 1))
+        self.assertIsNone(email.claimed_by)
+
+if __name__ == '__main__':
+    unittest.main()
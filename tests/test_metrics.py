@@ -0,0 +1,118 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import date
+from app import app, db
+from models import User, Inventory
+
+# Value of a sample in the Prometheus text output, or 0 if it is missing
+def sample(text, name):
+    for line in text.splitlines():
+        if line.startswith(name + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return 0
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        self.app = app.test_client()
+        with app.app_context():
+            db.create_all()
+            user = User(username='testuser', email='testuser@example.com', role='admin')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.execute(Inventory.__table__.insert(), [
+                {
+                    'material': 1000 + index,
+                    'product_name': f'Product{index}',
+                    'total_litres': 25,
+                    'date_received': date(2024, 7, 1),
+                    'best_before_date': date(2026, 7, 1),
+                    'location': 'Warehouse1'
+                }
+                for index in range(3)
+            ])
+            db.session.commit()
+        self.app.post('/login', data={'username': 'testuser', 'password': 'password123'})
+
+    def tearDown(self):
+        app.config['METRICS_TOKEN'] = None
+        app.config['METRICS_DIR'] = None
+        app.config['SLOW_REQUEST_SECONDS'] = None
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def metrics(self):
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        return response.data.decode()
+
+    def test_requests_and_their_sql_are_counted(self):
+        labels = '{endpoint="main.get_total_inventory",method="GET",status="200"}'
+        before = self.metrics()
+        for _ in range(2):
+            self.assertEqual(self.app.get('/inventory/total').status_code, 200)
+        after = self.metrics()
+        count = sample(after, f'http_request_duration_seconds_count{labels}')
+        self.assertEqual(count - sample(before, f'http_request_duration_seconds_count{labels}'), 2)
+        # The +Inf bucket holds every request
+        inf_labels = labels[:-1] + ',le="+Inf"}'
+        self.assertEqual(sample(after, f'http_request_duration_seconds_bucket{inf_labels}'), count)
+        statements = 'sql_statements_total{endpoint="main.get_total_inventory"}'
+        self.assertEqual(sample(after, statements) - sample(before, statements), 2)
+        self.assertIn('# TYPE db_pool_checked_out gauge', after)
+
+    def test_exports_record_rows(self):
+        rows = 'export_rows_total{report="Inventory Levels",format="csv"}'
+        before = sample(self.metrics(), rows)
+        response = self.app.get('/report/inventory_levels?download=true&format=csv')
+        self.assertEqual(len(response.data.decode().splitlines()), 4)
+        self.assertEqual(sample(self.metrics(), rows) - before, 3)
+
+    def test_token_protects_metrics(self):
+        app.config['METRICS_TOKEN'] = 'scrape-secret'
+        self.assertEqual(self.app.get('/metrics').status_code, 401)
+        response = self.app.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_slow_requests_are_logged_with_their_sql(self):
+        self.app.get('/inventory/total')
+        app.config['SLOW_REQUEST_SECONDS'] = 0
+        with self.assertLogs(app.logger, 'WARNING') as logs:
+            self.app.get('/inventory/total')
+        self.assertIn('main.get_total_inventory', logs.output[0])
+        self.assertIn('SELECT count', logs.output[0])
+
+    def test_workers_serve_their_shared_totals(self):
+        statements = 'sql_statements_total{endpoint="main.get_total_inventory"}'
+        pool_size = 'db_pool_size{bind="primary"}'
+        with tempfile.TemporaryDirectory() as directory:
+            app.config['METRICS_DIR'] = directory
+            self.app.get('/inventory/total')
+            before = self.metrics()
+            # Files as left by another running worker and by one that exited
+            dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+            dead.wait()
+            for pid in (os.getppid(), dead.pid):
+                with open(os.path.join(directory, f'metrics-{pid}-test.json'), 'w') as output:
+                    json.dump({'pid': pid, 'samples': {
+                        'sql_statements_total': [['sql_statements_total', ['endpoint'], ['main.get_total_inventory'], 10]],
+                        'db_pool_size': [['db_pool_size', ['bind'], ['primary'], 7]],
+                    }}, output)
+            for _ in range(2):
+                after = self.metrics()
+                self.assertEqual(sample(after, statements), sample(before, statements) + 20)
+                # Gauges only count the workers still running
+                self.assertEqual(sample(after, pool_size), sample(before, pool_size) + 7)
+            # The exited worker's counts were moved to the archive
+            self.assertFalse(os.path.exists(os.path.join(directory, f'metrics-{dead.pid}-test.json')))
+            self.assertTrue(os.path.exists(os.path.join(directory, 'metrics-archive.json')))
+            app.config['METRICS_DIR'] = None
+
+if __name__ == '__main__':
+    unittest.main()
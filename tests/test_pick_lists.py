@@ -0,0 +1,88 @@
+import unittest
+from datetime import date
+from decimal import Decimal
+from app import app, db
+from inventory_lookup import material_cache
+from models import User, Inventory, InventoryTransaction, InventoryMovement
+from thresholds import current_rules
+from tests.query_counter import QueryCountMixin
+
+class PickListTestCase(QueryCountMixin, unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        self.app = app.test_client()
+        material_cache.clear()
+        with app.app_context():
+            db.create_all()
+            user = User(username='testuser', email='testuser@example.com', role='admin')
+            user.set_password('password123')
+            db.session.add(user)
+            for index in range(10):
+                db.session.add(Inventory(
+                    material=1000 + index,
+                    product_name=f'Product{index}',
+                    total_litres=100,
+                    date_received=date(2024, 7, 1),
+                    best_before_date=date(2026, 7, 1),
+                    location='Warehouse1'
+                ))
+            db.session.commit()
+        self.app.post('/login', data={
+            'username': 'testuser',
+            'password': 'password123'
+        })
+
+    def tearDown(self):
+        material_cache.clear()
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def take(self, lines):
+        return self.app.post('/take_inventory/batch', json={'lines': lines})
+
+    def test_pick_list_is_taken_in_one_transaction(self):
+        lines = [{'material': str(1000 + index % 10), 'quantity': 5} for index in range(20)]
+        # Warm the lookup and rule caches so only the batch itself is counted
+        for index in range(10):
+            self.app.post('/get_inventory_by_material', json={'material': str(1000 + index)})
+        with app.app_context():
+            current_rules()
+            engine = db.engine
+        # The batch reads the threshold rules version once and stores its
+        # live events in one statement
+        with self.assertMaxQueries(engine, 7):
+            response = self.take(lines)
+        self.assertEqual(response.status_code, 200)
+        taken = response.get_json()['taken']
+        self.assertEqual(len(taken), 10)
+        self.assertEqual(taken[0]['remaining'], '90.00')
+
+        with app.app_context():
+            self.assertEqual(InventoryTransaction.query.count(), 20)
+            self.assertEqual(InventoryMovement.query.filter_by(kind='take').count(), 20)
+            item = Inventory.query.filter_by(material=1003).first()
+            self.assertEqual(item.total_litres, Decimal('90.00'))
+
+    def test_insufficient_line_rejects_whole_pick_list(self):
+        response = self.take([
+            {'material': '1000', 'quantity': 60},
+            {'material': '1001', 'quantity': 10},
+            {'material': '1000', 'quantity': 50},
+        ])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([error['line'] for error in response.get_json()['errors']], [3])
+        with app.app_context():
+            self.assertEqual(InventoryTransaction.query.count(), 0)
+            item = Inventory.query.filter_by(material=1001).first()
+            self.assertEqual(item.total_litres, Decimal('100.00'))
+
+    def test_invalid_lines(self):
+        response = self.take([{'material': '9999', 'quantity': 1}])
+        self.assertEqual(response.status_code, 409)
+        response = self.take([{'material': '1000', 'quantity': -1}, {'quantity': 1}])
+        self.assertEqual(len(response.get_json()['errors']), 2)
+        self.assertEqual(self.take([]).status_code, 409)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import pstats
+import tempfile
+import unittest
+from app import app, db, scheduled_job
+from models import User
+
+SETTINGS = ('PROFILE_MODE', 'PROFILE_THRESHOLD', 'PROFILE_DIR', 'PROFILE_KEEP')
+
+@scheduled_job
+def nightly_job():
+    return sum(range(1000))
+
+class ProfilingTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        self.saved = {name: app.config[name] for name in SETTINGS}
+        self.directory = tempfile.TemporaryDirectory()
+        app.config['PROFILE_DIR'] = self.directory.name
+        self.app = app.test_client()
+        with app.app_context():
+            db.create_all()
+            for username, role in (('admin', 'admin'), ('staff', 'staff')):
+                user = User(username=username, email=f'{username}@example.com', role=role)
+                user.set_password('password123')
+                db.session.add(user)
+            db.session.commit()
+
+    def tearDown(self):
+        app.config.update(self.saved)
+        self.directory.cleanup()
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def login(self, username):
+        self.app.post('/login', data={'username': username, 'password': 'password123'})
+
+    def saved_profiles(self):
+        return sorted(os.listdir(self.directory.name))
+
+    def test_nothing_is_profiled_when_off(self):
+        self.login('admin')
+        self.assertEqual(self.app.get('/inventory/total').status_code, 200)
+        nightly_job()
+        self.assertEqual(self.saved_profiles(), [])
+
+    def test_slow_requests_are_profiled(self):
+        self.login('staff')
+        app.config.update(PROFILE_MODE='cprofile', PROFILE_THRESHOLD=60)
+        self.app.get('/inventory/total')
+        self.assertEqual(self.saved_profiles(), [])
+        app.config['PROFILE_THRESHOLD'] = 0
+        response = self.app.get('/inventory/total')
+        # Only a profile asked for by header is announced
+        self.assertNotIn('X-Profile-Saved', response.headers)
+        [name] = self.saved_profiles()
+        self.assertIn('-request-main.get_total_inventory-', name)
+        stats = pstats.Stats(os.path.join(self.directory.name, name))
+        self.assertTrue(any(function == 'get_total_inventory' for _, _, function in stats.stats))
+
+    def test_admins_can_profile_one_request_by_header(self):
+        self.login('staff')
+        self.app.get('/inventory/total', headers={'X-Profile': 'sampling'})
+        self.assertEqual(self.saved_profiles(), [])
+        self.login('admin')
+        response = self.app.get('/inventory/total', headers={'X-Profile': 'sampling'})
+        name = response.headers['X-Profile-Saved']
+        self.assertEqual(self.saved_profiles(), [name])
+        self.assertTrue(name.endswith('.txt'))
+
+    def test_streamed_bodies_are_profiled(self):
+        self.login('admin')
+        response = self.app.get('/report/inventory_levels?download=true&format=csv', headers={'X-Profile': 'cprofile'})
+        self.assertEqual(self.saved_profiles(), [])
+        response.get_data()
+        response.close()
+        [name] = self.saved_profiles()
+        self.assertIn('-request-main.', name)
+        stats = pstats.Stats(os.path.join(self.directory.name, name))
+        # The rows were written while the profile was still running
+        self.assertTrue(any(function == 'iter_csv' for _, _, function in stats.stats))
+
+    def test_job_runs_are_profiled_and_rotated(self):
+        app.config.update(PROFILE_MODE='cprofile', PROFILE_KEEP=2)
+        for _ in range(3):
+            self.assertEqual(nightly_job(), 499500)
+        names = self.saved_profiles()
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all('-job-nightly_job-' in name for name in names))
+
+    def test_admin_page_lists_and_downloads_profiles(self):
+        app.config.update(PROFILE_MODE='sampling', PROFILE_THRESHOLD=0)
+        nightly_job()
+        [name] = self.saved_profiles()
+        self.login('staff')
+        self.assertEqual(self.app.get('/admin/profiles').status_code, 403)
+        app.config['PROFILE_MODE'] = None
+        self.login('admin')
+        response = self.app.get('/admin/profiles')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(name.encode(), response.data)
+        response = self.app.get(f'/admin/profiles/{name}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        response.close()
+        self.assertEqual(self.app.get('/admin/profiles/..%2Fconfig.py').status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
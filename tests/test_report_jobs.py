@@ -0,0 +1,154 @@
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from datetime import date
+from unittest import mock
+from openpyxl import load_workbook
+from app import app, db
+from models import User, Inventory
+
+# Runs jobs as they are submitted, so no pool thread shares the one
+# connection of the in-memory test database
+class InlineExecutor:
+    def submit(self, fn, *args):
+        fn(*args)
+
+class ReportJobTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        executor = mock.patch.object(app.extensions['report_jobs'], 'executor', InlineExecutor())
+        executor.start()
+        self.addCleanup(executor.stop)
+        self.job_dir = tempfile.mkdtemp()
+        app.config['REPORT_JOB_DIR'] = self.job_dir
+        self.app = app.test_client()
+        with app.app_context():
+            db.create_all()
+            user = User(username='testuser', email='testuser@example.com', role='admin')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.add(Inventory(
+                material=1000,
+                product_name='Product1',
+                total_litres=100,
+                date_received=date(2024, 7, 23),
+                best_before_date=date(2025, 7, 23),
+                location='Warehouse1'
+            ))
+            db.session.commit()
+        self.app.post('/login', data={
+            'username': 'testuser',
+            'password': 'password123'
+        })
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        shutil.rmtree(self.job_dir, ignore_errors=True)
+
+    def wait_for_job(self, status_url):
+        for _ in range(100):
+            job = self.app.get(status_url).get_json()
+            if job['status'] in ('finished', 'failed'):
+                return job
+            time.sleep(0.05)
+        self.fail('Report job did not finish')
+
+    def test_async_report_download(self):
+        response = self.app.get('/report/inventory_levels?download=true&async=true')
+        self.assertEqual(response.status_code, 202)
+        job = self.wait_for_job(response.get_json()['status_url'])
+        self.assertEqual(job['status'], 'finished')
+        self.assertEqual(job['rows'], 1)
+
+        response = self.app.get(job['download_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('inventory_levels_report.xlsx', response.headers['Content-Disposition'])
+        sheet = load_workbook(io.BytesIO(response.data))['Inventory Levels']
+        self.assertEqual(sheet.max_row, 2)
+
+    def test_identical_jobs_are_shared(self):
+        with mock.patch.object(app.extensions['report_jobs'], 'executor'):
+            first = self.app.post('/reports/jobs', json={
+                'report': 'inventory_taken',
+                'params': {'start_date': '2024-01-01', 'end_date': '2024-12-31'}
+            }).get_json()
+            second = self.app.post('/reports/jobs', json={
+                'report': 'inventory_taken',
+                'params': {'start_date': '2024-01-01', 'end_date': '2024-12-31'}
+            }).get_json()
+            other = self.app.post('/reports/jobs', json={
+                'report': 'inventory_taken',
+                'params': {'start_date': '2024-02-01', 'end_date': '2024-12-31'}
+            }).get_json()
+        self.assertEqual(first['id'], second['id'])
+        self.assertNotEqual(first['id'], other['id'])
+        response = self.app.get(f"/reports/jobs/{first['id']}/download")
+        self.assertEqual(response.status_code, 409)
+
+    def submit_levels(self):
+        return self.app.post('/reports/jobs', json={'report': 'inventory_levels'}).get_json()
+
+    def test_jobs_of_dead_workers_are_replaced(self):
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+        with mock.patch.object(app.extensions['report_jobs'], 'executor'):
+            first = self.submit_levels()
+            path = os.path.join(self.job_dir, f"{first['id']}.json")
+            with open(path) as job_file:
+                job = json.load(job_file)
+            job['pid'] = dead.pid
+            with open(path, 'w') as job_file:
+                json.dump(job, job_file)
+            second = self.submit_levels()
+        self.assertNotEqual(first['id'], second['id'])
+        job = self.app.get(f"/reports/jobs/{first['id']}").get_json()
+        self.assertEqual(job['status'], 'failed')
+
+    def test_jobs_that_miss_heartbeats_are_dead(self):
+        with mock.patch.object(app.extensions['report_jobs'], 'executor'):
+            first = self.submit_levels()
+            stale = time.time() - 3600
+            os.utime(os.path.join(self.job_dir, f"{first['id']}.json"), (stale, stale))
+            second = self.submit_levels()
+        self.assertNotEqual(first['id'], second['id'])
+
+    def test_cleanup_keeps_markers_of_live_jobs(self):
+        with mock.patch.object(app.extensions['report_jobs'], 'executor'):
+            first = self.submit_levels()
+            # The build has outlived the TTL; only its status file is fresh
+            stale = time.time() - 7200
+            for name in os.listdir(self.job_dir):
+                if name.startswith('pending-'):
+                    os.utime(os.path.join(self.job_dir, name), (stale, stale))
+            second = self.submit_levels()
+        self.assertEqual(first['id'], second['id'])
+
+    def test_failures_do_not_leak_error_details(self):
+        with mock.patch('report_jobs.write_export', side_effect=RuntimeError('SELECT secret FROM /srv/db')):
+            job = self.wait_for_job(self.app.get('/report/inventory_levels?download=true&async=true').get_json()['status_url'])
+        self.assertEqual(job['status'], 'failed')
+        self.assertNotIn('secret', job['error'])
+
+    def test_invalid_report_parameters(self):
+        response = self.app.post('/reports/jobs', json={
+            'report': 'inventory_taken',
+            'params': {'start_date': 'yesterday', 'end_date': '2024-12-31'}
+        })
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post('/reports/jobs', json=['inventory_levels'])
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post('/reports/jobs', json={'report': 'inventory_levels', 'params': 'all'})
+        self.assertEqual(response.status_code, 400)
+        response = self.app.get('/reports/jobs/doesnotexist')
+        self.assertEqual(response.status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from datetime import date, datetime, timedelta
+from app import app, db
+from models import User, Inventory, InventoryTransaction
+from tests.query_counter import QueryCountMixin
+
+# Every report is built from a single statement, however many rows it has
+MAX_REPORT_QUERIES = 1
+
+class ReportQueryCountTestCase(QueryCountMixin, unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        self.app = app.test_client()
+        with app.app_context():
+            db.create_all()
+            user = User(username='testuser', email='testuser@example.com', role='admin')
+            user.set_password('password123')
+            db.session.add(user)
+            items = [
+                Inventory(
+                    material=1000 + index,
+                    product_name=f'Product{index}',
+                    total_litres=20 * index,
+                    date_received=date.today(),
+                    best_before_date=date.today() + timedelta(days=15 * index),
+                    location='Warehouse1'
+                )
+                for index in range(10)
+            ]
+            db.session.add_all(items)
+            db.session.flush()
+            db.session.add_all([
+                InventoryTransaction(
+                    inventory_id=items[index % 10].id,
+                    quantity_taken=5,
+                    date_taken=datetime.now() - timedelta(days=index % 5)
+                )
+                for index in range(50)
+            ])
+            db.session.commit()
+        self.app.post('/login', data={
+            'username': 'testuser',
+            'password': 'password123'
+        })
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def assertReportQueries(self, method, url, **kwargs):
+        with app.app_context():
+            engine = db.engine
+        with self.assertMaxQueries(engine, MAX_REPORT_QUERIES):
+            response = self.app.open(url, method=method, **kwargs)
+            response.get_data()
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_inventory_list_queries(self):
+        for url in ('/inventory/below_threshold', '/inventory/expiring_soon'):
+            for query in ('', '?download=true', '?download=true&format=csv'):
+                self.assertReportQueries('GET', url + query)
+
+    def test_inventory_levels_queries(self):
+        self.assertReportQueries('GET', '/report/inventory_levels?download=true')
+        self.assertReportQueries('GET', '/report/inventory_levels?download=true&format=csv')
+
+    def test_inventory_taken_queries(self):
+        data = {
+            'start_date': (date.today() - timedelta(days=10)).isoformat(),
+            'end_date': (date.today() + timedelta(days=1)).isoformat(),
+        }
+        response = self.assertReportQueries('POST', '/report/inventory_taken', data=data)
+        self.assertEqual(response.data.count(b'<td>Product'), 50)
+        self.assertReportQueries('POST', '/report/inventory_taken', data=dict(data, download='true'))
+
+    def test_user_activity_queries(self):
+        self.assertReportQueries('GET', '/report/user_activity')
+        self.assertReportQueries('GET', '/report/user_activity?download=true')
+
+if __name__ == '__main__':
+    unittest.main()
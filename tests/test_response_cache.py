@@ -0,0 +1,141 @@
+import os
+import tempfile
+import unittest
+from datetime import date, datetime
+from decimal import Decimal
+from flask import Flask
+from sqlalchemy import update
+from app import app, db
+from models import Inventory, User
+from response_cache import DiskBackend, dump_entry, load_entry, response_cache
+from thresholds import invalidate_rules
+from tests.test_metrics import sample
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        self.app = app.test_client()
+        invalidate_rules()
+        with app.app_context():
+            db.create_all()
+            user = User(username='testuser', email='testuser@example.com', role='admin')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.execute(Inventory.__table__.insert(), [
+                {
+                    'material': 1000 + index,
+                    'product_name': f'Product{index}',
+                    'total_litres': 500 + 1000 * index,
+                    'date_received': date(2024, 7, 1),
+                    'best_before_date': date(2030, 7, 1),
+                    'location': 'Warehouse1'
+                }
+                for index in range(3)
+            ])
+            db.session.commit()
+        self.app.post('/login', data={'username': 'testuser', 'password': 'password123'})
+
+    def tearDown(self):
+        invalidate_rules()
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    # Change stock behind the app's back, without bumping any generation
+    def change_stock_directly(self, litres):
+        with app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(update(Inventory).values(total_litres=litres))
+
+    def hits(self, endpoint):
+        metrics = self.app.get('/metrics').data.decode()
+        return sample(metrics, f'response_cache_lookups_total{{endpoint="{endpoint}",result="hit"}}')
+
+    def low_stock(self):
+        return sorted(item['total_litres'] for item in self.app.get('/inventory/below_threshold').get_json())
+
+    def test_reports_are_served_from_cache_until_a_write(self):
+        self.app.post('/thresholds', json={'low_stock_litres': '1000'})
+        self.assertEqual(self.low_stock(), [500])
+        before = self.hits('main.get_inventory_below_threshold')
+        self.change_stock_directly(10)
+        self.assertEqual(self.low_stock(), [500])
+        self.assertEqual(self.hits('main.get_inventory_below_threshold') - before, 1)
+        # A take through the app invalidates the result
+        self.app.post('/take_inventory', data={'material': '1000', 'quantity': '1'})
+        self.assertEqual(self.low_stock(), [9, 10, 10])
+
+    def test_excel_downloads_are_cached(self):
+        url = '/report/inventory_levels?download=true&format=xlsx'
+        first = self.app.get(url)
+        self.assertEqual(first.status_code, 200)
+        data = first.data
+        first.close()
+        self.change_stock_directly(999)
+        second = self.app.get(url)
+        self.assertEqual(second.data, data)
+        self.assertIn('inventory_levels_report.xlsx', second.headers['Content-Disposition'])
+        second.close()
+        with app.app_context():
+            db.session.execute(update(Inventory).values(total_litres=5))
+            db.session.commit()
+        third = self.app.get(url)
+        self.assertNotEqual(third.data, data)
+        third.close()
+
+    def test_threshold_rules_and_users_invalidate_their_results(self):
+        self.assertEqual(self.low_stock(), [])
+        response = self.app.post('/thresholds', json={'low_stock_litres': '2000'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.low_stock(), [500, 1500])
+
+        self.assertNotIn(b'newuser', self.app.get('/report/user_activity').data)
+        with app.app_context():
+            user = User(username='newuser', email='newuser@example.com', role='staff')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+        self.assertIn(b'newuser', self.app.get('/report/user_activity').data)
+
+    def test_rolled_back_writes_keep_the_cache(self):
+        with app.app_context(), app.test_request_context():
+            before = response_cache.backend.generations(('inventory',))
+            db.session.execute(update(Inventory).values(total_litres=1))
+            db.session.rollback()
+            self.assertEqual(response_cache.backend.generations(('inventory',)), before)
+            db.session.execute(update(Inventory).values(total_litres=1))
+            db.session.commit()
+            self.assertEqual(response_cache.backend.generations(('inventory',)), [before[0] + 1])
+
+    def test_disk_backend_is_shared_between_workers(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        config = Flask(__name__)
+        config.config.update(RESPONSE_CACHE_DIR=directory.name, RESPONSE_CACHE_SIZE=10, RESPONSE_CACHE_TTL=60)
+        first, second = DiskBackend(config), DiskBackend(config)
+        self.assertEqual(first.generations(('inventory', 'users')), [0, 0])
+        first.incr('inventory')
+        first.incr('inventory')
+        self.assertEqual(second.generations(('inventory', 'users')), [2, 0])
+        first.set('key', b'report bytes')
+        self.assertEqual(second.get('key'), b'report bytes')
+        self.assertIsNone(second.get('other'))
+        second.ttl = -1
+        second.set('key', b'expired')
+        self.assertIsNone(first.get('key'))
+        for index in range(15):
+            first.set(f'entry{index}', b'x')
+        first.prune()
+        self.assertEqual(len([name for name in os.listdir(directory.name) if name.endswith('.entry')]), 10)
+
+    def test_entries_are_typed_not_pickled(self):
+        result = [{'total_litres': Decimal('10.50'), 'received': date(2024, 7, 1),
+                   'taken_at': datetime(2024, 7, 1, 9, 30), 'location': 'Warehouse1'}]
+        self.assertEqual(load_entry(dump_entry(result)), result)
+        self.assertTrue(dump_entry(result).startswith(b'json\n'))
+        self.assertEqual(load_entry(dump_entry(b'PK\x03\x04')), b'PK\x03\x04')
+        with self.assertRaises(ValueError):
+            load_entry(b'\x80\x05K\x01.')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.triggers.interval import IntervalTrigger
+import scheduler
+from app import scheduled_job
+from metrics import job_failures, job_seconds
+from scheduler import JOBS, acquire_lock, create_scheduler, sync_jobs
+
+@scheduled_job
+def failing_job():
+    time.sleep(0.05)
+    raise RuntimeError('job failed')
+
+class SchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.url = f'sqlite:///{os.path.join(self.directory.name, "jobs.db")}'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def start(self):
+        runner = create_scheduler(SQLAlchemyJobStore(url=self.url))
+        runner.start(paused=True)
+        sync_jobs(runner)
+        return runner
+
+    def test_jobs_persist_across_restarts(self):
+        runner = self.start()
+        self.assertEqual(sorted(job.id for job in runner.get_jobs()), sorted(job_id for job_id, _, _ in JOBS))
+        next_runs = {job.id: job.next_run_time for job in runner.get_jobs()}
+        runner.shutdown()
+
+        # A restarted runner keeps the stored schedule
+        runner = self.start()
+        self.assertEqual({job.id: job.next_run_time for job in runner.get_jobs()}, next_runs)
+        runner.shutdown()
+
+    def test_changed_and_removed_jobs_are_synced(self):
+        self.start().shutdown()
+        original = scheduler.JOBS
+        scheduler.JOBS = [
+            (job_id, func, IntervalTrigger(minutes=5) if job_id == 'cleanup_report_jobs' else trigger)
+            for job_id, func, trigger in original
+            if job_id != 'send_queued_mail'
+        ]
+        try:
+            runner = self.start()
+            jobs = {job.id: job for job in runner.get_jobs()}
+            runner.shutdown()
+        finally:
+            scheduler.JOBS = original
+        self.assertNotIn('send_queued_mail', jobs)
+        self.assertEqual(jobs['cleanup_report_jobs'].trigger.interval.total_seconds(), 300)
+
+    def test_only_one_runner_holds_the_lock(self):
+        path = os.path.join(self.directory.name, 'scheduler.lock')
+        leader = acquire_lock(path, wait=False)
+        self.assertIsNotNone(leader)
+        self.assertIsNone(acquire_lock(path, wait=False))
+        leader.close()
+        standby = acquire_lock(path, wait=False)
+        self.assertIsNotNone(standby)
+        standby.close()
+
+    def test_job_runs_are_timed(self):
+        runner = create_scheduler(MemoryJobStore())
+        done = threading.Event()
+        runner.add_listener(lambda event: done.set(), EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+        runner.start()
+        try:
+            runner.add_job(failing_job, id='failing_job')
+            self.assertTrue(done.wait(5))
+        finally:
+            runner.shutdown()
+        counts, total, count = job_seconds.values[('failing_job',)]
+        self.assertEqual(count, 1)
+        self.assertGreaterEqual(total, 0.05)
+        self.assertEqual(job_failures.values[('failing_job',)], 1)
+
+if __name__ == '__main__':
+    unittest.main()
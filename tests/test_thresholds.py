@@ -0,0 +1,179 @@
+import io
+import unittest
+from datetime import date, timedelta
+from decimal import Decimal
+from sqlalchemy import select
+from app import app, db
+from inventory_changes import item_state
+from models import Inventory, InventoryAlert, User
+from dashboard_counters import dashboard_summary, rebuild_counters
+from thresholds import current_rules, invalidate_rules, rule_cache, rules_version, with_thresholds
+
+
+class ThresholdRulesTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config_test.TestConfig')
+        self.app = app.test_client()
+        invalidate_rules()
+        with app.app_context():
+            db.create_all()
+            user = User(username='testuser', email='testuser@example.com', role='admin')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+        self.app.post('/login', data={
+            'username': 'testuser',
+            'password': 'password123'
+        })
+        today = date.today()
+        rows = [
+            (1001, 'Engine Oil 5W-30', 40, today + timedelta(days=400), 'Lagos'),
+            (1002, 'Engine Oil 10W-40', 800, today + timedelta(days=100), 'Kano'),
+            (1003, 'Drum Coolant', 3000, today + timedelta(days=150), 'Lagos'),
+            (1004, 'Gear Oil', 30, today + timedelta(days=20), 'Kano'),
+        ]
+        lines = ['material,product_name,total_litres,date_received,best_before_date,location']
+        lines.extend(
+            f'{material},{name},{litres},2024-07-01,{best_before:%Y-%m-%d},{location}'
+            for material, name, litres, best_before, location in rows
+        )
+        upload = io.BytesIO('\n'.join(lines).encode())
+        self.app.post('/inventory/import', data={'file': (upload, 'inventory.csv')})
+
+    def tearDown(self):
+        invalidate_rules()
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def save_rule(self, **rule):
+        response = self.app.post('/thresholds', json=rule)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def materials(self, url):
+        return sorted(int(Decimal(item['material'])) for item in self.app.get(url).get_json())
+
+    def active_alerts(self):
+        with app.app_context():
+            return sorted(
+                (int(alert.material), alert.kind)
+                for alert in db.session.scalars(
+                    select(InventoryAlert).where(InventoryAlert.active.is_(True))
+                )
+            )
+
+    def test_fallback_thresholds(self):
+        self.assertEqual(self.materials('/inventory/below_threshold'), [1001, 1004])
+        self.assertEqual(self.materials('/inventory/expiring_soon'), [1004])
+
+    def test_most_specific_rule_wins(self):
+        self.save_rule(low_stock_litres=100, expiry_days=120)
+        self.save_rule(location='Lagos', low_stock_litres=5000)
+        self.save_rule(product_family='engine oil', low_stock_litres=1000)
+        self.save_rule(material='1001', low_stock_litres=10)
+        self.save_rule(material='1002', expiry_days=30)
+
+        # 1001 by material, 1002 by family, 1003 by location, 1004 by default
+        self.assertEqual(
+            self.materials('/inventory/below_threshold'), [1002, 1003, 1004]
+        )
+        # 1002 takes its expiry window from its material rule
+        self.assertEqual(self.materials('/inventory/expiring_soon'), [1004])
+
+        # The write paths resolve the same thresholds as the SQL join
+        with app.app_context():
+            statement, low_stock_litres, expiry_days = with_thresholds(
+                select(Inventory.id)
+            )
+            resolved = {
+                inventory_id: (Decimal(str(litres)), days)
+                for inventory_id, litres, days in db.session.execute(
+                    statement.add_columns(low_stock_litres, expiry_days)
+                )
+            }
+            for item in Inventory.query:
+                state = item_state(item)
+                self.assertEqual(
+                    resolved[item.id], (state.low_stock_litres, state.expiry_days)
+                )
+
+    def test_rule_changes_update_counters_and_alerts(self):
+        self.assertEqual(self.app.get('/dashboard/summary').get_json()['low_stock'], 2)
+        self.assertEqual(
+            self.active_alerts(),
+            [(1001, 'low_stock'), (1004, 'expiry'), (1004, 'low_stock')],
+        )
+
+        rule = self.save_rule(location='Kano', low_stock_litres=1000, expiry_days=7)
+        self.assertEqual(self.app.get('/dashboard/summary').get_json()['low_stock'], 3)
+        self.assertEqual(
+            self.active_alerts(),
+            [(1001, 'low_stock'), (1002, 'low_stock'), (1004, 'low_stock')],
+        )
+
+        # Writes use the new thresholds straight away
+        self.app.post('/take_inventory/batch', json={
+            'lines': [{'material': '1002', 'quantity': 10}]
+        })
+        self.assertEqual(self.app.get('/dashboard/summary').get_json()['low_stock'], 3)
+
+        response = self.app.delete(f"/thresholds/{rule['id']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.app.get('/dashboard/summary').get_json()['low_stock'], 2)
+        self.assertEqual(
+            self.active_alerts(),
+            [(1001, 'low_stock'), (1004, 'expiry'), (1004, 'low_stock')],
+        )
+
+    def test_rules_cached_before_a_change_are_not_used(self):
+        # Another worker cached the rules before the change...
+        with app.app_context():
+            version, stale = rules_version(), current_rules()
+        self.save_rule(low_stock_litres=20)
+        # ...and still holds them when it serves a take
+        rule_cache.set(version, stale)
+        # 1001 drops from 40 to 15 litres, below the new 20 litre threshold
+        self.app.post('/take_inventory', data={'material': '1001', 'quantity': '25'})
+        self.assertEqual(self.app.get('/dashboard/summary').get_json()['low_stock'], 1)
+        with app.app_context():
+            rebuild_counters()
+            self.assertEqual(dashboard_summary()['low_stock'], 1)
+
+    def test_rules_are_saved_per_scope(self):
+        first = self.save_rule(location='Lagos', low_stock_litres=100)
+        second = self.save_rule(location='Lagos', low_stock_litres=200)
+        self.assertEqual(first['id'], second['id'])
+        rules = self.app.get('/thresholds').get_json()['rules']
+        self.assertEqual(len(rules), 1)
+        self.assertEqual(rules[0]['low_stock_litres'], '200.00')
+
+    def test_only_admins_change_rules(self):
+        rule = self.app.post('/thresholds', json={'low_stock_litres': 100}).get_json()
+        with app.app_context():
+            user = User(username='staffuser', email='staffuser@example.com', role='staff')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+        self.app.get('/logout')
+        self.app.post('/login', data={'username': 'staffuser', 'password': 'password123'})
+        self.assertEqual(self.app.post('/thresholds', json={'low_stock_litres': 5}).status_code, 403)
+        self.assertEqual(self.app.delete(f"/thresholds/{rule['id']}").status_code, 403)
+        response = self.app.get('/thresholds')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(rule['id'], [item['id'] for item in response.get_json()['rules']])
+
+    def test_invalid_rules(self):
+        for rule in (
+            {'location': 'Lagos'},
+            {'material': 'ABC', 'low_stock_litres': 10},
+            {'low_stock_litres': -1},
+            {'expiry_days': 'soon'},
+        ):
+            response = self.app.post('/thresholds', json=rule)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.app.delete('/thresholds/99').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,461 @@
+from collections import namedtuple
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import (
+    Date,
+    Integer,
+    and_,
+    case,
+    event,
+    func,
+    literal,
+    or_,
+    select,
+    union_all,
+    update,
+)
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import FunctionElement
+from cache import TTLCache
+from models import db, Inventory, ThresholdRule, ThresholdRuleVersion
+
+# Thresholds used when no rule sets one, not even a default rule
+LOW_STOCK_THRESHOLD = 50
+EXPIRY_WINDOW_DAYS = 90
+
+# What a rule can be scoped to, from the most to the least specific
+RULE_SCOPES = ("material", "product_family", "location")
+
+# The rules are few and needed on every write, so each process caches them,
+# keyed by the shared rules version. Each transaction reads the version once,
+# so a change made through any worker is seen by the next write everywhere.
+rule_cache = TTLCache(maxsize=1, ttl=60)
+
+Rule = namedtuple(
+    "Rule",
+    [
+        "id",
+        "material",
+        "product_family",
+        "location",
+        "low_stock_litres",
+        "expiry_days",
+    ],
+)
+Thresholds = namedtuple("Thresholds", ["low_stock_litres", "expiry_days"])
+
+
+class ThresholdRuleError(ValueError):
+    pass
+
+
+# A date plus a number of days, compiled to the date functions of each
+# database
+class add_days(FunctionElement):
+    type = Date()
+    inherit_cache = True
+
+
+@compiles(add_days)
+def compile_add_days(element, compiler, **kw):
+    day, days = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"DATE({day}, '+' || ({days}) || ' days')"
+
+
+@compiles(add_days, "mysql")
+def compile_add_days_mysql(element, compiler, **kw):
+    day, days = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"DATE_ADD({day}, INTERVAL ({days}) DAY)"
+
+
+@compiles(add_days, "postgresql")
+def compile_add_days_postgresql(element, compiler, **kw):
+    day, days = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"({day} + ({days}))"
+
+
+# Length of a string in characters on every database; MySQL's LENGTH()
+# counts bytes
+class char_length(FunctionElement):
+    type = Integer()
+    inherit_cache = True
+
+
+@compiles(char_length)
+def compile_char_length(element, compiler, **kw):
+    return f"LENGTH({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(char_length, "mysql")
+@compiles(char_length, "postgresql")
+def compile_char_length_mysql(element, compiler, **kw):
+    return f"CHAR_LENGTH({compiler.process(element.clauses, **kw)})"
+
+
+# Precedence of matching rules: material rules win over product family rules,
+# which win over location rules, which win over defaults. Among product
+# families the longest wins, then the oldest rule.
+def rule_precedence(rule):
+    return (
+        (4 if rule.material is not None else 0)
+        + (2 if rule.product_family is not None else 0)
+        + (1 if rule.location is not None else 0),
+        len(rule.product_family or ""),
+        -rule.id,
+    )
+
+
+# The same precedence as SQL ordering terms, highest first
+def precedence_order():
+    return [
+        (
+            case((ThresholdRule.material.is_not(None), 4), else_=0)
+            + case((ThresholdRule.product_family.is_not(None), 2), else_=0)
+            + case((ThresholdRule.location.is_not(None), 1), else_=0)
+        ).desc(),
+        char_length(func.coalesce(ThresholdRule.product_family, "")).desc(),
+        ThresholdRule.id,
+    ]
+
+
+def load_rules():
+    rules = [
+        Rule(
+            rule.id,
+            str(int(rule.material)) if rule.material is not None else None,
+            rule.product_family,
+            rule.location,
+            rule.low_stock_litres,
+            rule.expiry_days,
+        )
+        for rule in db.session.execute(
+            select(
+                ThresholdRule.id,
+                ThresholdRule.material,
+                ThresholdRule.product_family,
+                ThresholdRule.location,
+                ThresholdRule.low_stock_litres,
+                ThresholdRule.expiry_days,
+            )
+            # Read the latest rules, as the locked version read does
+            .with_for_update(read=True)
+        )
+    ]
+    return sorted(rules, key=rule_precedence, reverse=True)
+
+
+# Version of the threshold rules, read once per transaction. It is locked
+# shared, so a rule change waits for the writes that resolved thresholds
+# under the old rules, and writes after it see the new version.
+def rules_version():
+    version = db.session.info.get("threshold_rules_version")
+    if version is None:
+        version = db.session.scalar(
+            select(ThresholdRuleVersion.version)
+            .where(ThresholdRuleVersion.id == 1)
+            .with_for_update(read=True)
+        )
+        version = db.session.info["threshold_rules_version"] = version or 0
+    return version
+
+
+@event.listens_for(Session, "after_transaction_end")
+def forget_rules_version(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("threshold_rules_version", None)
+
+
+# Every rule, most specific first, for the write paths
+def current_rules():
+    return rule_cache.get_or_load(rules_version(), load_rules)
+
+
+# Move the rules version on in the caller's transaction, after changing a rule
+def bump_rules_version():
+    db.session.execute(
+        update(ThresholdRuleVersion)
+        .where(ThresholdRuleVersion.id == 1)
+        .values(version=ThresholdRuleVersion.version + 1)
+    )
+
+
+def invalidate_rules():
+    rule_cache.clear()
+
+
+def rule_matches(rule, material, product_name, location):
+    return (
+        (rule.material is None or rule.material == material)
+        and (
+            rule.product_family is None
+            or product_name.lower().startswith(rule.product_family.lower())
+        )
+        and (rule.location is None or rule.location == location)
+    )
+
+
+# Thresholds of one item from the cached rules, for the write paths. Resolves
+# the same way as item_thresholds() does in SQL.
+def thresholds_for(material, product_name, location):
+    low_stock_litres = expiry_days = None
+    for rule in current_rules():
+        if not rule_matches(rule, material, product_name, location):
+            continue
+        if low_stock_litres is None:
+            low_stock_litres = rule.low_stock_litres
+        if expiry_days is None:
+            expiry_days = rule.expiry_days
+    return Thresholds(
+        Decimal(LOW_STOCK_THRESHOLD) if low_stock_litres is None else low_stock_litres,
+        EXPIRY_WINDOW_DAYS if expiry_days is None else expiry_days,
+    )
+
+
+# Thresholds of every item matched by a rule, resolved in one query: each
+# item is joined to its matching rules, which are ranked by precedence for
+# each threshold, skipping rules that leave it unset. Criteria on Inventory
+# limit the items resolved.
+def item_thresholds(*criteria):
+    matches = and_(
+        or_(
+            ThresholdRule.material.is_(None),
+            ThresholdRule.material == Inventory.material,
+        ),
+        or_(
+            ThresholdRule.product_family.is_(None),
+            func.lower(
+                func.substr(
+                    Inventory.product_name, 1, char_length(ThresholdRule.product_family)
+                )
+            )
+            == func.lower(ThresholdRule.product_family),
+        ),
+        or_(
+            ThresholdRule.location.is_(None),
+            ThresholdRule.location == Inventory.location,
+        ),
+    )
+    order = precedence_order()
+    ranked = (
+        select(
+            Inventory.id.label("inventory_id"),
+            ThresholdRule.low_stock_litres,
+            ThresholdRule.expiry_days,
+            func.row_number()
+            .over(
+                partition_by=Inventory.id,
+                order_by=[ThresholdRule.low_stock_litres.is_(None), *order],
+            )
+            .label("low_stock_rank"),
+            func.row_number()
+            .over(
+                partition_by=Inventory.id,
+                order_by=[ThresholdRule.expiry_days.is_(None), *order],
+            )
+            .label("expiry_rank"),
+        )
+        .join_from(Inventory, ThresholdRule, matches)
+        .where(*criteria)
+        .subquery()
+    )
+    return (
+        select(
+            ranked.c.inventory_id,
+            func.max(
+                case((ranked.c.low_stock_rank == 1, ranked.c.low_stock_litres))
+            ).label("low_stock_litres"),
+            func.max(case((ranked.c.expiry_rank == 1, ranked.c.expiry_days))).label(
+                "expiry_days"
+            ),
+        )
+        .group_by(ranked.c.inventory_id)
+        .subquery()
+    )
+
+
+# Join each item's thresholds to a statement selecting from Inventory.
+# Criteria on Inventory restrict both the statement and the items the rules
+# are resolved for. Returns the statement and the low stock and expiry
+# threshold columns.
+def with_thresholds(statement, *criteria):
+    thresholds = item_thresholds(*criteria)
+    return (
+        statement.outerjoin(
+            thresholds, thresholds.c.inventory_id == Inventory.id
+        ).where(*criteria),
+        func.coalesce(thresholds.c.low_stock_litres, LOW_STOCK_THRESHOLD),
+        func.coalesce(thresholds.c.expiry_days, EXPIRY_WINDOW_DAYS),
+    )
+
+
+# Restrict a statement selecting from Inventory to items at or below their
+# low stock threshold
+def low_stock_filter(statement):
+    statement, low_stock_litres, _ = with_thresholds(
+        # Bounds the scan of the total litres index
+        statement,
+        Inventory.total_litres <= low_stock_ceiling(),
+    )
+    return statement.where(Inventory.total_litres <= low_stock_litres)
+
+
+# Restrict a statement selecting from Inventory to items inside their
+# expiring soon window
+def expiring_filter(statement, today=None):
+    today = today or date.today()
+    statement, _, expiry_days = with_thresholds(
+        # Bounds the scan of the best before date index
+        statement,
+        Inventory.best_before_date <= expiry_cutoff(today),
+    )
+    return statement.where(
+        Inventory.best_before_date <= add_days(literal(today, Date()), expiry_days)
+    )
+
+
+# Highest value a rule sets for a threshold, or the fallback if higher, as
+# a scalar subquery
+def highest_threshold(column, fallback):
+    values = union_all(
+        select(column.label("value")),
+        select(literal(fallback, column.type).label("value")),
+    ).subquery()
+    return select(func.max(values.c.value)).scalar_subquery()
+
+
+# Highest low stock threshold of any item
+def low_stock_ceiling():
+    return highest_threshold(
+        ThresholdRule.low_stock_litres, Decimal(LOW_STOCK_THRESHOLD)
+    )
+
+
+# Last best before date inside any item's expiring soon window
+def expiry_cutoff(today=None):
+    return add_days(
+        literal(today or date.today(), Date()),
+        highest_threshold(ThresholdRule.expiry_days, EXPIRY_WINDOW_DAYS),
+    )
+
+
+# Item states carry the thresholds resolved for the item
+def is_low_stock(state):
+    return state.total_litres <= state.low_stock_litres
+
+
+# Item states hold the date as YYYY-MM-DD text
+def is_expiring(state, today=None):
+    cutoff = (today or date.today()) + timedelta(days=state.expiry_days)
+    return state.best_before_date <= cutoff.isoformat()
+
+
+# Whether a change moved an item into ("raised") or out of ("cleared") a
+# state, given whether the item was in it before and after; None means the
+# item did not exist
+def transition(was_in, is_in):
+    if is_in and not was_in:
+        return "raised"
+    if was_in and not is_in:
+        return "cleared"
+    return None
+
+
+# Low stock transition of an item between two states
+def low_stock_transition(before, after):
+    return transition(
+        before is not None and is_low_stock(before),
+        after is not None and is_low_stock(after),
+    )
+
+
+# Expiring soon transition of an item between two states
+def expiry_transition(before, after, today=None):
+    return transition(
+        before is not None and is_expiring(before, today),
+        after is not None and is_expiring(after, today),
+    )
+
+
+# Validate a threshold rule from a JSON body
+def parse_rule(data):
+    if not isinstance(data, dict):
+        raise ThresholdRuleError("Send the rule as a JSON object")
+    values = {}
+    for scope in RULE_SCOPES:
+        value = data.get(scope)
+        value = str(value).strip() if value is not None else ""
+        if len(value) > 255:
+            raise ThresholdRuleError(f"{scope} is too long")
+        values[scope] = value or None
+    if values["material"] is not None:
+        if not values["material"].isdigit() or len(values["material"]) > 15:
+            raise ThresholdRuleError(
+                "material must be a whole number of at most 15 digits"
+            )
+        values["material"] = Decimal(values["material"])
+
+    try:
+        low_stock_litres = data.get("low_stock_litres")
+        if low_stock_litres is not None:
+            low_stock_litres = Decimal(str(low_stock_litres))
+            if not low_stock_litres.is_finite() or not 0 <= low_stock_litres < 10**8:
+                raise InvalidOperation
+    except InvalidOperation:
+        raise ThresholdRuleError("low_stock_litres must be a number of litres")
+    expiry_days = data.get("expiry_days")
+    if expiry_days is not None and (
+        not isinstance(expiry_days, int)
+        or isinstance(expiry_days, bool)
+        or not 0 <= expiry_days <= 3650
+    ):
+        raise ThresholdRuleError("expiry_days must be a whole number of days")
+    if low_stock_litres is None and expiry_days is None:
+        raise ThresholdRuleError("Set low_stock_litres, expiry_days or both")
+    values["low_stock_litres"] = low_stock_litres
+    values["expiry_days"] = expiry_days
+    return values
+
+
+# Create the rule for a scope, or replace the thresholds of the existing one.
+# The caller commits.
+def save_rule(data):
+    values = parse_rule(data)
+    rule = db.session.scalar(
+        select(ThresholdRule).where(
+            *(
+                (
+                    getattr(ThresholdRule, scope).is_(None)
+                    if values[scope] is None
+                    else getattr(ThresholdRule, scope) == values[scope]
+                )
+                for scope in RULE_SCOPES
+            )
+        )
+    )
+    if rule is None:
+        rule = ThresholdRule()
+        db.session.add(rule)
+    for name, value in values.items():
+        setattr(rule, name, value)
+    bump_rules_version()
+    return rule
+
+
+# Delete a rule. The caller commits.
+def delete_rule(rule):
+    db.session.delete(rule)
+    bump_rules_version()
+
+
+def rule_json(rule):
+    return {
+        "id": rule.id,
+        "material": str(int(rule.material)) if rule.material is not None else None,
+        "product_family": rule.product_family,
+        "location": rule.location,
+        "low_stock_litres": (
+            str(rule.low_stock_litres) if rule.low_stock_litres is not None else None
+        ),
+        "expiry_days": rule.expiry_days,
+    }